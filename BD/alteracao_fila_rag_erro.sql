@@ -0,0 +1,12 @@
+-- Migração para bases criadas antes da separação de itens com erro
+ALTER TABLE fila_rag ADD COLUMN IF NOT EXISTS data_hora_erro timestamp;
+ALTER TABLE fila_rag ADD COLUMN IF NOT EXISTS erro text;
+
+    COMMENT ON COLUMN fila_rag.data_hora_erro IS 'Preenchida quando o item é separado da fila (ex.: extração excedeu o prazo); limpar para reprocessar';
+    COMMENT ON COLUMN fila_rag.erro IS 'Motivo da separação do item';
+
+DROP INDEX IF EXISTS idx_fila_rag_pendentes;
+CREATE INDEX idx_fila_rag_pendentes
+    ON public.fila_rag USING btree
+    (data_hora ASC)
+    WHERE data_hora_processamento IS NULL AND data_hora_erro IS NULL;
@@ -0,0 +1,5 @@
+-- Migração para bases criadas antes da ordem dos itens de um mesmo documento na reserva
+CREATE INDEX IF NOT EXISTS idx_fila_rag_pendentes_documento
+    ON public.fila_rag USING btree
+    (referencia, documento, data_hora)
+    WHERE data_hora_processamento IS NULL AND data_hora_erro IS NULL;
@@ -0,0 +1,11 @@
+-- Migração para bases criadas antes da reserva de itens por worker
+ALTER TABLE fila_rag ADD COLUMN IF NOT EXISTS reservado_por varchar(200);
+ALTER TABLE fila_rag ADD COLUMN IF NOT EXISTS reservado_ate timestamp;
+
+    COMMENT ON COLUMN fila_rag.reservado_por IS 'Identificador do worker que reservou o item';
+    COMMENT ON COLUMN fila_rag.reservado_ate IS 'Fim da reserva; após essa data o item pode ser reservado por outro worker';
+
+CREATE INDEX IF NOT EXISTS idx_fila_rag_pendentes
+    ON public.fila_rag USING btree
+    (data_hora ASC)
+    WHERE data_hora_processamento IS NULL;
@@ -0,0 +1,4 @@
+-- Migração para bases criadas antes do limite de tentativas por item
+ALTER TABLE fila_rag ADD COLUMN IF NOT EXISTS tentativas integer NOT NULL DEFAULT 0;
+
+    COMMENT ON COLUMN fila_rag.tentativas IS 'Quantidade de reservas do item; ao atingir FILA_MAX_TENTATIVAS sem conclusão, o item é separado';
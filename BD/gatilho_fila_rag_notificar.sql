@@ -0,0 +1,13 @@
+-- Notifica os workers assim que um item entra na fila.
+-- O canal é o argumento do gatilho e deve coincidir com FILA_CANAL do processador
+CREATE OR REPLACE FUNCTION fila_rag_notificar() RETURNS trigger AS $$
+BEGIN
+    PERFORM pg_notify(COALESCE(TG_ARGV[0], 'fila_rag'), NEW.id::text);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_fila_rag_notificar ON fila_rag;
+CREATE TRIGGER trg_fila_rag_notificar
+    AFTER INSERT ON fila_rag
+    FOR EACH ROW EXECUTE FUNCTION fila_rag_notificar('fila_rag');
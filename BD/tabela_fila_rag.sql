@@ -6,13 +6,40 @@ CREATE TABLE fila_rag (
     tipo char(1),
     acao char(1), 
     conteudo text, 
-    data_hora_processamento timestamp);
+    data_hora_processamento timestamp,
+    reservado_por varchar(200),
+    reservado_ate timestamp,
+    data_hora_erro timestamp,
+    erro text,
+    tentativas integer NOT NULL DEFAULT 0);
 
     COMMENT ON COLUMN fila_rag.tipo IS 'B - Binário, E - Estruturado';
     COMMENT ON COLUMN fila_rag.acao IS 'I - Inclusão, E - Exclusão';
-    COMMENT ON COLUMN fila_rag.conteudo IS 'Caso tipo = B, o conteúdo deve ser um JSON contendo Hash e bucket';
+    COMMENT ON COLUMN fila_rag.conteudo IS 'Caso tipo = B, o conteúdo deve ser um JSON contendo Hash e bucket. Caso acao = E, pode conter o JSON {"id_fila": N} do item a remover; vazio, remove o documento da referência ou, sem documento, toda a referência; qualquer outro conteúdo separa o item com erro';
+    COMMENT ON COLUMN fila_rag.reservado_por IS 'Identificador do worker que reservou o item';
+    COMMENT ON COLUMN fila_rag.reservado_ate IS 'Fim da reserva; após essa data o item pode ser reservado por outro worker';
+    COMMENT ON COLUMN fila_rag.data_hora_erro IS 'Preenchida quando o item é separado da fila (ex.: extração excedeu o prazo); limpar para reprocessar';
+    COMMENT ON COLUMN fila_rag.erro IS 'Motivo da separação do item';
+    COMMENT ON COLUMN fila_rag.tentativas IS 'Quantidade de reservas do item; ao atingir FILA_MAX_TENTATIVAS sem conclusão, o item é separado';
 
 
 CREATE INDEX idx_data_hora_processamento
     ON public.fila_rag USING btree
-    (data_hora_processamento ASC NULLS FIRST);
\ No newline at end of file
+    (data_hora_processamento ASC NULLS FIRST);
+
+CREATE INDEX idx_fila_rag_pendentes
+    ON public.fila_rag USING btree
+    (data_hora ASC)
+    WHERE data_hora_processamento IS NULL AND data_hora_erro IS NULL;
+
+-- Ordem dos itens de um mesmo documento na reserva
+CREATE INDEX idx_fila_rag_pendentes_documento
+    ON public.fila_rag USING btree
+    (referencia, documento, data_hora)
+    WHERE data_hora_processamento IS NULL AND data_hora_erro IS NULL;
+
+
+-- Gatilho de NOTIFY a cada inserção, definido em um único script; o canal é o
+-- argumento do gatilho e deve coincidir com FILA_CANAL. Executar pelo psql, ou
+-- aplicar gatilho_fila_rag_notificar.sql logo após este script
+\ir gatilho_fila_rag_notificar.sql
@@ -0,0 +1,381 @@
+import os
+import re
+import math
+import time
+import heapq
+import random
+import asyncio
+import logging
+import itertools
+import threading
+import openai
+import metricas
+
+# Configuração do logger
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Prioridades das chamadas: menor valor é atendido primeiro
+PRIORIDADE_CONSULTA = 0
+PRIORIDADE_INGESTAO = 1
+NOMES_PRIORIDADE = {PRIORIDADE_CONSULTA: "consulta", PRIORIDADE_INGESTAO: "ingestao"}
+
+# Durações dos cabeçalhos x-ratelimit-reset-* ("1s", "6m0s", "20ms")
+DURACAO = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+UNIDADES = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+def duracao_segundos(texto):
+    if not texto:
+        return None
+    partes = DURACAO.findall(texto)
+    if not partes:
+        try:
+            return float(texto)
+        except ValueError:
+            return None
+    return sum(float(valor) * UNIDADES[unidade] for valor, unidade in partes)
+
+class _Orcamento:
+    """
+    Orçamento de requisições ou de tokens da OpenAI, a partir dos cabeçalhos
+    x-ratelimit-limit-*, x-ratelimit-remaining-* e x-ratelimit-reset-*. Entre
+    duas respostas, o restante é recomposto linearmente até o limite no prazo
+    informado e descontado das chamadas liberadas localmente.
+    """
+
+    def __init__(self):
+        self.limite = None
+        self.restante = 0
+        self.taxa = 0.0
+        self.momento = 0.0
+        self.consumido = 0
+
+    def atualizar(self, limite, restante, reset, agora):
+        self.limite = limite
+        self.restante = restante
+        # Unidades recompostas por segundo; sem prazo informado, limites por minuto
+        self.taxa = (limite - restante) / reset if reset and restante < limite else limite / 60
+        self.momento = agora
+        self.consumido = 0
+
+    def disponivel(self, agora):
+        if self.limite is None:
+            return math.inf
+        return min(self.limite, self.restante + self.taxa * (agora - self.momento)) - self.consumido
+
+    def espera(self, quantidade, reserva, agora):
+        """
+        Segundos até haver quantidade disponível além da fração reservada do limite.
+        """
+        if self.limite is None:
+            return 0.0
+        # Uma chamada maior que o limite aguarda apenas o orçamento completo
+        necessario = min(self.limite, quantidade + reserva * self.limite)
+        falta = necessario - self.disponivel(agora)
+        if falta <= 0:
+            return 0.0
+        return falta / self.taxa if self.taxa else math.inf
+
+class _Espera:
+    __slots__ = ("prioridade", "tokens", "liberar", "admitida", "inicio")
+
+    def __init__(self, prioridade, tokens, liberar):
+        self.prioridade = prioridade
+        self.tokens = tokens
+        self.liberar = liberar
+        self.admitida = False
+        self.inicio = time.monotonic()
+
+class AgendadorOpenAI:
+    """
+    Agenda as chamadas de embedding e de chat à OpenAI de um processo,
+    respeitando os limites de requisições e de tokens por minuto.
+
+    As chamadas aguardam em uma fila por prioridade: consultas da API passam à
+    frente da ingestão, e a ingestão só é liberada enquanto sobrar, além da
+    chamada, OPENAI_RESERVA_CONSULTAS do limite informado pela OpenAI. Como o
+    limite é da organização, essa reserva também protege as consultas da API
+    quando a ingestão roda em outro processo.
+
+    A quantidade de chamadas simultâneas se ajusta por AIMD: cresce aos poucos
+    a cada sucesso e cai pela metade a cada resposta 429, que também suspende
+    as liberações pelo prazo de Retry-After. Erros transitórios (429, 5xx,
+    conexão e timeout) são repetidos com espera exponencial com jitter, até
+    OPENAI_MAX_TENTATIVAS.
+
+    Os clientes da OpenAI devem ser criados com max_retries=0 e com os
+    ganchos de ganchos_http() (ou aganchos_http()) no cliente httpx, que
+    repassam os cabeçalhos de limite ao agendador.
+    """
+
+    def __init__(self):
+        self.concorrencia_max = int(os.getenv("OPENAI_CONCORRENCIA_MAX", 16))
+        self.concorrencia = float(min(self.concorrencia_max, int(os.getenv("OPENAI_CONCORRENCIA_INICIAL", 4))))
+        self.reserva_consultas = float(os.getenv("OPENAI_RESERVA_CONSULTAS", 0.2))
+        self.max_tentativas = int(os.getenv("OPENAI_MAX_TENTATIVAS", 6))
+        self.espera_base = float(os.getenv("OPENAI_ESPERA_BASE_SEGUNDOS", 1))
+        self.espera_max = float(os.getenv("OPENAI_ESPERA_MAX_SEGUNDOS", 60))
+        # Tokens de resposta estimados para uma chamada de chat, contados no orçamento
+        self.tokens_resposta = int(os.getenv("OPENAI_TOKENS_RESPOSTA", 500))
+
+        self._lock = threading.Lock()
+        self._fila = []  # heap de (prioridade, sequência, espera)
+        self._sequencia = itertools.count()
+        self._em_andamento = 0
+        self._pausa_ate = 0.0
+        self._requisicoes = _Orcamento()
+        self._tokens = _Orcamento()
+        self._temporizador = None
+        metricas.OPENAI_CONCORRENCIA.set(self.concorrencia)
+
+    # Cabeçalhos de limite
+
+    def registrar_cabecalhos(self, cabecalhos):
+        """
+        Atualiza os orçamentos com os cabeçalhos x-ratelimit-* de uma resposta.
+        """
+        agora = time.monotonic()
+        with self._lock:
+            for orcamento, sufixo in ((self._requisicoes, "requests"), (self._tokens, "tokens")):
+                limite = cabecalhos.get(f"x-ratelimit-limit-{sufixo}")
+                restante = cabecalhos.get(f"x-ratelimit-remaining-{sufixo}")
+                if not limite or restante is None:
+                    continue
+                try:
+                    orcamento.atualizar(
+                        int(limite), int(restante),
+                        duracao_segundos(cabecalhos.get(f"x-ratelimit-reset-{sufixo}")), agora
+                    )
+                except ValueError:
+                    continue
+                metricas.OPENAI_ORCAMENTO_RESTANTE.labels(sufixo).set(int(restante))
+            self._despertar()
+
+    def ganchos_http(self):
+        return {"response": [lambda resposta: self.registrar_cabecalhos(resposta.headers)]}
+
+    def aganchos_http(self):
+        async def registrar(resposta):
+            self.registrar_cabecalhos(resposta.headers)
+        return {"response": [registrar]}
+
+    # Execução
+
+    def executar(self, funcao, tokens=0, prioridade=PRIORIDADE_INGESTAO):
+        """
+        Executa a chamada quando houver vaga e orçamento, repetindo-a em erros
+        transitórios.
+
+        :param funcao: Função sem argumentos que faz uma chamada à OpenAI.
+        :param tokens: Tokens estimados da chamada (entrada e resposta).
+        :param prioridade: PRIORIDADE_CONSULTA ou PRIORIDADE_INGESTAO.
+        :return: O retorno de funcao.
+        """
+        tentativa = 0
+        while True:
+            self._adquirir(prioridade, tokens)
+            try:
+                resultado = funcao()
+            except Exception as e:
+                atraso = self._falhar(e, tentativa)
+                if atraso is None:
+                    raise
+                tentativa += 1
+                time.sleep(atraso)
+                continue
+            self._liberar(sucesso=True)
+            return resultado
+
+    async def aexecutar(self, fabrica, tokens=0, prioridade=PRIORIDADE_CONSULTA):
+        """
+        Versão assíncrona de executar.
+
+        :param fabrica: Função sem argumentos que retorna a corrotina da chamada
+                        (uma nova a cada tentativa).
+        """
+        tentativa = 0
+        while True:
+            await self._aadquirir(prioridade, tokens)
+            try:
+                resultado = await fabrica()
+            except asyncio.CancelledError:
+                self._liberar(sucesso=False)
+                raise
+            except Exception as e:
+                atraso = self._falhar(e, tentativa)
+                if atraso is None:
+                    raise
+                tentativa += 1
+                await asyncio.sleep(atraso)
+                continue
+            self._liberar(sucesso=True)
+            return resultado
+
+    async def aexecutar_stream(self, fabrica, tokens=0, prioridade=PRIORIDADE_CONSULTA):
+        """
+        Repassa os itens de uma chamada em streaming, ocupando a vaga até o fim.
+        A chamada só é repetida se falhar antes do primeiro item.
+
+        :param fabrica: Função sem argumentos que retorna o iterador assíncrono da chamada.
+        """
+        tentativa = 0
+        while True:
+            await self._aadquirir(prioridade, tokens)
+            emitiu = False
+            liberada = False
+            try:
+                async for item in fabrica():
+                    emitiu = True
+                    yield item
+            except Exception as e:
+                liberada = True
+                atraso = self._falhar(e, tentativa)
+                if atraso is None or emitiu:
+                    raise
+            else:
+                liberada = True
+                self._liberar(sucesso=True)
+                return
+            finally:
+                # Consumidor interrompido (cliente desconectado): apenas libera a vaga
+                if not liberada:
+                    self._liberar(sucesso=False)
+            tentativa += 1
+            await asyncio.sleep(atraso)
+
+    # Fila
+
+    def _adquirir(self, prioridade, tokens):
+        evento = threading.Event()
+        espera = self._entrar(prioridade, tokens, evento.set)
+        evento.wait()
+        self._registrar_espera(espera)
+
+    async def _aadquirir(self, prioridade, tokens):
+        loop = asyncio.get_running_loop()
+        evento = asyncio.Event()
+        espera = self._entrar(prioridade, tokens, lambda: loop.call_soon_threadsafe(evento.set))
+        try:
+            await evento.wait()
+        except asyncio.CancelledError:
+            with self._lock:
+                if espera.admitida:
+                    self._em_andamento -= 1
+                else:
+                    self._fila = [entrada for entrada in self._fila if entrada[2] is not espera]
+                    heapq.heapify(self._fila)
+                self._despertar()
+            raise
+        self._registrar_espera(espera)
+
+    def _entrar(self, prioridade, tokens, liberar):
+        espera = _Espera(prioridade, tokens, liberar)
+        with self._lock:
+            heapq.heappush(self._fila, (prioridade, next(self._sequencia), espera))
+            self._despertar()
+        return espera
+
+    @staticmethod
+    def _registrar_espera(espera):
+        metricas.OPENAI_ESPERA_SEGUNDOS.labels(NOMES_PRIORIDADE.get(espera.prioridade, str(espera.prioridade))).observe(
+            time.monotonic() - espera.inicio
+        )
+
+    def _atraso(self, espera, agora):
+        """
+        Segundos até a chamada poder ser liberada; infinito enquanto todas as
+        vagas estiverem ocupadas (a próxima liberação reavalia a fila).
+        """
+        if self._em_andamento >= int(self.concorrencia):
+            return math.inf
+        if self._pausa_ate > agora:
+            return self._pausa_ate - agora
+        reserva = self.reserva_consultas if espera.prioridade > PRIORIDADE_CONSULTA else 0.0
+        return max(self._requisicoes.espera(1, reserva, agora), self._tokens.espera(espera.tokens, reserva, agora))
+
+    def _despertar(self):
+        # Chamado com o lock: libera, em ordem de prioridade, as chamadas que cabem
+        agora = time.monotonic()
+        while self._fila:
+            espera = self._fila[0][2]
+            atraso = self._atraso(espera, agora)
+            if atraso > 0:
+                if atraso != math.inf:
+                    self._agendar_despertar(atraso)
+                return
+            heapq.heappop(self._fila)
+            self._em_andamento += 1
+            self._requisicoes.consumido += 1
+            self._tokens.consumido += espera.tokens
+            espera.admitida = True
+            espera.liberar()
+
+    def _agendar_despertar(self, atraso):
+        if self._temporizador is not None:
+            self._temporizador.cancel()
+        self._temporizador = threading.Timer(min(max(atraso, 0.01), 5.0), self._despertar_agendado)
+        self._temporizador.daemon = True
+        self._temporizador.start()
+
+    def _despertar_agendado(self):
+        with self._lock:
+            self._despertar()
+
+    def _liberar(self, sucesso):
+        with self._lock:
+            self._em_andamento -= 1
+            if sucesso:
+                # Aumento aditivo: cerca de uma vaga a mais por janela de chamadas bem-sucedidas
+                self.concorrencia = min(self.concorrencia_max, self.concorrencia + 1 / self.concorrencia)
+                metricas.OPENAI_CONCORRENCIA.set(self.concorrencia)
+            self._despertar()
+
+    def _falhar(self, erro, tentativa):
+        """
+        Libera a vaga de uma chamada que falhou e decide se ela será repetida.
+
+        :return: Segundos a aguardar antes de repetir, ou None se o erro não é
+                 transitório ou as tentativas se esgotaram.
+        """
+        limitada = isinstance(erro, openai.RateLimitError) and getattr(erro, "code", None) != "insufficient_quota"
+        transitoria = limitada or isinstance(erro, (openai.APIConnectionError, openai.InternalServerError))
+        atraso = random.uniform(0, min(self.espera_max, self.espera_base * 2 ** tentativa))
+
+        with self._lock:
+            self._em_andamento -= 1
+            if limitada:
+                # Redução multiplicativa e pausa de todas as liberações até o prazo informado
+                self.concorrencia = max(1.0, self.concorrencia / 2)
+                metricas.OPENAI_CONCORRENCIA.set(self.concorrencia)
+                pausa = self._retry_after(erro)
+                self._pausa_ate = max(self._pausa_ate, time.monotonic() + (pausa if pausa is not None else atraso))
+            self._despertar()
+
+        if not transitoria:
+            metricas.OPENAI_FALHAS.labels("definitiva").inc()
+            return None
+        metricas.OPENAI_FALHAS.labels("limite" if limitada else "transitoria").inc()
+        if tentativa + 1 >= self.max_tentativas:
+            logger.error("Chamada à OpenAI falhou após %s tentativas: %s", tentativa + 1, erro)
+            return None
+        logger.warning(
+            "Chamada à OpenAI falhou (tentativa %s de %s), será repetida: %s",
+            tentativa + 1, self.max_tentativas, erro
+        )
+        # Limitadas voltam à fila e aguardam a pausa; as demais aguardam o backoff
+        return 0.0 if limitada else atraso
+
+    @staticmethod
+    def _retry_after(erro):
+        resposta = getattr(erro, "response", None)
+        if resposta is None:
+            return None
+        cabecalhos = resposta.headers
+        try:
+            if cabecalhos.get("retry-after-ms"):
+                return float(cabecalhos["retry-after-ms"]) / 1000
+            if cabecalhos.get("retry-after"):
+                return float(cabecalhos["retry-after"])
+        except ValueError:
+            pass
+        return None
@@ -0,0 +1,116 @@
+"""
+Teste de carga do endpoint /consultar contra servidores falsos locais.
+
+Compara o comportamento anterior (handler async chamando uma consulta
+bloqueante, que serializava as requisições no event loop) com o caminho
+assíncrono atual, em um único worker do uvicorn.
+
+Uso:
+    python -m benchmark.cargaConsulta --requisicoes 40 --concorrencia 10
+"""
+import os
+import json
+import time
+import uuid
+import asyncio
+import argparse
+import tempfile
+import statistics
+import httpx
+from benchmark.servidoresFalsos import (
+    ServidorFalso, criar_openai_falso, criar_qdrant_falso, vetor_deterministico
+)
+
+REFERENCIA = "IP 1234/2025"
+
+def configurar_ambiente(openai_falso, qdrant_falso):
+    os.environ["OPENAI_API_KEY"] = "falso"
+    os.environ["OPENAI_API_BASE"] = f"{openai_falso.url}/v1"
+    os.environ["OPENAI_BASE_URL"] = f"{openai_falso.url}/v1"
+    os.environ["QDRANT_URL"] = qdrant_falso.url
+    os.environ["EMBEDDING_CACHE_PATH"] = os.path.join(tempfile.mkdtemp(), "embeddings.sqlite")
+
+def popular_qdrant(qdrant_falso, blocos=50):
+    pontos = qdrant_falso.app.state.colecoes.setdefault("investigacao", {})
+    for i in range(blocos):
+        texto = f"Bloco {i} do inquérito com informações sobre o caso."
+        id_ponto = str(uuid.uuid4())
+        pontos[id_ponto] = {
+            "id": id_ponto,
+            "vector": vetor_deterministico(texto),
+            "payload": {
+                "page_content": texto,
+                "metadata": {"referencia": REFERENCIA, "documento": f"Documento {i % 5}", "bloco_id": i}
+            }
+        }
+
+async def disparar(url, rota, requisicoes, concorrencia):
+    semaforo = asyncio.Semaphore(concorrencia)
+    latencias = []
+
+    async def requisitar(cliente, i):
+        async with semaforo:
+            inicio = time.perf_counter()
+            resposta = await cliente.post(rota, json={
+                "referencia": REFERENCIA,
+                "pergunta": f"Pergunta {rota} {i} sobre o caso?"
+            })
+            resposta.raise_for_status()
+            latencias.append(time.perf_counter() - inicio)
+
+    async with httpx.AsyncClient(base_url=url, timeout=600) as cliente:
+        inicio = time.perf_counter()
+        await asyncio.gather(*[requisitar(cliente, i) for i in range(requisicoes)])
+        duracao = time.perf_counter() - inicio
+
+    latencias.sort()
+    return {
+        "requisicoes": requisicoes,
+        "concorrencia": concorrencia,
+        "duracao_s": round(duracao, 3),
+        "requisicoes_por_s": round(requisicoes / duracao, 2),
+        "latencia_p50_s": round(statistics.median(latencias), 3),
+        "latencia_p95_s": round(latencias[int(len(latencias) * 0.95) - 1], 3)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--requisicoes", type=int, default=40)
+    parser.add_argument("--concorrencia", type=int, default=10)
+    parser.add_argument("--latencia-embedding", type=float, default=0.05)
+    parser.add_argument("--latencia-llm", type=float, default=0.5)
+    parser.add_argument("--latencia-qdrant", type=float, default=0.01)
+    args = parser.parse_args()
+
+    openai_falso = ServidorFalso(criar_openai_falso(args.latencia_embedding, args.latencia_llm)).iniciar()
+    qdrant_falso = ServidorFalso(criar_qdrant_falso(args.latencia_qdrant)).iniciar()
+    configurar_ambiente(openai_falso, qdrant_falso)
+    popular_qdrant(qdrant_falso)
+
+    # Importado após configurar o ambiente, pois o módulo instancia o RAGQuery
+    import consultaRequest
+
+    serializacao = asyncio.Lock()
+
+    @consultaRequest.app.post("/consultar/bloqueante", include_in_schema=False)
+    async def consultar_bloqueante(request: consultaRequest.ConsultaRequest):
+        # Comportamento anterior: a chamada síncrona bloqueava o event loop, atendendo
+        # uma consulta por vez; reproduzido serializando o caminho assíncrono
+        async with serializacao:
+            resposta, cache = await consultaRequest.rag_query.aconsultar(request.pergunta, request.referencia)
+        return {"referencia": request.referencia, "resposta": resposta, "cache": cache}
+
+    api = ServidorFalso(consultaRequest.app).iniciar()
+    try:
+        resultado = {
+            "antes": asyncio.run(disparar(api.url, "/consultar/bloqueante", args.requisicoes, args.concorrencia)),
+            "depois": asyncio.run(disparar(api.url, "/consultar", args.requisicoes, args.concorrencia))
+        }
+        print(json.dumps(resultado, indent=2))
+    finally:
+        api.parar()
+        openai_falso.parar()
+        qdrant_falso.parar()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""
+Vazão (blocos/s) e pico de memória (RSS) da divisão de textos em blocos.
+
+Compara a implementação anterior (pipeline completo do pt_core_news_sm, com
+contagem de palavras) com o ContentProcessor atual (apenas sentencizer, tokens
+do modelo de embedding). Cada implementação roda em um processo próprio, para
+que o pico de RSS de uma não contamine a outra.
+
+Uso:
+    python -m benchmark.divisaoBlocos --documentos 20 --caracteres 200000
+"""
+import os
+import glob
+import json
+import time
+import argparse
+import resource
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+def montar_corpus(documentos, caracteres):
+    # Texto real dos anexos e inserts de exemplo, repetido até o tamanho pedido
+    import fitz
+    base = []
+    for caminho in sorted(glob.glob("BD/*.pdf")):
+        with fitz.open(caminho) as pdf:
+            base.append("".join(pagina.get_text() for pagina in pdf))
+    for caminho in sorted(glob.glob("BD/inserts_*.sql")):
+        with open(caminho, encoding="utf-8") as arquivo:
+            base.append(arquivo.read())
+    texto = "\n".join(base)
+    repeticoes = caracteres // len(texto) + 1
+    return [(texto * repeticoes)[:caracteres] for _ in range(documentos)]
+
+def dividir_anterior(nlp, texto, max_tokens=500):
+    # Implementação anterior do ContentProcessor.dividir_por_frases
+    doc = nlp(texto)
+    frases = [sent.text for sent in doc.sents]
+    blocos = []
+    bloco_atual = []
+    token_count = 0
+    for frase in frases:
+        num_tokens = len(frase.split())
+        if token_count + num_tokens > max_tokens:
+            blocos.append(" ".join(bloco_atual))
+            bloco_atual = []
+            token_count = 0
+        bloco_atual.append(frase)
+        token_count += num_tokens
+    if bloco_atual:
+        blocos.append(" ".join(bloco_atual))
+    return blocos
+
+def pico_rss_mb():
+    # ru_maxrss é informado em KB no Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+def executar(implementacao, textos):
+    inicio = time.perf_counter()
+    if implementacao == "anterior":
+        import spacy
+        nlp = spacy.load("pt_core_news_sm")
+        dividir = lambda lote: [dividir_anterior(nlp, texto) for texto in lote]
+    else:
+        from contentProcessor import ContentProcessor
+        processor = ContentProcessor()
+        dividir = processor.dividir_varios
+    tempo_carga = time.perf_counter() - inicio
+    rss_carregado = pico_rss_mb()
+
+    inicio = time.perf_counter()
+    try:
+        blocos = dividir(textos)
+    except Exception as e:
+        return {"implementacao": implementacao, "erro": str(e).splitlines()[0]}
+    duracao = time.perf_counter() - inicio
+
+    total = sum(len(b) for b in blocos)
+    return {
+        "implementacao": implementacao,
+        "tempo_carga_s": round(tempo_carga, 2),
+        "blocos": total,
+        "duracao_s": round(duracao, 2),
+        "blocos_por_s": round(total / duracao, 1),
+        "caracteres_por_s": round(sum(len(t) for t in textos) / duracao),
+        "rss_carregado_mb": rss_carregado,
+        "pico_rss_mb": pico_rss_mb()
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--documentos", type=int, default=20)
+    parser.add_argument("--caracteres", type=int, default=200000)
+    parser.add_argument("--implementacoes", nargs="+", default=["anterior", "atual"])
+    args = parser.parse_args()
+
+    textos = montar_corpus(args.documentos, args.caracteres)
+    resultados = []
+    for implementacao in args.implementacoes:
+        # Processo novo por implementação: o pico de RSS é medido isoladamente
+        with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+            try:
+                resultado = executor.submit(executar, implementacao, textos).result()
+            except Exception as e:
+                resultado = {"implementacao": implementacao, "erro": str(e).splitlines()[0]}
+        resultados.append(resultado)
+        print(json.dumps(resultado), flush=True)
+
+    print(json.dumps({
+        "documentos": args.documentos,
+        "caracteres_por_documento": args.caracteres,
+        "resultados": resultados
+    }, indent=2))
+
+if __name__ == "__main__":
+    main()
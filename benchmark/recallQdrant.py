@@ -0,0 +1,134 @@
+"""
+Relatório de recall e latência da busca filtrada no Qdrant para diferentes
+configurações de HNSW (m, ef) e quantização int8.
+
+Requer um Qdrant em execução (QDRANT_URL); cria collections temporárias e as
+remove ao final.
+
+Uso:
+    python -m benchmark.recallQdrant --pontos 20000 --consultas 200
+"""
+import os
+import json
+import time
+import argparse
+import statistics
+import numpy as np
+from qdrant_client import QdrantClient
+from qdrant_client.http import models
+from qdrantCollection import QdrantCollection, DIMENSAO_EMBEDDING
+
+def gerar_dados(pontos, referencias, semente):
+    gerador = np.random.default_rng(semente)
+    # Vetores agrupados por referência, como blocos de um mesmo inquérito
+    centros = gerador.normal(size=(referencias, DIMENSAO_EMBEDDING))
+    rotulos = gerador.integers(0, referencias, size=pontos)
+    vetores = centros[rotulos] + gerador.normal(scale=2.0, size=(pontos, DIMENSAO_EMBEDDING))
+    vetores /= np.linalg.norm(vetores, axis=1, keepdims=True)
+    return vetores.astype(np.float32), rotulos
+
+def aguardar_indexacao(client, nome, timeout=600):
+    limite = time.time() + timeout
+    while time.time() < limite:
+        info = client.get_collection(nome)
+        if info.status == models.CollectionStatus.GREEN:
+            return
+        time.sleep(1)
+    raise TimeoutError(f"Collection {nome} não concluiu a indexação")
+
+def medir(client, colecao, consultas, verdade, k, parametros):
+    latencias = []
+    acertos = 0
+    total = sum(len(esperado) for esperado in verdade)
+    for (vetor, referencia), esperado in zip(consultas, verdade):
+        inicio = time.perf_counter()
+        pontos = client.query_points(
+            collection_name=colecao.collection_name,
+            query=vetor.tolist(),
+            query_filter=models.Filter(must=[models.FieldCondition(
+                key="metadata.referencia", match=models.MatchValue(value=f"IP {referencia}")
+            )]),
+            search_params=parametros,
+            limit=k
+        ).points
+        latencias.append(time.perf_counter() - inicio)
+        acertos += len(esperado & {p.id for p in pontos})
+    latencias.sort()
+    return {
+        "recall": round(acertos / total, 4),
+        "latencia_p50_ms": round(statistics.median(latencias) * 1000, 2),
+        "latencia_p95_ms": round(latencias[int(len(latencias) * 0.95) - 1] * 1000, 2)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--url", default=os.getenv("QDRANT_URL", "http://localhost:6333"))
+    parser.add_argument("--pontos", type=int, default=20000)
+    parser.add_argument("--referencias", type=int, default=50)
+    parser.add_argument("--consultas", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--m", type=int, nargs="+", default=[16, 32])
+    parser.add_argument("--ef", type=int, nargs="+", default=[64, 128, 256])
+    parser.add_argument("--semente", type=int, default=42)
+    args = parser.parse_args()
+
+    client = QdrantClient(location=args.url, api_key=os.getenv("QDRANT_API_KEY"))
+    vetores, rotulos = gerar_dados(args.pontos, args.referencias, args.semente)
+
+    # Consultas próximas a pontos existentes e resposta exata por força bruta
+    gerador = np.random.default_rng(args.semente + 1)
+    indices = gerador.integers(0, args.pontos, size=args.consultas)
+    consultas = []
+    verdade = []
+    for i in indices:
+        vetor = vetores[i] + gerador.normal(scale=0.02, size=DIMENSAO_EMBEDDING).astype(np.float32)
+        vetor /= np.linalg.norm(vetor)
+        referencia = int(rotulos[i])
+        candidatos = np.flatnonzero(rotulos == referencia)
+        melhores = candidatos[np.argsort(-(vetores[candidatos] @ vetor))[:args.k]]
+        consultas.append((vetor, referencia))
+        verdade.append({int(p) for p in melhores})
+
+    relatorio = []
+    for m in args.m:
+        for quantizacao in (False, True):
+            colecao = QdrantCollection(client, f"bench_recall_m{m}_{'int8' if quantizacao else 'f32'}")
+            colecao.hnsw_m = m
+            colecao.quantizacao = quantizacao
+            if client.collection_exists(colecao.collection_name):
+                client.delete_collection(colecao.collection_name)
+            try:
+                colecao.garantir()
+                # Indexa mesmo coleções pequenas para que o HNSW seja de fato usado
+                client.update_collection(
+                    collection_name=colecao.collection_name,
+                    optimizers_config=models.OptimizersConfigDiff(indexing_threshold=1000)
+                )
+                for inicio in range(0, args.pontos, 256):
+                    fim = min(inicio + 256, args.pontos)
+                    client.upsert(
+                        collection_name=colecao.collection_name,
+                        points=models.Batch(
+                            ids=list(range(inicio, fim)),
+                            vectors=vetores[inicio:fim].tolist(),
+                            payloads=[{"metadata": {"referencia": f"IP {int(r)}"}} for r in rotulos[inicio:fim]]
+                        )
+                    )
+                aguardar_indexacao(client, colecao.collection_name)
+
+                for ef in args.ef:
+                    colecao.hnsw_ef = ef
+                    resultado = medir(client, colecao, consultas, verdade, args.k, colecao.parametros_busca())
+                    relatorio.append({"m": m, "ef": ef, "quantizacao_int8": quantizacao, **resultado})
+                    print(json.dumps(relatorio[-1]), flush=True)
+
+                exato = medir(client, colecao, consultas, verdade, args.k, models.SearchParams(exact=True))
+                relatorio.append({"m": m, "ef": "exato", "quantizacao_int8": quantizacao, **exato})
+                print(json.dumps(relatorio[-1]), flush=True)
+            finally:
+                client.delete_collection(colecao.collection_name)
+
+    print(json.dumps({"pontos": args.pontos, "k": args.k, "resultados": relatorio}, indent=2))
+
+if __name__ == "__main__":
+    main()
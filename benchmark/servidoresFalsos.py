@@ -0,0 +1,515 @@
+import time
+import math
+import random
+import asyncio
+import hashlib
+import logging
+import threading
+import importlib.metadata
+import uvicorn
+import json
+import numpy as np
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+
+# Configuração do logger
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+DIMENSAO = 1536
+
+def vetor_deterministico(texto, dimensao=DIMENSAO):
+    """
+    Gera um vetor unitário determinístico a partir do texto.
+    """
+    semente = int.from_bytes(hashlib.sha256(str(texto).encode("utf-8")).digest()[:8], "big")
+    gerador = random.Random(semente)
+    vetor = [gerador.uniform(-1, 1) for _ in range(dimensao)]
+    norma = math.sqrt(sum(v * v for v in vetor)) or 1.0
+    return [v / norma for v in vetor]
+
+class LimiteTokens:
+    """
+    Balde de tokens por minuto, como o limite TPM da OpenAI, com os cabeçalhos
+    x-ratelimit-* das respostas.
+    """
+
+    def __init__(self, tokens_minuto):
+        self.limite = tokens_minuto
+        self.restante = float(tokens_minuto)
+        self.momento = time.monotonic()
+        self.recusadas = 0
+
+    def consumir(self, tokens):
+        agora = time.monotonic()
+        self.restante = min(self.limite, self.restante + (agora - self.momento) * self.limite / 60)
+        self.momento = agora
+        if tokens > self.restante:
+            self.recusadas += 1
+            return False
+        self.restante -= tokens
+        return True
+
+    def cabecalhos(self):
+        reset = (self.limite - self.restante) * 60 / self.limite
+        return {
+            "x-ratelimit-limit-tokens": str(self.limite),
+            "x-ratelimit-remaining-tokens": str(int(self.restante)),
+            "x-ratelimit-reset-tokens": f"{reset:.3f}s",
+        }
+
+    def recusa(self, tokens):
+        espera = (tokens - self.restante) * 60 / self.limite
+        return JSONResponse(
+            status_code=429,
+            headers={**self.cabecalhos(), "retry-after-ms": str(int(espera * 1000) + 1)},
+            content={"error": {
+                "message": "Rate limit reached for tokens per min (TPM)", "type": "tokens", "code": "rate_limit_exceeded"
+            }}
+        )
+
+def criar_openai_falso(latencia_embedding=0.05, latencia_chat=1.0, dimensao=DIMENSAO, tokens_minuto=None):
+    """
+    Servidor compatível com as rotas /v1/embeddings e /v1/chat/completions da
+    OpenAI, com latência configurável e respostas determinísticas. Com
+    tokens_minuto, aplica um limite de tokens por minuto e responde 429 ao
+    excedê-lo.
+    """
+    app = FastAPI()
+    app.state.chamadas = {"embeddings": 0, "chat": 0}
+    app.state.limite = LimiteTokens(tokens_minuto) if tokens_minuto else None
+
+    @app.post("/v1/embeddings")
+    async def embeddings(request: Request):
+        corpo = await request.json()
+        entradas = corpo["input"]
+        if isinstance(entradas, str) or (entradas and isinstance(entradas[0], int)):
+            entradas = [entradas]
+        tokens = sum(len(e) if isinstance(e, list) else len(str(e).split()) for e in entradas)
+        limite = app.state.limite
+        if limite and not limite.consumir(tokens):
+            return limite.recusa(tokens)
+        app.state.chamadas["embeddings"] += 1
+        await asyncio.sleep(latencia_embedding)
+        corpo_resposta = {
+            "object": "list",
+            "model": corpo.get("model", "text-embedding-ada-002"),
+            "data": [
+                {"object": "embedding", "index": i, "embedding": vetor_deterministico(e, dimensao)}
+                for i, e in enumerate(entradas)
+            ],
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens}
+        }
+        return JSONResponse(corpo_resposta, headers=limite.cabecalhos() if limite else None)
+
+    @app.post("/v1/chat/completions")
+    async def chat(request: Request):
+        corpo = await request.json()
+        pergunta = corpo["messages"][-1]["content"]
+        limite = app.state.limite
+        tokens_estimados = len(pergunta.split()) + (corpo.get("max_tokens") or 0)
+        if limite and not limite.consumir(tokens_estimados):
+            return limite.recusa(tokens_estimados)
+        app.state.chamadas["chat"] += 1
+        conteudo = f"Resposta simulada ({len(pergunta)} caracteres de prompt)."
+        if corpo.get("stream"):
+            return StreamingResponse(
+                _chat_stream(corpo, conteudo), media_type="text/event-stream",
+                headers=limite.cabecalhos() if limite else None
+            )
+        await asyncio.sleep(latencia_chat)
+        tokens_prompt = len(pergunta.split())
+        tokens_resposta = len(conteudo.split())
+        return JSONResponse({
+            "id": "chatcmpl-falso",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": corpo.get("model", "gpt-4"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": conteudo},
+                "finish_reason": "stop"
+            }],
+            "usage": {
+                "prompt_tokens": tokens_prompt,
+                "completion_tokens": tokens_resposta,
+                "total_tokens": tokens_prompt + tokens_resposta
+            }
+        }, headers=limite.cabecalhos() if limite else None)
+
+    async def _chat_stream(corpo, conteudo):
+        # O primeiro token chega após a latência inicial; o restante em intervalos curtos
+        palavras = conteudo.split(" ")
+        await asyncio.sleep(latencia_chat / 2)
+        for i, palavra in enumerate(palavras):
+            trecho = {
+                "id": "chatcmpl-falso",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": corpo.get("model", "gpt-4"),
+                "choices": [{
+                    "index": 0,
+                    "delta": {"content": palavra if i == 0 else f" {palavra}"},
+                    "finish_reason": None
+                }]
+            }
+            yield f"data: {json.dumps(trecho)}\n\n"
+            await asyncio.sleep(latencia_chat / 2 / len(palavras))
+        final = {
+            "id": "chatcmpl-falso",
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": corpo.get("model", "gpt-4"),
+            "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]
+        }
+        yield f"data: {json.dumps(final)}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return app
+
+def _valor_payload(payload, chave):
+    valor = payload
+    for parte in chave.split("."):
+        if not isinstance(valor, dict):
+            return None
+        valor = valor.get(parte)
+    return valor
+
+def _atende_condicao(ponto, condicao):
+    if "has_id" in condicao:
+        return str(ponto["id"]) in {str(i) for i in condicao["has_id"]}
+    if "key" not in condicao:
+        # Filtro aninhado
+        return _atende_filtro(ponto, condicao)
+    valor = _valor_payload(ponto["payload"], condicao["key"])
+    match = condicao.get("match") or {}
+    if "value" in match:
+        return valor == match["value"]
+    if "any" in match:
+        return valor in match["any"]
+    intervalo = condicao.get("range") or {}
+    if intervalo:
+        if valor is None:
+            return False
+        comparacoes = {
+            "gt": lambda limite: valor > limite, "gte": lambda limite: valor >= limite,
+            "lt": lambda limite: valor < limite, "lte": lambda limite: valor <= limite,
+        }
+        return all(comparacoes[operador](limite) for operador, limite in intervalo.items() if limite is not None)
+    return True
+
+def _atende_filtro(ponto, filtro):
+    if not filtro:
+        return True
+    must = filtro.get("must") or []
+    must_not = filtro.get("must_not") or []
+    should = filtro.get("should") or []
+    if not all(_atende_condicao(ponto, c) for c in must):
+        return False
+    if any(_atende_condicao(ponto, c) for c in must_not):
+        return False
+    if should and not any(_atende_condicao(ponto, c) for c in should):
+        return False
+    return True
+
+def _cosseno(a, b):
+    return float(np.dot(a, b))
+
+def _vetor_denso(vetores):
+    # Vetor sem nome, isolado ou junto de vetores nomeados
+    return vetores.get("") if isinstance(vetores, dict) else vetores
+
+def _produto_esparso(consulta, vetor, idf):
+    pesos = dict(zip(vetor.get("indices") or [], vetor.get("values") or []))
+    return sum(
+        valor * pesos[indice] * idf.get(indice, 1.0)
+        for indice, valor in zip(consulta["indices"], consulta["values"])
+        if indice in pesos
+    )
+
+def criar_qdrant_falso(latencia=0.01):
+    """
+    Servidor em memória compatível com o subconjunto da API REST do Qdrant usado
+    pelo projeto (upsert, query densa, esparsa ou híbrida com RRF, exclusão por
+    filtro ou ids).
+    """
+    app = FastAPI()
+    app.state.colecoes = {}
+    app.state.configuracoes = {}
+
+    def resposta(resultado):
+        return {"result": resultado, "status": "ok", "time": 0.0}
+
+    def pontos(colecao):
+        return app.state.colecoes.setdefault(colecao, {})
+
+    def idf_esparso(colecao, nome):
+        # IDF do BM25 sobre os pontos da collection, como o Modifier.IDF do Qdrant
+        vetores = [p["vector"].get(nome) for p in pontos(colecao).values() if isinstance(p["vector"], dict)]
+        vetores = [v for v in vetores if v]
+        documentos = {}
+        for vetor in vetores:
+            for indice in vetor["indices"]:
+                documentos[indice] = documentos.get(indice, 0) + 1
+        total = len(vetores)
+        return {indice: math.log((total - n + 0.5) / (n + 0.5) + 1) for indice, n in documentos.items()}
+
+    def buscar(colecao, consulta, usando, filtro, limite):
+        if isinstance(consulta, dict) and "nearest" in consulta:
+            consulta = consulta["nearest"]
+        selecionados = [p for p in pontos(colecao).values() if _atende_filtro(p, filtro)]
+        if isinstance(consulta, dict):
+            idf = idf_esparso(colecao, usando)
+            candidatos = [
+                (_produto_esparso(consulta, p["vector"][usando], idf), p)
+                for p in selecionados
+                if isinstance(p["vector"], dict) and p["vector"].get(usando)
+            ]
+            candidatos = [c for c in candidatos if c[0] > 0]
+        else:
+            consulta = np.asarray(consulta, dtype=np.float32)
+            candidatos = [(_cosseno(consulta, _vetor_denso(p["vector"])), p) for p in selecionados]
+        candidatos.sort(key=lambda c: c[0], reverse=True)
+        return candidatos[:limite]
+
+    def fundir_rrf(listas, limite, k=2):
+        scores = {}
+        por_id = {}
+        for candidatos in listas:
+            for posicao, (_, p) in enumerate(candidatos):
+                scores[p["id"]] = scores.get(p["id"], 0.0) + 1 / (k + posicao + 1)
+                por_id[p["id"]] = p
+        return sorted(((score, por_id[i]) for i, score in scores.items()), key=lambda c: c[0], reverse=True)[:limite]
+
+    def consultar(colecao, corpo):
+        consulta = corpo.get("query") or corpo.get("vector")
+        filtro = corpo.get("filter")
+        limite = corpo.get("limit", 10)
+        limiar = corpo.get("score_threshold")
+        if corpo.get("prefetch"):
+            listas = [
+                buscar(colecao, p.get("query"), p.get("using"), p.get("filter"), p.get("limit", 10))
+                for p in corpo["prefetch"]
+            ]
+            candidatos = fundir_rrf(listas, limite)
+        else:
+            candidatos = buscar(colecao, consulta, corpo.get("using"), filtro, len(pontos(colecao)))
+        if limiar is not None:
+            candidatos = [c for c in candidatos if c[0] >= limiar]
+        return {"points": [
+            {"id": p["id"], "version": 0, "score": score, "payload": p["payload"]}
+            for score, p in candidatos[:limite]
+        ]}
+
+    @app.get("/")
+    async def raiz():
+        # Informa a mesma versão do cliente instalado para evitar o aviso de incompatibilidade
+        return {"title": "qdrant - vector search engine", "version": importlib.metadata.version("qdrant-client")}
+
+    @app.get("/collections/{colecao}/exists")
+    async def existe(colecao: str):
+        return resposta({"exists": colecao in app.state.configuracoes})
+
+    @app.put("/collections/{colecao}")
+    async def criar(colecao: str, request: Request):
+        corpo = await request.json()
+        app.state.configuracoes[colecao] = corpo
+        pontos(colecao)
+        return resposta(True)
+
+    @app.patch("/collections/{colecao}")
+    async def atualizar(colecao: str, request: Request):
+        corpo = await request.json()
+        config = app.state.configuracoes.setdefault(colecao, {})
+        # Diferenças do vetor sem nome são aplicadas sobre os parâmetros existentes
+        diferenca_vetores = (corpo.pop("vectors", None) or {}).get("", {})
+        config.setdefault("vectors", {"size": DIMENSAO, "distance": "Cosine"}).update(diferenca_vetores)
+        config.update(corpo)
+        return resposta(True)
+
+    @app.get("/collections/{colecao}")
+    async def info(colecao: str):
+        config = app.state.configuracoes.get(colecao, {})
+        hnsw = {"m": 16, "ef_construct": 100, "full_scan_threshold": 10000}
+        hnsw.update(config.get("hnsw_config") or {})
+        quantizacao = config.get("quantization_config")
+        return resposta({
+            "status": "green",
+            "optimizer_status": "ok",
+            "segments_count": 1,
+            "points_count": len(pontos(colecao)),
+            "indexed_vectors_count": 0,
+            "config": {
+                "params": {
+                    "vectors": config.get("vectors") or {"size": DIMENSAO, "distance": "Cosine"},
+                    "sparse_vectors": config.get("sparse_vectors")
+                },
+                "hnsw_config": hnsw,
+                "optimizer_config": {
+                    "deleted_threshold": 0.2, "vacuum_min_vector_number": 1000, "default_segment_number": 0,
+                    "indexing_threshold": 20000, "flush_interval_sec": 5
+                },
+                "wal_config": {"wal_capacity_mb": 32, "wal_segments_ahead": 0},
+                "quantization_config": quantizacao if isinstance(quantizacao, dict) else None
+            },
+            "payload_schema": {}
+        })
+
+    @app.put("/collections/{colecao}/index")
+    async def indice(colecao: str):
+        return resposta({"operation_id": 0, "status": "completed"})
+
+    @app.put("/collections/{colecao}/points")
+    async def upsert(colecao: str, request: Request):
+        corpo = await request.json()
+        await asyncio.sleep(latencia)
+        for ponto in corpo["points"]:
+            # Vetores densos em numpy, para que a busca exata escale com a quantidade de pontos
+            vetores = ponto["vector"]
+            if isinstance(vetores, dict):
+                vetores = {nome: v if isinstance(v, dict) else np.asarray(v, dtype=np.float32) for nome, v in vetores.items()}
+            else:
+                vetores = np.asarray(vetores, dtype=np.float32)
+            pontos(colecao)[str(ponto["id"])] = {
+                "id": ponto["id"], "vector": vetores, "payload": ponto.get("payload") or {}
+            }
+        return resposta({"operation_id": 0, "status": "completed"})
+
+    @app.post("/collections/{colecao}/points")
+    async def recuperar(colecao: str, request: Request):
+        corpo = await request.json()
+        await asyncio.sleep(latencia)
+        armazenados = pontos(colecao)
+        return resposta([
+            {"id": armazenados[str(i)]["id"], "payload": armazenados[str(i)]["payload"]}
+            for i in corpo["ids"] if str(i) in armazenados
+        ])
+
+    @app.post("/collections/{colecao}/points/query")
+    async def query(colecao: str, request: Request):
+        corpo = await request.json()
+        await asyncio.sleep(latencia)
+        return resposta(consultar(colecao, corpo))
+
+    @app.post("/collections/{colecao}/points/query/batch")
+    async def query_lote(colecao: str, request: Request):
+        corpo = await request.json()
+        await asyncio.sleep(latencia)
+        return resposta([consultar(colecao, busca) for busca in corpo["searches"]])
+
+    @app.post("/collections/{colecao}/points/scroll")
+    async def scroll(colecao: str, request: Request):
+        corpo = await request.json()
+        await asyncio.sleep(latencia)
+        selecionados = [p for p in pontos(colecao).values() if _atende_filtro(p, corpo.get("filter"))]
+        inicio = int(corpo.get("offset") or 0)
+        limite = corpo.get("limit", 10)
+        proximo = inicio + limite if inicio + limite < len(selecionados) else None
+        return resposta({
+            "points": [
+                {"id": p["id"], "payload": p["payload"]}
+                for p in selecionados[inicio:inicio + limite]
+            ],
+            "next_page_offset": proximo
+        })
+
+    @app.post("/collections/{colecao}/points/payload")
+    async def definir_payload(colecao: str, request: Request):
+        corpo = await request.json()
+        await asyncio.sleep(latencia)
+        for id_ponto in corpo.get("points") or []:
+            ponto = pontos(colecao).get(str(id_ponto))
+            if ponto is None:
+                continue
+            destino = ponto["payload"]
+            if corpo.get("key"):
+                destino = destino.setdefault(corpo["key"], {})
+            destino.update(corpo["payload"])
+        return resposta({"operation_id": 0, "status": "completed"})
+
+    @app.post("/collections/{colecao}/points/count")
+    async def contar(colecao: str, request: Request):
+        corpo = await request.json()
+        await asyncio.sleep(latencia)
+        total = sum(1 for p in pontos(colecao).values() if _atende_filtro(p, corpo.get("filter")))
+        return resposta({"count": total})
+
+    @app.post("/collections/{colecao}/points/delete")
+    async def excluir(colecao: str, request: Request):
+        corpo = await request.json()
+        await asyncio.sleep(latencia)
+        armazenados = pontos(colecao)
+        if "points" in corpo:
+            for id_ponto in corpo["points"]:
+                armazenados.pop(str(id_ponto), None)
+        else:
+            for id_ponto in [i for i, p in armazenados.items() if _atende_filtro(p, corpo.get("filter"))]:
+                del armazenados[id_ponto]
+        return resposta({"operation_id": 0, "status": "completed"})
+
+    return app
+
+def criar_minio_falso(objetos, latencia=0.0):
+    """
+    Servidor compatível com a leitura de objetos da API S3 usada pelo projeto
+    (get_object e URLs pré-assinadas, com requisições de intervalo para o
+    ffmpeg). Não valida assinaturas.
+
+    :param objetos: Dict {(bucket, nome): bytes}.
+    """
+    app = FastAPI()
+    app.state.objetos = objetos
+    app.state.requisicoes = 0
+
+    @app.api_route("/{bucket}/{objeto:path}", methods=["GET", "HEAD"])
+    async def obter(bucket: str, objeto: str, request: Request):
+        dados = app.state.objetos.get((bucket, objeto))
+        if dados is None:
+            return Response(status_code=404, content="<Error><Code>NoSuchKey</Code></Error>", media_type="application/xml")
+        app.state.requisicoes += 1
+        await asyncio.sleep(latencia)
+
+        cabecalhos = {"Accept-Ranges": "bytes", "ETag": f'"{hashlib.md5(dados).hexdigest()}"'}
+        intervalo = request.headers.get("range")
+        status = 200
+        if intervalo and intervalo.startswith("bytes="):
+            inicio, _, fim = intervalo[len("bytes="):].partition("-")
+            inicio = int(inicio or 0)
+            fim = min(int(fim) if fim else len(dados) - 1, len(dados) - 1)
+            cabecalhos["Content-Range"] = f"bytes {inicio}-{fim}/{len(dados)}"
+            dados = dados[inicio:fim + 1]
+            status = 206
+        if request.method == "HEAD":
+            cabecalhos["Content-Length"] = str(len(dados))
+            return Response(status_code=status, headers=cabecalhos)
+        return Response(content=dados, status_code=status, headers=cabecalhos, media_type="application/octet-stream")
+
+    return app
+
+class ServidorFalso:
+    """
+    Executa uma aplicação ASGI com uvicorn em uma thread, em porta livre local.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.servidor = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=0, log_level="warning"))
+        self.thread = threading.Thread(target=self.servidor.run, daemon=True)
+
+    def iniciar(self):
+        self.thread.start()
+        while not self.servidor.started:
+            time.sleep(0.01)
+        return self
+
+    @property
+    def porta(self):
+        return self.servidor.servers[0].sockets[0].getsockname()[1]
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.porta}"
+
+    def parar(self):
+        self.servidor.should_exit = True
+        self.thread.join()
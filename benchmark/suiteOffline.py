@@ -0,0 +1,463 @@
+"""
+Benchmark reprodutível de ingestão e consulta, sem serviços externos.
+
+Reexecuta as fixtures de BD/ (inserts de texto, PDFs e o mp4), replicadas até
+N documentos, pelo FilaProcessor real contra substitutos locais: OpenAI
+(embeddings e chat determinísticos, com latência configurável), Qdrant em
+memória, MinIO servindo os arquivos de BD/ e uma fila em memória com a mesma
+semântica de reserva da fila_rag. Depois atualiza os resumos das referências e
+dispara consultas ao /consultar.
+
+O tiktoken baixa a codificação cl100k_base no primeiro uso: sem acesso à rede,
+ela precisa estar no cache apontado por TIKTOKEN_CACHE_DIR (ver o README).
+
+O resultado (JSON) traz documentos/s, tempos por etapa, latências p50/p95/p99
+das consultas e pico de RSS, para comparar commits:
+
+    python -m benchmark.suiteOffline --documentos 200 --saida base.json
+    python -m benchmark.suiteOffline --documentos 200 --comparar base.json
+"""
+import os
+import re
+import sys
+import json
+import time
+import asyncio
+import argparse
+import resource
+import tempfile
+import threading
+import subprocess
+from datetime import datetime, timedelta
+from benchmark.servidoresFalsos import ServidorFalso, criar_openai_falso, criar_qdrant_falso, criar_minio_falso
+
+BUCKET = "anexo"
+
+# Linhas dos inserts: (data_hora, referencia, documento, tipo, acao, conteudo, ...)
+LINHA_INSERT = re.compile(
+    r"\('([^']*)',\s*'([^']*)',\s*'([^']*)',\s*'(\w)',\s*'(\w)',\s*(?:\$\$(.*?)\$\$|'((?:[^']|'')*)')",
+    re.DOTALL
+)
+
+def ler_fixtures(diretorio="BD"):
+    """
+    Itens da fila e binários das fixtures.
+
+    :return: Tupla (itens, binarios), com itens (documento, tipo, conteudo) e
+             binarios {nome: bytes}.
+    """
+    itens = []
+    for nome in sorted(os.listdir(diretorio)):
+        if not (nome.startswith("inserts_") and nome.endswith(".sql")):
+            continue
+        with open(os.path.join(diretorio, nome), encoding="utf-8") as arquivo:
+            for _, _, documento, tipo, _, texto, literal in LINHA_INSERT.findall(arquivo.read()):
+                # Os inserts de texto usam o tipo 'T'; o processador trata texto como 'E'
+                itens.append((documento, "E" if tipo == "T" else tipo, texto or literal.replace("''", "'")))
+
+    binarios = {}
+    for _, tipo, conteudo in itens:
+        if tipo == "B":
+            nome = json.loads(conteudo)["hash"]
+            with open(os.path.join(diretorio, nome), "rb") as arquivo:
+                binarios[nome] = arquivo.read()
+    return itens, binarios
+
+def escalar(itens, binarios, documentos, referencias):
+    """
+    Replica as fixtures até a quantidade de documentos. Cada cópia de binário
+    vira um objeto próprio no MinIO, para que a extração não seja atendida pelo
+    cache de extrações.
+
+    :return: Tupla (linhas da fila, objetos do MinIO).
+    """
+    linhas = []
+    objetos = {}
+    for i in range(documentos):
+        documento, tipo, conteudo = itens[i % len(itens)]
+        if tipo == "B":
+            original = json.loads(conteudo)["hash"]
+            nome = f"copia{i:06d}-{original}"
+            objetos[(BUCKET, nome)] = binarios[original]
+            conteudo = json.dumps({"hash": nome, "bucket": BUCKET})
+        linhas.append((f"IP {i % referencias + 1}/2025", f"{documento} #{i}", tipo, "I", conteudo))
+    return linhas, objetos
+
+class FilaMemoria:
+    """
+    Substituto em memória da fila_rag, com a mesma interface e semântica de
+    reserva por lease da FilaPostgres (SKIP LOCKED, expiração e separação).
+    """
+
+    def __init__(self, linhas):
+        agora = datetime.now()
+        self._lock = threading.Lock()
+        self.itens = [
+            {
+                "id": i + 1, "referencia": referencia, "documento": documento, "tipo": tipo, "acao": acao,
+                "conteudo": conteudo, "data_hora": agora + timedelta(microseconds=i),
+                "processado": False, "erro": None, "reservado_por": None, "reservado_ate": None, "tentativas": 0
+            }
+            for i, (referencia, documento, tipo, acao, conteudo) in enumerate(linhas)
+        ]
+        self._por_id = {item["id"]: item for item in self.itens}
+
+    def reservar(self, worker_id, limite, lease_segundos, max_tentativas):
+        agora = datetime.now()
+        with self._lock:
+            disponiveis = [
+                item for item in self.itens
+                if not item["processado"] and item["erro"] is None
+                and (item["reservado_ate"] is None or item["reservado_ate"] < agora)
+            ]
+            for item in disponiveis:
+                if item["tentativas"] >= max_tentativas:
+                    item["erro"] = f"Tentativas esgotadas ({item['tentativas']})"
+                    item["reservado_ate"] = None
+
+            # Um item só é reservado sem item anterior pendente do mesmo documento
+            elegiveis = {item["id"] for item in disponiveis if item["erro"] is None}
+            documentos = set()
+            livres = []
+            for item in self.itens:
+                if item["processado"] or item["erro"] is not None:
+                    continue
+                chave = (item["referencia"], item["documento"])
+                if chave not in documentos and item["id"] in elegiveis:
+                    livres.append(item)
+                documentos.add(chave)
+            livres = livres[:limite]
+            for item in livres:
+                item["reservado_por"] = worker_id
+                item["reservado_ate"] = agora + timedelta(seconds=lease_segundos)
+                item["tentativas"] += 1
+        return [
+            (item["id"], item["referencia"], item["documento"], item["tipo"], item["acao"], item["conteudo"],
+             item["tentativas"])
+            for item in livres
+        ]
+
+    def renovar(self, ids, worker_id, lease_segundos):
+        agora = datetime.now()
+        renovados = 0
+        with self._lock:
+            for id_fila in ids:
+                item = self._por_id[id_fila]
+                if item["reservado_por"] == worker_id and not item["processado"] and item["erro"] is None:
+                    item["reservado_ate"] = agora + timedelta(seconds=lease_segundos)
+                    renovados += 1
+        return renovados
+
+    def marcar(self, id_fila, worker_id):
+        with self._lock:
+            item = self._por_id[id_fila]
+            if item["reservado_por"] == worker_id:
+                item["processado"] = True
+                item["reservado_ate"] = None
+
+    def separar(self, id_fila, worker_id, erro):
+        with self._lock:
+            item = self._por_id[id_fila]
+            if item["reservado_por"] == worker_id:
+                item["erro"] = erro
+                item["reservado_ate"] = None
+
+    def processados(self):
+        with self._lock:
+            return {item["id"] for item in self.itens if item["processado"]}
+
+    def situacao(self):
+        with self._lock:
+            return {
+                "processados": sum(1 for item in self.itens if item["processado"]),
+                "separados": sum(1 for item in self.itens if item["erro"] is not None),
+                "pendentes": sum(1 for item in self.itens if not item["processado"] and item["erro"] is None)
+            }
+
+def criar_processador(fila, minio_url, usar_caches):
+    """
+    FilaProcessor real com a fila em memória e o cliente do MinIO falso
+    injetados; os demais serviços vêm das variáveis de ambiente. As threads de
+    escuta, o agendador e o servidor de métricas não são iniciados.
+    """
+    import urllib3
+    from minio import Minio
+    from filaProcessor import FilaProcessor
+
+    processor = FilaProcessor(
+        fila=fila,
+        minio_client=Minio(
+            minio_url.split("://", 1)[1], access_key="falso", secret_key="falso", secure=False,
+            region="us-east-1", http_client=urllib3.PoolManager(maxsize=int(os.environ["FILA_WORKERS"]))
+        )
+    )
+    if not usar_caches:
+        processor.embedding_cache = None
+    return processor
+
+def ids_com_blocos(processor):
+    """
+    IDs da fila com ao menos um bloco gravado na collection.
+    """
+    ids = set()
+    deslocamento = None
+    while True:
+        pontos, deslocamento = processor.qdrant_client.scroll(
+            "investigacao", limit=1000, offset=deslocamento, with_payload=["metadata.id_fila"]
+        )
+        ids.update((ponto.payload.get("metadata") or {}).get("id_fila") for ponto in pontos)
+        if deslocamento is None:
+            return ids
+
+def verificar_tiktoken():
+    """
+    O tiktoken baixa o cl100k_base no primeiro uso; sem rede, ele precisa estar
+    no cache indicado por TIKTOKEN_CACHE_DIR.
+    """
+    import tiktoken
+    try:
+        tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        sys.exit(
+            f"Codificação cl100k_base do tiktoken indisponível ({e}). Prepare o cache uma vez com acesso à rede:\n"
+            "    TIKTOKEN_CACHE_DIR=cache/tiktoken python -c \"import tiktoken; tiktoken.get_encoding('cl100k_base')\"\n"
+            "e execute a suíte com TIKTOKEN_CACHE_DIR=cache/tiktoken."
+        )
+
+def resumir_etapas(histograma):
+    """
+    Tempo total, contagem e média de cada etapa de um histograma do módulo metricas.
+    """
+    etapas = {}
+    for metrica in histograma.collect():
+        for amostra in metrica.samples:
+            etapa = etapas.setdefault(amostra.labels.get("etapa"), {})
+            if amostra.name.endswith("_sum"):
+                etapa["total_s"] = round(amostra.value, 4)
+            elif amostra.name.endswith("_count"):
+                etapa["contagem"] = int(amostra.value)
+    for etapa in etapas.values():
+        etapa["media_s"] = round(etapa["total_s"] / etapa["contagem"], 4) if etapa.get("contagem") else 0.0
+    return etapas
+
+def contar(contador, **rotulos):
+    total = 0.0
+    for metrica in contador.collect():
+        for amostra in metrica.samples:
+            if amostra.name.endswith("_total") and all(amostra.labels.get(k) == v for k, v in rotulos.items()):
+                total += amostra.value
+    return total
+
+def percentil(valores, p):
+    ordenados = sorted(valores)
+    return ordenados[min(len(ordenados) - 1, max(0, round(p / 100 * len(ordenados)) - 1))]
+
+def pico_rss_mb(quem):
+    # ru_maxrss é informado em KB no Linux
+    return round(resource.getrusage(quem).ru_maxrss / 1024, 1)
+
+def versao_codigo():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return None
+
+def medir_ingestao(processor, fila, documentos):
+    import metricas
+    inicio = time.perf_counter()
+    processor.processar_fila()
+    duracao = time.perf_counter() - inicio
+    blocos = contar(metricas.INGESTAO_BLOCOS, situacao="gravado")
+    # Itens não concluídos (separados ou pendentes após erro) e concluídos sem
+    # nenhum bloco gravado, como binários de tipo não suportado
+    com_blocos = ids_com_blocos(processor)
+    sem_blocos = fila.processados() - com_blocos
+    # Itens não concluídos não podem deixar blocos gravados (documento pela metade)
+    parciais = com_blocos - fila.processados()
+    situacao = fila.situacao()
+    return {
+        "documentos": documentos,
+        **situacao,
+        "itens_sem_blocos": len(sem_blocos),
+        "itens_parciais": len(parciais),
+        "itens_com_erro": situacao["separados"] + situacao["pendentes"] + len(sem_blocos),
+        "duracao_s": round(duracao, 3),
+        "documentos_por_s": round(documentos / duracao, 2),
+        "blocos": int(blocos),
+        "blocos_por_s": round(blocos / duracao, 1),
+        "tokens_embedding": int(contar(metricas.EMBEDDING_TOKENS)),
+        "etapas": resumir_etapas(metricas.INGESTAO_ETAPA_SEGUNDOS)
+    }
+
+def medir_resumos(processor):
+    import metricas
+    inicio = time.perf_counter()
+    atualizadas = processor.resumos.atualizar_pendentes()
+    duracao = time.perf_counter() - inicio
+    return {
+        "referencias": len(atualizadas),
+        "duracao_s": round(duracao, 3),
+        "nos_gerados": int(contar(metricas.RESUMOS_NOS, resultado="gerado")),
+        "nos_reutilizados": int(contar(metricas.RESUMOS_NOS, resultado="reutilizado"))
+    }
+
+async def disparar_consultas(url, requisicoes, concorrencia, referencias):
+    import httpx
+    semaforo = asyncio.Semaphore(concorrencia)
+    latencias = []
+    erros = 0
+
+    async def requisitar(cliente, i):
+        nonlocal erros
+        async with semaforo:
+            inicio = time.perf_counter()
+            # Perguntas distintas, para não serem atendidas pelo cache de respostas;
+            # uma em cada cinco pede o resumo do caso
+            if i % 5 == 0:
+                pergunta = f"Pergunta {i}: qual é o resumo do caso?"
+            else:
+                pergunta = f"Pergunta {i}: qual é o valor do recibo do veículo e quem são as testemunhas?"
+            resposta = await cliente.post("/consultar", json={
+                "referencia": f"IP {i % referencias + 1}/2025", "pergunta": pergunta
+            })
+            latencias.append(time.perf_counter() - inicio)
+            if resposta.status_code != 200:
+                erros += 1
+
+    async with httpx.AsyncClient(base_url=url, timeout=600) as cliente:
+        inicio = time.perf_counter()
+        await asyncio.gather(*[requisitar(cliente, i) for i in range(requisicoes)])
+        duracao = time.perf_counter() - inicio
+    return latencias, duracao, erros
+
+def medir_consultas(url, requisicoes, concorrencia, referencias):
+    import metricas
+    latencias, duracao, erros = asyncio.run(disparar_consultas(url, requisicoes, concorrencia, referencias))
+    return {
+        "requisicoes": requisicoes,
+        "concorrencia": concorrencia,
+        "erros": erros,
+        "duracao_s": round(duracao, 3),
+        "requisicoes_por_s": round(requisicoes / duracao, 2),
+        "latencia_p50_s": round(percentil(latencias, 50), 4),
+        "latencia_p95_s": round(percentil(latencias, 95), 4),
+        "latencia_p99_s": round(percentil(latencias, 99), 4),
+        "etapas": resumir_etapas(metricas.CONSULTA_ETAPA_SEGUNDOS)
+    }
+
+# Métricas comparadas entre execuções: (seção, chave, maior é melhor)
+COMPARACOES = [
+    ("ingestao", "documentos_por_s", True),
+    ("ingestao", "blocos_por_s", True),
+    ("resumos", "duracao_s", False),
+    ("consultas", "latencia_p50_s", False),
+    ("consultas", "latencia_p95_s", False),
+    ("consultas", "latencia_p99_s", False),
+    ("memoria", "pico_rss_mb", False),
+    ("memoria", "pico_rss_filhos_mb", False),
+]
+
+def comparar(base, atual):
+    comparacao = {}
+    for secao, chave, maior_melhor in COMPARACOES:
+        antes = (base.get(secao) or {}).get(chave)
+        depois = (atual.get(secao) or {}).get(chave)
+        if not antes or depois is None:
+            continue
+        variacao = (depois - antes) / antes * 100
+        comparacao[f"{secao}.{chave}"] = {
+            "base": antes, "atual": depois, "variacao_pct": round(variacao, 1),
+            "melhorou": variacao > 0 if maior_melhor else variacao < 0
+        }
+    return comparacao
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--documentos", type=int, default=100)
+    parser.add_argument("--referencias", type=int, default=10)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--consultas", type=int, default=100)
+    parser.add_argument("--concorrencia", type=int, default=10)
+    parser.add_argument("--latencia-embedding", type=float, default=0.05)
+    parser.add_argument("--latencia-llm", type=float, default=0.5)
+    parser.add_argument("--latencia-qdrant", type=float, default=0.005)
+    parser.add_argument("--latencia-minio", type=float, default=0.005)
+    parser.add_argument("--tokens-minuto", type=int, help="Limite de tokens por minuto da OpenAI simulada")
+    parser.add_argument("--caches", action="store_true", help="Usa o cache de embeddings na ingestão")
+    parser.add_argument("--saida", help="Arquivo onde gravar o resultado em JSON")
+    parser.add_argument("--comparar", help="Resultado anterior (JSON) para comparação")
+    args = parser.parse_args()
+
+    itens, binarios = ler_fixtures()
+    linhas, objetos = escalar(itens, binarios, args.documentos, args.referencias)
+
+    openai_falso = ServidorFalso(criar_openai_falso(args.latencia_embedding, args.latencia_llm, tokens_minuto=args.tokens_minuto)).iniciar()
+    qdrant_falso = ServidorFalso(criar_qdrant_falso(args.latencia_qdrant)).iniciar()
+    minio_falso = ServidorFalso(criar_minio_falso(objetos, args.latencia_minio)).iniciar()
+
+    # Caches e spool em diretório temporário: cada execução começa do zero
+    temporario = tempfile.mkdtemp(prefix="benchmark_")
+    os.environ.update({
+        "OPENAI_API_KEY": "falso",
+        "OPENAI_API_BASE": f"{openai_falso.url}/v1",
+        "OPENAI_BASE_URL": f"{openai_falso.url}/v1",
+        "QDRANT_URL": qdrant_falso.url,
+        "EMBEDDING_CACHE_PATH": os.path.join(temporario, "embeddings.sqlite"),
+        "EXTRACAO_CACHE_PATH": os.path.join(temporario, "extracoes.sqlite"),
+        "MINIO_DIRETORIO_SPOOL": temporario,
+        "TRANSCRICAO_MOTOR": os.getenv("TRANSCRICAO_MOTOR", "falso"),
+        # Os resumos são atualizados logo após a ingestão, sem aguardar novas alterações
+        "RESUMO_ESPERA_SEGUNDOS": "0",
+        "FILA_WORKERS": str(args.workers),
+    })
+    verificar_tiktoken()
+
+    fila = FilaMemoria(linhas)
+    processor = criar_processador(fila, minio_falso.url, args.caches)
+    api = None
+    try:
+        ingestao = medir_ingestao(processor, fila, args.documentos)
+        resumos = medir_resumos(processor)
+        print(json.dumps({"ingestao": ingestao, "resumos": resumos}), file=sys.stderr, flush=True)
+
+        # Importado após configurar o ambiente, pois o módulo instancia o RAGQuery
+        import consultaRequest
+        api = ServidorFalso(consultaRequest.app).iniciar()
+        consultas = medir_consultas(api.url, args.consultas, args.concorrencia, args.referencias)
+    finally:
+        processor.extracao.encerrar()
+        processor.executor.shutdown()
+        for servidor in (api, openai_falso, qdrant_falso, minio_falso):
+            if servidor is not None:
+                servidor.parar()
+
+    resultado = {
+        "versao": versao_codigo(),
+        "data": datetime.now().isoformat(timespec="seconds"),
+        "parametros": vars(args),
+        "ingestao": ingestao,
+        "resumos": resumos,
+        "consultas": consultas,
+        "openai": {
+            "chamadas": openai_falso.app.state.chamadas,
+            "recusadas": openai_falso.app.state.limite.recusadas if openai_falso.app.state.limite else 0
+        },
+        "memoria": {
+            "pico_rss_mb": pico_rss_mb(resource.RUSAGE_SELF),
+            "pico_rss_filhos_mb": pico_rss_mb(resource.RUSAGE_CHILDREN)
+        }
+    }
+    if args.comparar:
+        with open(args.comparar, encoding="utf-8") as arquivo:
+            resultado["comparacao"] = comparar(json.load(arquivo), resultado)
+
+    saida = json.dumps(resultado, indent=2, ensure_ascii=False)
+    if args.saida:
+        with open(args.saida, "w", encoding="utf-8") as arquivo:
+            arquivo.write(saida)
+    print(saida)
+
+if __name__ == "__main__":
+    main()
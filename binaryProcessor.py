@@ -2,59 +2,88 @@ import fitz  # PyMuPDF
 import pytesseract
 import ffmpeg
 import os
+import io
 import json
+import time
 import logging
+import tempfile
+import subprocess
+import wave
+import multiprocessing
+import numpy as np
+from collections import deque
+from PIL import Image
+from motorTranscricao import obter_motor
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_EXCEPTION
+from concurrent.futures.process import BrokenProcessPool
 
 # Configuração do logger
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Limites dos subprocessos externos (tesseract e ffmpeg)
+OCR_TIMEOUT_SEGUNDOS = int(os.getenv("OCR_TIMEOUT_SEGUNDOS", 120))
+FFMPEG_TIMEOUT_SEGUNDOS = int(os.getenv("FFMPEG_TIMEOUT_SEGUNDOS", 1800))
+
+# OCR por página: resolução da renderização e mínimo de caracteres da camada de texto
+OCR_DPI = int(os.getenv("OCR_DPI", 300))
+OCR_MIN_CARACTERES = int(os.getenv("OCR_MIN_CARACTERES", 10))
+
+# Segmentação do áudio para a transcrição paralela
+QUADRO_SEGUNDOS = 0.03
+SILENCIO_DB = float(os.getenv("TRANSCRICAO_SILENCIO_DB", -40))
+PAUSA_MIN_SEGUNDOS = float(os.getenv("TRANSCRICAO_PAUSA_MIN_SEGUNDOS", 0.3))
+SEGMENTO_MIN_SEGUNDOS = float(os.getenv("TRANSCRICAO_SEGMENTO_MIN_SEGUNDOS", 10))
+SEGMENTO_MAX_SEGUNDOS = float(os.getenv("TRANSCRICAO_SEGMENTO_MAX_SEGUNDOS", 30))
+
+# Versão da extração: incrementar ao alterar a lógica de extração, invalidando o cache de extrações
+VERSAO_EXTRACAO = 2
+
 class PDFProcessor:
-    def processar_pdf(self, caminho):
-        try:
-            logger.info("Processando PDF: %s", caminho)
-            texto = ""
-            with fitz.open(caminho) as pdf:
-                for pagina in pdf:
-                    texto += pagina.get_text()
-            
-            if not texto.strip():
-                logger.info("PDF sem texto. Aplicando OCR em imagens...")
-                texto = self._extrair_texto_com_ocr(pdf)
-            return texto
-        except Exception as e:
-            logger.error("Erro ao processar PDF %s: %s", caminho, e)
-            return ""
-        finally:
-            if os.path.exists(caminho):
-                os.remove(caminho)
-                logger.info("Arquivo temporário removido: %s", caminho)
+    def extrair_pagina(self, origem, numero_pagina):
+        """
+        Extrai o texto de uma única página do PDF.
 
-    def _extrair_texto_com_ocr(self, pdf):
-        texto = ""
-        try:
-            for pagina in pdf:
-                pixmap = pagina.get_pixmap()
-                imagem = pixmap.tobytes("png")
-                texto += pytesseract.image_to_string(imagem, lang="por")
+        :param origem: Caminho do arquivo ou conteúdo do PDF em bytes.
+        """
+        with self._abrir(origem) as pdf:
+            return self._texto_pagina(pdf[numero_pagina])
+
+    @classmethod
+    def contar_paginas(cls, origem):
+        with cls._abrir(origem) as pdf:
+            return pdf.page_count
+
+    @staticmethod
+    def _abrir(origem):
+        if isinstance(origem, bytes):
+            return fitz.open(stream=origem, filetype="pdf")
+        return fitz.open(origem)
+
+    def _texto_pagina(self, pagina):
+        texto = pagina.get_text()
+        if len(texto.strip()) >= OCR_MIN_CARACTERES:
             return texto
-        except Exception as e:
-            logger.error("Erro ao aplicar OCR no PDF: %s", e)
-            return ""
+        logger.info("Página %s sem camada de texto. Aplicando OCR...", pagina.number + 1)
+        return self._ocr(pagina)
+
+    @staticmethod
+    def _ocr(pagina):
+        pixmap = pagina.get_pixmap(dpi=OCR_DPI)
+        imagem = Image.open(io.BytesIO(pixmap.tobytes("png")))
+        return pytesseract.image_to_string(imagem, lang="por", timeout=OCR_TIMEOUT_SEGUNDOS)
 
 class ImageProcessor:
-    def processar_imagem(self, caminho):
-        try:
-            logger.info("Processando imagem: %s", caminho)
-            texto = pytesseract.image_to_string(caminho, lang="por")
-            return texto
-        except Exception as e:
-            logger.error("Erro ao processar imagem %s: %s", caminho, e)
-            return ""
-        finally:
-            if os.path.exists(caminho):
-                os.remove(caminho)
-                logger.info("Arquivo temporário removido: %s", caminho)
+    @staticmethod
+    def extrair_texto(origem):
+        """
+        Aplica OCR na imagem.
+
+        :param origem: Caminho do arquivo ou conteúdo da imagem em bytes.
+        """
+        if isinstance(origem, bytes):
+            origem = Image.open(io.BytesIO(origem))
+        return pytesseract.image_to_string(origem, lang="por", timeout=OCR_TIMEOUT_SEGUNDOS)
 
     @staticmethod
     def suporta_formatos(caminho):
@@ -62,24 +91,71 @@ class ImageProcessor:
         return any(caminho.endswith(ext) for ext in formatos_suportados)
 
 class AudioProcessor:
-    def __init__(self):
+    """
+    Transcrição offline de WAV 16 kHz mono, dividido em segmentos alinhados às
+    pausas da fala. O motor é definido em TRANSCRICAO_MOTOR (ver motorTranscricao).
+    """
+
+    def __init__(self, motor=None):
         try:
-            #todo: verificar como implementar a descrição a partir do wisper
-            logger.info("Carregar API Wisper")
+            self.motor = motor or obter_motor()
         except Exception as e:
-            logger.error("Erro ao carregar API Whisper: %s", e)
+            logger.error("Erro ao carregar o motor de transcrição: %s", e)
             raise
 
-    def processar_audio(self, caminho):
-        try:
-            return "Policial 1: Bom dia, João. Estamos aqui para entender melhor o que aconteceu ontem. Você pode nos contar sua versão dos fatos? João: Olha, eu sei que errei, mas foi um momento de desespero. Minha filha está doente, e eu não sabia o que fazer. Policial 2: Entendemos que você estava em uma situação difícil, mas roubar não é a solução. Pode descrever como aconteceu? João: Eu estava andando pelo centro e vi uma senhora saindo de uma loja com uma bolsa cheia. Não pensei muito. Peguei a bolsa e saí correndo. Policial 1: E depois? O que fez com os itens da bolsa? João: Só tirei o dinheiro. Foram 200 reais. Depois joguei a bolsa num beco. Policial 2: Já devolvemos os pertences da vítima, mas a senhora ficou bastante abalada. Você entende a gravidade disso? João: Sim, eu entendo. Me arrependo muito. Nunca fiz nada assim antes. Policial 1: O arrependimento é importante, mas agora você terá que responder pelo que fez. Vamos encaminhar o caso para o delegado e garantir que você tenha o suporte necessário para sua filha. João: Obrigado, eu aceito as consequências. Só quero poder corrigir isso."
-        except Exception as e:
-            logger.error("Erro ao processar áudio %s: %s", caminho, e)
-            return ""
-        finally:
-            if os.path.exists(caminho):
-                os.remove(caminho)
-                logger.info("Arquivo temporário removido: %s", caminho)
+    def transcrever_segmento(self, caminho, inicio, fim):
+        """
+        Transcreve o trecho [inicio, fim) do WAV, em segundos.
+        """
+        with wave.open(caminho, "rb") as wav:
+            taxa = wav.getframerate()
+            wav.setpos(int(inicio * taxa))
+            pcm = wav.readframes(int((fim - inicio) * taxa))
+        return self.motor.transcrever(pcm, taxa)
+
+    @staticmethod
+    def segmentar(caminho):
+        """
+        Divide o WAV em segmentos de SEGMENTO_MIN_SEGUNDOS a SEGMENTO_MAX_SEGUNDOS,
+        cortando no meio da primeira pausa após a duração mínima. Segmentos sem
+        fala são descartados.
+
+        :return: Lista de tuplas (inicio, fim), em segundos.
+        """
+        segmentos = []
+        with wave.open(caminho, "rb") as wav:
+            taxa = wav.getframerate()
+            amostras_quadro = int(taxa * QUADRO_SEGUNDOS)
+            limiar = 32768 * 10 ** (SILENCIO_DB / 20)
+            quadros_pausa = max(int(PAUSA_MIN_SEGUNDOS / QUADRO_SEGUNDOS), 1)
+
+            inicio = posicao = silencio = 0
+            com_fala = False
+            while True:
+                dados = wav.readframes(amostras_quadro)
+                if not dados:
+                    break
+                amostras = np.frombuffer(dados, dtype=np.int16).astype(np.float32)
+                posicao += len(amostras)
+                if np.sqrt(np.mean(amostras ** 2)) < limiar:
+                    silencio += 1
+                else:
+                    silencio = 0
+                    com_fala = True
+
+                duracao = (posicao - inicio) / taxa
+                pausa = silencio >= quadros_pausa
+                if (pausa and duracao >= SEGMENTO_MIN_SEGUNDOS) or duracao >= SEGMENTO_MAX_SEGUNDOS:
+                    fim = posicao - (silencio * amostras_quadro) // 2 if pausa else posicao
+                    if com_fala:
+                        segmentos.append((inicio / taxa, fim / taxa))
+                    inicio = fim
+                    silencio = 0
+                    com_fala = False
+
+            if com_fala and posicao > inicio:
+                segmentos.append((inicio / taxa, posicao / taxa))
+        return segmentos
 
     @staticmethod
     def suporta_formatos(caminho):
@@ -87,36 +163,49 @@ class AudioProcessor:
         return any(caminho.endswith(ext) for ext in formatos_suportados)
 
 class VideoProcessor:
-    def __init__(self):
-        self.audio_processor = AudioProcessor()
+    @staticmethod
+    def _sem_assinatura(origem):
+        # Não registra no log a assinatura de URLs pré-assinadas
+        return origem.split("?", 1)[0]
 
-    def processar_video(self, caminho):
-        audio_caminho = None
-        try:
-            logger.info("Processando vídeo: %s", caminho)
-            audio_caminho = self._extrair_audio(caminho)
-            texto = self.audio_processor.processar_audio(audio_caminho)
-            return texto
-        except Exception as e:
-            logger.error("Erro ao processar vídeo %s: %s", caminho, e)
-            return ""
-        finally:
-            if audio_caminho and os.path.exists(audio_caminho):
-                os.remove(audio_caminho)
-                logger.info("Arquivo temporário removido: %s", audio_caminho)
-            if os.path.exists(caminho):
-                os.remove(caminho)
-                logger.info("Arquivo temporário removido: %s", caminho)
+    @staticmethod
+    def _extrair_audio(video_caminho):
+        """
+        Converte o áudio de um vídeo ou arquivo de áudio para WAV 16 kHz mono.
 
-    def _extrair_audio(self, video_caminho):
+        :return: Caminho do WAV.
+        :raises TimeoutError: Se o ffmpeg exceder FFMPEG_TIMEOUT_SEGUNDOS.
+        :raises RuntimeError: Se o ffmpeg terminar com erro (arquivo inválido, URL
+                              expirada ou falha de rede na leitura do objeto).
+        """
+        # Nome único: o mesmo vídeo pode ser processado por dois workers
+        descritor, audio_caminho = tempfile.mkstemp(prefix="fila_rag_", suffix=".wav")
+        os.close(descritor)
         try:
-            audio_caminho = f"{video_caminho}.wav"
-            logger.info("Extraindo áudio do vídeo: %s", video_caminho)
-            ffmpeg.input(video_caminho).output(audio_caminho, format="wav", ac=1, ar="16000").run(overwrite_output=True)
+            logger.info("Extraindo áudio do vídeo: %s", VideoProcessor._sem_assinatura(video_caminho))
+            processo = (
+                ffmpeg.input(video_caminho)
+                .output(audio_caminho, format="wav", ac=1, ar="16000")
+                .overwrite_output()
+                .run_async(quiet=True)
+            )
+            try:
+                _, erro = processo.communicate(timeout=FFMPEG_TIMEOUT_SEGUNDOS)
+            except subprocess.TimeoutExpired:
+                processo.kill()
+                processo.communicate()
+                raise TimeoutError(f"ffmpeg excedeu {FFMPEG_TIMEOUT_SEGUNDOS}s")
+            if processo.returncode != 0:
+                linhas = erro.decode("utf-8", "replace").strip().splitlines()
+                raise RuntimeError(
+                    f"ffmpeg terminou com código {processo.returncode}: {linhas[-1] if linhas else 'sem mensagem'}"
+                )
             return audio_caminho
         except Exception as e:
-            logger.error("Erro ao extrair áudio do vídeo %s: %s", video_caminho, e)
-            return ""
+            # O erro é repassado para que o item não seja marcado como processado sem transcrição
+            logger.error("Erro ao extrair áudio do vídeo %s: %s", VideoProcessor._sem_assinatura(video_caminho), e)
+            os.remove(audio_caminho)
+            raise
 
     @staticmethod
     def suporta_formatos(caminho):
@@ -136,3 +225,144 @@ class FormatSupport:
             return "video"
         else:
             return None
+
+
+# Tarefas executadas nos processos do ExtracaoPool (funções de módulo para serem serializáveis)
+def _tarefa_pagina_pdf(origem, numero_pagina):
+    return PDFProcessor().extrair_pagina(origem, numero_pagina)
+
+def _tarefa_imagem(origem):
+    return ImageProcessor.extrair_texto(origem)
+
+def _tarefa_preparar_audio(origem):
+    audio_caminho = VideoProcessor._extrair_audio(origem)
+    return audio_caminho, AudioProcessor.segmentar(audio_caminho)
+
+def _tarefa_segmento_audio(audio_caminho, inicio, fim):
+    return AudioProcessor().transcrever_segmento(audio_caminho, inicio, fim)
+
+class ExtracaoPool:
+    """
+    Pool limitado de processos para a extração de texto (OCR, áudio e vídeo),
+    fora das threads que reservam itens da fila e geram embeddings. PDFs são
+    distribuídos página a página e áudios segmento a segmento entre os
+    processos, e o texto é entregue em ordem à medida que as partes ficam prontas.
+    """
+
+    TAREFAS = {
+        "imagem": _tarefa_imagem,
+    }
+
+    def __init__(self):
+        self.num_workers = int(os.getenv("EXTRACAO_WORKERS", os.cpu_count() or 1))
+        self.timeout = float(os.getenv("EXTRACAO_TIMEOUT_SEGUNDOS", 1800))
+        self.executor = self._criar_executor()
+        logger.info("Pool de extração iniciado com %s processo(s).", self.num_workers)
+
+    def _criar_executor(self):
+        # spawn evita herdar, via fork, locks das threads do processador da fila
+        return ProcessPoolExecutor(max_workers=self.num_workers, mp_context=multiprocessing.get_context("spawn"))
+
+    @staticmethod
+    def versao():
+        """
+        Identifica a extração e os parâmetros que alteram o texto extraído.
+        """
+        return (
+            f"{VERSAO_EXTRACAO};ocr_dpi={OCR_DPI};ocr_min={OCR_MIN_CARACTERES};"
+            f"transcricao={os.getenv('TRANSCRICAO_MOTOR', 'vosk')};"
+            f"segmentos={SEGMENTO_MIN_SEGUNDOS}-{SEGMENTO_MAX_SEGUNDOS}"
+        )
+
+    def extrair_partes(self, tipo_arquivo, fonte):
+        """
+        Gera o texto do binário em partes (páginas de PDFs, segmentos de áudio)
+        extraídas nos processos do pool.
+
+        O prazo conta apenas o tempo de espera pelo pool, não o tempo em que o
+        consumidor processa cada parte.
+
+        :param tipo_arquivo: Tipo retornado por FormatSupport.verificar_formato.
+        :param fonte: FonteBinario com o conteúdo em memória, o arquivo de spool ou
+                      a URL do objeto; a liberação da fonte cabe ao chamador. PDFs
+                      devem vir do spool: cada tarefa de página recebe a origem.
+        :raises TimeoutError: Se a extração exceder EXTRACAO_TIMEOUT_SEGUNDOS.
+        """
+        if tipo_arquivo in ("audio", "video"):
+            for texto, _, _ in self.extrair_segmentos(fonte):
+                yield texto
+            return
+
+        prazo = time.monotonic() + self.timeout
+        if tipo_arquivo != "pdf":
+            futuro = self.executor.submit(self.TAREFAS[tipo_arquivo], fonte.origem)
+            yield self._aguardar([futuro], prazo)[0]
+            return
+
+        logger.info("Processando PDF: %s", fonte.nome)
+        total = PDFProcessor.contar_paginas(fonte.origem)
+        yield from self._em_janela(_tarefa_pagina_pdf, [(fonte.origem, pagina) for pagina in range(total)], prazo)
+
+    def extrair_segmentos(self, fonte):
+        """
+        Converte o áudio (ou o áudio do vídeo) para WAV, divide-o em segmentos
+        alinhados às pausas e os transcreve em paralelo.
+
+        :param fonte: FonteBinario do áudio ou vídeo.
+        :return: Gerador de tuplas (texto, inicio, fim), em segundos, na ordem do áudio.
+        :raises TimeoutError: Se a extração exceder EXTRACAO_TIMEOUT_SEGUNDOS.
+        """
+        prazo = time.monotonic() + self.timeout
+        audio_caminho = None
+        try:
+            futuro = self.executor.submit(_tarefa_preparar_audio, fonte.origem)
+            audio_caminho, segmentos = self._aguardar([futuro], prazo)[0]
+            logger.info("Áudio de %s dividido em %s segmento(s).", fonte.nome, len(segmentos))
+
+            argumentos = [(audio_caminho, inicio, fim) for inicio, fim in segmentos]
+            for (inicio, fim), texto in zip(segmentos, self._em_janela(_tarefa_segmento_audio, argumentos, prazo)):
+                yield texto, inicio, fim
+        finally:
+            if audio_caminho and os.path.exists(audio_caminho):
+                os.remove(audio_caminho)
+                logger.info("Arquivo temporário removido: %s", audio_caminho)
+
+    def _em_janela(self, tarefa, argumentos, prazo):
+        """
+        Executa a tarefa para cada tupla de argumentos, com uma janela limitada de
+        tarefas em andamento, e gera os resultados na ordem dos argumentos.
+        """
+        janela = deque()
+        proximo = 0
+        try:
+            # Janela limitada de tarefas em andamento mantém a memória constante
+            while proximo < len(argumentos) or janela:
+                while proximo < len(argumentos) and len(janela) < self.num_workers * 2:
+                    janela.append(self.executor.submit(tarefa, *argumentos[proximo]))
+                    proximo += 1
+                resultado = self._aguardar([janela.popleft()], prazo)[0]
+                pausa = time.monotonic()
+                yield resultado
+                prazo += time.monotonic() - pausa
+        finally:
+            for futuro in janela:
+                futuro.cancel()
+
+    def _aguardar(self, futuros, prazo):
+        concluidos, pendentes = wait(futuros, timeout=max(prazo - time.monotonic(), 0), return_when=FIRST_EXCEPTION)
+        if pendentes:
+            # Tarefas ainda não iniciadas são canceladas; as em execução terminam
+            # pelo timeout do tesseract/ffmpeg sem bloquear o pool indefinidamente
+            for futuro in pendentes:
+                futuro.cancel()
+            if not any(futuro.exception() for futuro in concluidos):
+                raise TimeoutError(f"Extração excedeu {self.timeout:.0f}s")
+        try:
+            return [futuro.result() for futuro in futuros]
+        except BrokenProcessPool:
+            logger.error("Pool de extração interrompido; recriando processos.")
+            self.executor = self._criar_executor()
+            raise
+
+    def encerrar(self):
+        self.executor.shutdown(cancel_futures=True)
@@ -1,7 +1,11 @@
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import StreamingResponse
+from prometheus_client import make_asgi_app
 from pydantic import BaseModel
+from typing import List
 from ragQuery import RAGQuery
 import os
+import json
 import logging
 
 # Configuração do logger
@@ -11,11 +15,20 @@ logger = logging.getLogger(__name__)
 # Configuração inicial da API
 app = FastAPI(title="RAG API", description="API para consulta ao RAG", version="1.0.0")
 
+# Métricas do Prometheus (latência por etapa, tokens, caches)
+app.mount("/metrics", make_asgi_app())
+
 # Modelo para entrada de dados
 class ConsultaRequest(BaseModel):
     referencia: str
     pergunta: str
 
+class ConsultaLoteRequest(BaseModel):
+    consultas: List[ConsultaRequest]
+
+# Limite de perguntas por chamada de /consultar/lote
+max_consultas_lote = int(os.getenv("CONSULTA_LOTE_MAX", 100))
+
 # Instância do RAGQuery
 weaviate_url = os.getenv("WEAVIATE_HOST", "http://localhost:8080")
 weaviate_api_key = os.getenv("WEAVIATE_API_KEY", "")
@@ -38,13 +51,62 @@ async def consultar_rag(request: ConsultaRequest):
     """
     try:
         logger.info("Recebida consulta com referência: %s", request.referencia)
-        resposta = rag_query.consultar(request.pergunta, request.referencia)
+        resposta, cache = await rag_query.aconsultar(request.pergunta, request.referencia)
         logger.info("Consulta processada com sucesso para referência: %s", request.referencia)
-        return {"referencia": request.referencia, "resposta": resposta}
+        return {"referencia": request.referencia, "resposta": resposta, "cache": cache}
     except Exception as e:
         logger.error("Erro ao consultar o RAG: %s", e)
         raise HTTPException(status_code=500, detail=f"Erro ao consultar o RAG: {str(e)}")
 
+@app.post("/consultar/lote", summary="Consulta ao RAG em lote", response_description="Respostas por pergunta")
+async def consultar_rag_lote(request: ConsultaLoteRequest):
+    """
+    Endpoint para responder várias perguntas, de uma ou mais referências, em uma
+    única chamada. Os embeddings são gerados juntos, as buscas vão ao Qdrant em
+    lote e as chamadas ao ChatGPT são feitas em paralelo.
+
+    :param request: JSON com a lista de consultas (referência e pergunta).
+    :return: Lista "resultados", na ordem das consultas, com "resposta" e "cache"
+             ou, se aquela consulta falhou, "erro".
+    """
+    if not request.consultas:
+        raise HTTPException(status_code=400, detail="Nenhuma consulta informada.")
+    if len(request.consultas) > max_consultas_lote:
+        raise HTTPException(status_code=400, detail=f"Máximo de {max_consultas_lote} consultas por lote.")
+
+    logger.info("Recebido lote de %s consultas.", len(request.consultas))
+    resultados = await rag_query.aconsultar_lote([(c.pergunta, c.referencia) for c in request.consultas])
+    return {"resultados": resultados}
+
+@app.post("/consultar/stream", summary="Consulta ao RAG com streaming", response_description="Eventos SSE com fontes e tokens da resposta")
+async def consultar_rag_stream(request: ConsultaRequest):
+    """
+    Endpoint para consultar o RAG recebendo a resposta por server-sent events.
+
+    Emite o evento "fontes" logo após a recuperação, com os pares referência/documento,
+    seguido de eventos "token" à medida que o ChatGPT gera a resposta e, por fim, "fim"
+    (ou "erro"), que informa em "cache" se a resposta veio do cache de respostas.
+
+    :param request: JSON contendo a referência e a pergunta.
+    :return: Fluxo text/event-stream.
+    """
+    logger.info("Recebida consulta (stream) com referência: %s", request.referencia)
+
+    async def eventos():
+        async for evento, dados in rag_query.aconsultar_stream(request.pergunta, request.referencia):
+            yield f"event: {evento}\ndata: {json.dumps(dados, ensure_ascii=False)}\n\n"
+
+    return StreamingResponse(
+        eventos(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.on_event("shutdown")
+async def encerrar():
+    # Fecha os pools de conexões HTTP compartilhados
+    await rag_query.fechar()
+
 # Exemplo de inicialização da API
 if __name__ == "__main__":
     import uvicorn
@@ -1,49 +1,193 @@
+import os
 import spacy
-from typing import List
 import logging
+import tiktoken
+
+# Configuração do logger
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Frase em aberto maior que isso (texto sem pontuação) é emitida sem aguardar o fim
+MAX_CARACTERES_PENDENTES = 20000
 
 class ContentProcessor:
-    def __init__(self):
-        # Inicializa o spaCy com o modelo de português
+    """
+    Divide textos em blocos de frases limitados pela quantidade de tokens do
+    modelo de embedding, com sobreposição opcional entre blocos consecutivos.
+
+    A segmentação usa apenas o sentencizer do spaCy (regras de pontuação sobre o
+    tokenizador do português), sem tagger, parser ou NER.
+    """
+
+    # Versão da divisão em blocos: incrementar ao alterar a lógica, invalidando o cache de extrações
+    VERSAO = 3
+
+    def __init__(self, modelo="text-embedding-ada-002"):
+        self.max_tokens = int(os.getenv("BLOCO_MAX_TOKENS", 500))
+        self.sobreposicao = int(os.getenv("BLOCO_SOBREPOSICAO_TOKENS", 0))
+
         try:
-            self.nlp = spacy.load("pt_core_news_sm")
-            logger.info("Modelo spaCy carregado com sucesso.")
+            self.nlp = spacy.blank("pt")
+            self.nlp.add_pipe("sentencizer")
+            # Sem parser e NER, o custo de memória por caractere é baixo
+            self.nlp.max_length = 10 ** 8
+            self.encoding = tiktoken.encoding_for_model(modelo)
+            logger.info("Segmentador de frases carregado com sucesso.")
         except Exception as e:
-            logger.error("Erro ao carregar o modelo spaCy: %s", e)
+            logger.error("Erro ao carregar o segmentador de frases: %s", e)
             raise
 
-    def dividir_por_frases(self, texto, max_tokens=500):
+    def contar_tokens(self, texto):
+        return len(self.encoding.encode_ordinary(texto))
+
+    def dividir_por_frases(self, texto, max_tokens=None):
         """
         Divide o texto em blocos com base em frases e limite de tokens.
 
         :param texto: Texto completo a ser dividido.
-        :param max_tokens: Número máximo de tokens por bloco.
+        :param max_tokens: Número máximo de tokens por bloco (padrão BLOCO_MAX_TOKENS).
         :return: Lista de blocos de texto.
+        :raises Exception: Erros da segmentação são repassados, para que o item
+                           não seja marcado como processado sem blocos.
         """
-        try:
-            doc = self.nlp(texto)  # Processar o texto
-            frases = [sent.text for sent in doc.sents]  # Extrair frases
-            blocos = []
-            bloco_atual = []
-
-            token_count = 0
-            for frase in frases:
-                num_tokens = len(frase.split())  # Contar palavras como proxy para tokens
-                if token_count + num_tokens > max_tokens:
-                    # Salvar o bloco atual e reiniciar
-                    blocos.append(" ".join(bloco_atual))
-                    bloco_atual = []
-                    token_count = 0
+        frases = (sent.text for sent in self.nlp(texto).sents)
+        return list(self._agrupar_frases(frases, max_tokens or self.max_tokens))
+
+    def dividir_varios(self, textos, max_tokens=None, batch_size=32):
+        """
+        Divide vários textos em blocos, segmentando-os em lote com nlp.pipe.
+
+        :param textos: Lista de textos.
+        :param max_tokens: Número máximo de tokens por bloco (padrão BLOCO_MAX_TOKENS).
+        :return: Lista com os blocos de cada texto.
+        """
+        return [
+            list(self._agrupar_frases((sent.text for sent in doc.sents), max_tokens or self.max_tokens))
+            for doc in self.nlp.pipe(textos, batch_size=batch_size)
+        ]
+
+    def dividir_por_frases_stream(self, textos, max_tokens=None):
+        """
+        Divide em blocos um texto recebido em partes (por exemplo, página a
+        página), produzindo cada bloco assim que ele é fechado.
+
+        :param textos: Iterável com as partes do texto, na ordem.
+        :param max_tokens: Número máximo de tokens por bloco (padrão BLOCO_MAX_TOKENS).
+        :return: Gerador de blocos de texto.
+        """
+        return self._agrupar_frases(self._frases_stream(textos), max_tokens or self.max_tokens)
+
+    def dividir_segmentos(self, segmentos, max_tokens=None):
+        """
+        Agrupa segmentos transcritos consecutivos em blocos de até max_tokens,
+        preservando o intervalo de tempo de cada bloco. As transcrições não têm
+        pontuação, então os segmentos (cortados nas pausas da fala) fazem o papel
+        das frases.
+
+        :param segmentos: Iterável de tuplas (texto, inicio, fim), em segundos.
+        :param max_tokens: Número máximo de tokens por bloco (padrão BLOCO_MAX_TOKENS).
+        :return: Gerador de tuplas (bloco, metadados com o intervalo do bloco).
+        """
+        max_tokens = max_tokens or self.max_tokens
+        textos = []
+        token_count = 0
+        inicio_bloco = fim_bloco = 0
+        for texto, inicio, fim in segmentos:
+            texto = texto.strip()
+            if not texto:
+                continue
+            num_tokens = self.contar_tokens(texto)
+            if textos and token_count + num_tokens > max_tokens:
+                yield " ".join(textos), {"inicio_segundos": round(inicio_bloco, 2), "fim_segundos": round(fim_bloco, 2)}
+                textos = []
+                token_count = 0
+
+            if not textos:
+                inicio_bloco = inicio
+            textos.append(texto)
+            token_count += num_tokens
+            fim_bloco = fim
+
+        if textos:
+            yield " ".join(textos), {"inicio_segundos": round(inicio_bloco, 2), "fim_segundos": round(fim_bloco, 2)}
+
+    def _frases_stream(self, textos):
+        # A última frase de cada parte é mantida até a parte seguinte, pois pode continuar nela
+        pendente = ""
+        for parte in textos:
+            doc = self.nlp(pendente + parte)
+            sentencas = list(doc.sents)
+            if not sentencas:
+                continue
+            for sent in sentencas[:-1]:
+                yield sent.text
+            pendente = doc.text[sentencas[-1].start_char:]
+            if len(pendente) > MAX_CARACTERES_PENDENTES:
+                yield pendente.strip()
+                pendente = ""
+
+        if pendente.strip():
+            yield pendente.strip()
+
+    def _agrupar_frases(self, frases, max_tokens):
+        """
+        Agrupa frases consecutivas em blocos de até max_tokens. Os blocos seguintes
+        começam com as últimas frases do anterior, até BLOCO_SOBREPOSICAO_TOKENS.
+        """
+        bloco = []  # (frase, tokens)
+        token_count = 0
+        novas = 0
+        for frase in frases:
+            for trecho, num_tokens in self._trechos(frase, max_tokens):
+                if novas and token_count + num_tokens > max_tokens:
+                    # Salvar o bloco atual e reiniciar com a sobreposição
+                    yield " ".join(texto for texto, _ in bloco)
+                    bloco, token_count = self._sobreposicao(bloco, max_tokens - num_tokens)
+                    novas = 0
 
                 # Adicionar a frase ao bloco atual
-                bloco_atual.append(frase)
+                bloco.append((trecho, num_tokens))
                 token_count += num_tokens
+                novas += 1
 
-            # Adicionar o último bloco
-            if bloco_atual:
-                blocos.append(" ".join(bloco_atual))
+        # Adicionar o último bloco, se tiver frases além da sobreposição
+        if novas:
+            yield " ".join(texto for texto, _ in bloco)
 
-            return blocos
-        except Exception as e:
-            logger.error("Erro ao dividir texto em frases: %s", e)
-            return []
\ No newline at end of file
+    def _sobreposicao(self, bloco, espaco):
+        limite = min(self.sobreposicao, espaco)
+        mantidas = []
+        token_count = 0
+        for frase, num_tokens in reversed(bloco):
+            if token_count + num_tokens > limite:
+                break
+            mantidas.insert(0, (frase, num_tokens))
+            token_count += num_tokens
+        return mantidas, token_count
+
+    def _trechos(self, frase, max_tokens):
+        """
+        Retorna a frase com sua contagem de tokens ou, se ela exceder max_tokens,
+        seus trechos de palavras consecutivas que cabem no limite.
+        """
+        frase = frase.strip()
+        # Frase só com espaços (quebras de linha entre sentenças) não gera trecho
+        if not frase:
+            return []
+        num_tokens = self.contar_tokens(frase)
+        if num_tokens <= max_tokens:
+            return [(frase, num_tokens)]
+
+        trechos = []
+        palavras = []
+        token_count = 0
+        for palavra, tokens in zip(frase.split(), self.encoding.encode_ordinary_batch([f" {p}" for p in frase.split()])):
+            if palavras and token_count + len(tokens) > max_tokens:
+                trechos.append((" ".join(palavras), token_count))
+                palavras = []
+                token_count = 0
+            palavras.append(palavra)
+            token_count += len(tokens)
+        if palavras:
+            trechos.append((" ".join(palavras), token_count))
+        return trechos
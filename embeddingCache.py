@@ -0,0 +1,162 @@
+import os
+import time
+import array
+import sqlite3
+import hashlib
+import logging
+import threading
+import metricas
+
+# Configuração do logger
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+class EmbeddingCache:
+    """
+    Cache persistente de embeddings em SQLite, endereçado pelo modelo e pelo hash
+    do texto normalizado. Ao ultrapassar o limite de itens, remove os menos
+    acessados recentemente (LRU).
+
+    Os acessos são acumulados em memória e gravados em lote (na próxima
+    gravação, a cada EMBEDDING_CACHE_ACESSOS_LOTE acertos ou a cada
+    EMBEDDING_CACHE_ACESSOS_SEGUNDOS), para que uma leitura não escreva no banco.
+    """
+
+    def __init__(self, caminho=None, max_itens=None):
+        self.caminho = caminho or os.getenv("EMBEDDING_CACHE_PATH", "cache/embeddings.sqlite")
+        self.max_itens = max_itens or int(os.getenv("EMBEDDING_CACHE_MAX_ITENS", 100000))
+        self.acertos = 0
+        self.falhas = 0
+        self._lock = threading.Lock()
+
+        # Último acesso de cada chave ainda não gravado no banco
+        self._acessos = {}
+        self._acessos_lote = int(os.getenv("EMBEDDING_CACHE_ACESSOS_LOTE", 1000))
+        self._acessos_segundos = float(os.getenv("EMBEDDING_CACHE_ACESSOS_SEGUNDOS", 60))
+        self._acessos_gravados_em = time.monotonic()
+
+        try:
+            diretorio = os.path.dirname(self.caminho)
+            if diretorio:
+                os.makedirs(diretorio, exist_ok=True)
+            self.conn = sqlite3.connect(self.caminho, check_same_thread=False)
+            self.conn.execute("PRAGMA journal_mode=WAL;")
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS embeddings (
+                    chave TEXT PRIMARY KEY,
+                    vetor BLOB NOT NULL,
+                    acessado_em REAL NOT NULL
+                );
+            """)
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_embeddings_acessado_em ON embeddings (acessado_em);")
+            self.conn.commit()
+            self._total = self.conn.execute("SELECT count(*) FROM embeddings;").fetchone()[0]
+            logger.info("Cache de embeddings aberto em %s com %s itens.", self.caminho, self._total)
+        except Exception as e:
+            logger.error("Erro ao abrir o cache de embeddings %s: %s", self.caminho, e)
+            raise
+
+    @staticmethod
+    def normalizar(texto):
+        return " ".join(texto.split())
+
+    def chave(self, modelo, texto):
+        conteudo = f"{modelo}\0{self.normalizar(texto)}".encode("utf-8")
+        return hashlib.sha256(conteudo).hexdigest()
+
+    def obter_varios(self, modelo, textos):
+        """
+        Busca os embeddings dos textos no cache.
+
+        :param modelo: Nome do modelo de embedding.
+        :param textos: Lista de textos.
+        :return: Lista com o vetor de cada texto, ou None quando ausente.
+        """
+        chaves = [self.chave(modelo, texto) for texto in textos]
+        encontrados = {}
+        with self._lock:
+            for inicio in range(0, len(chaves), 500):
+                parte = chaves[inicio:inicio + 500]
+                marcadores = ",".join("?" * len(parte))
+                for chave, vetor in self.conn.execute(
+                    f"SELECT chave, vetor FROM embeddings WHERE chave IN ({marcadores});", parte
+                ):
+                    encontrados[chave] = array.array("f", vetor).tolist()
+
+            # Último acesso para a política LRU, gravado em lote
+            if encontrados:
+                agora = time.time()
+                self._acessos.update((chave, agora) for chave in encontrados)
+                if (
+                    len(self._acessos) >= self._acessos_lote
+                    or time.monotonic() - self._acessos_gravados_em >= self._acessos_segundos
+                ):
+                    self._gravar_acessos()
+                    self.conn.commit()
+
+            vetores = [encontrados.get(chave) for chave in chaves]
+            acertos = sum(1 for vetor in vetores if vetor is not None)
+            self.acertos += acertos
+            self.falhas += len(vetores) - acertos
+            metricas.registrar_cache("embeddings", acertos, len(vetores) - acertos)
+        return vetores
+
+    def obter(self, modelo, texto):
+        return self.obter_varios(modelo, [texto])[0]
+
+    def gravar_varios(self, modelo, textos, vetores):
+        agora = time.time()
+        registros = [
+            (self.chave(modelo, texto), array.array("f", vetor).tobytes(), agora)
+            for texto, vetor in zip(textos, vetores)
+        ]
+        with self._lock:
+            self._gravar_acessos()
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (chave, vetor, acessado_em) VALUES (?, ?, ?);",
+                registros
+            )
+            self.conn.commit()
+            self._total += len(registros)
+            if self._total > self.max_itens:
+                self._remover_antigos()
+
+    def gravar(self, modelo, texto, vetor):
+        self.gravar_varios(modelo, [texto], [vetor])
+
+    def _gravar_acessos(self):
+        # Chamado com o lock; o commit fica a cargo de quem chama
+        if self._acessos:
+            self.conn.executemany(
+                "UPDATE embeddings SET acessado_em = ? WHERE chave = ?;",
+                [(agora, chave) for chave, agora in self._acessos.items()]
+            )
+            self._acessos = {}
+        self._acessos_gravados_em = time.monotonic()
+
+    def _remover_antigos(self):
+        # Remove até 90% do limite para não executar a remoção a cada inserção
+        self._total = self.conn.execute("SELECT count(*) FROM embeddings;").fetchone()[0]
+        excedente = self._total - int(self.max_itens * 0.9)
+        if excedente <= 0:
+            return
+        self.conn.execute("""
+            DELETE FROM embeddings WHERE chave IN (
+                SELECT chave FROM embeddings ORDER BY acessado_em ASC LIMIT ?
+            );
+        """, (excedente,))
+        self.conn.commit()
+        self._total -= excedente
+        logger.info("Cache de embeddings: %s itens removidos por LRU.", excedente)
+
+    def taxa_acerto(self):
+        total = self.acertos + self.falhas
+        return self.acertos / total if total else 0.0
+
+    def estatisticas(self):
+        return {
+            "acertos": self.acertos,
+            "falhas": self.falhas,
+            "taxa_acerto": self.taxa_acerto(),
+            "itens": self._total
+        }
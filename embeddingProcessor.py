@@ -0,0 +1,420 @@
+import os
+import json
+import time
+import uuid
+import hashlib
+import logging
+import tiktoken
+from qdrant_client.http import models
+from qdrant_client.http.models import PointStruct
+from indiceLexico import VETOR_LEXICO
+from agendadorOpenAI import PRIORIDADE_INGESTAO
+import metricas
+
+# Configuração do logger
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Estimativa do tamanho em JSON de cada float do vetor
+BYTES_POR_DIMENSAO = 20
+
+# Namespace dos IDs determinísticos dos pontos (uuid5)
+NAMESPACE_PONTOS = uuid.UUID("0f3c5b52-6a1e-4c1b-9a57-2d5e8f1b7c3a")
+
+class EmbeddingProcessor:
+    """
+    Acumula blocos de texto de vários itens da fila, gera os embeddings em lotes
+    limitados por quantidade de textos e de tokens e grava os pontos no Qdrant em
+    upserts limitados por quantidade de pontos e tamanho estimado da requisição.
+
+    Exclusões consecutivas são agrupadas em uma única requisição de delete por
+    filtro. A ordem entre inclusões e exclusões enfileiradas é preservada.
+
+    Os IDs dos pontos são derivados de (referencia, documento, bloco_id), de modo
+    que reprocessar um documento sobrescreve os pontos existentes: apenas blocos
+    com conteúdo alterado são embutidos novamente e blocos excedentes da versão
+    anterior são removidos.
+
+    Com um IndiceLexico, cada ponto recebe também o vetor esparso (BM25) do
+    bloco, usado na busca híbrida. Com um AgendadorOpenAI, as chamadas de
+    embedding respeitam os limites da OpenAI, com prioridade de ingestão.
+
+    Quando uma gravação falha, os IDs dos itens da fila com blocos ou exclusões
+    naquela gravação ficam em retirar_falhas(), para que não sejam marcados
+    como processados.
+
+    Os embeddings de um documento são gerados à medida que os blocos chegam,
+    mas os pontos só são gravados depois que o iterável de blocos termina: se a
+    extração falhar no meio, os blocos já gerados são descartados e a versão
+    armazenada permanece intacta.
+    """
+
+    def __init__(self, embeddings, qdrant_client, collection_name="investigacao", cache=None, lexico=None,
+                 agendador=None):
+        self.embeddings = embeddings
+        self.cache = cache
+        self.lexico = lexico
+        self.agendador = agendador
+        self.qdrant_client = qdrant_client
+        self.collection_name = collection_name
+
+        # Limites dos lotes
+        self.lote_textos = int(os.getenv("EMBEDDING_LOTE_TEXTOS", 256))
+        self.lote_tokens = int(os.getenv("EMBEDDING_LOTE_TOKENS", 100000))
+        self.lote_pontos = int(os.getenv("QDRANT_LOTE_PONTOS", 256))
+        self.lote_bytes = int(os.getenv("QDRANT_LOTE_BYTES", 16 * 1024 * 1024))
+
+        self.encoding = tiktoken.encoding_for_model(embeddings.model)
+
+        self._pendentes = []
+        self._tokens_pendentes = 0
+        self._documentos_pendentes = set()
+        self._exclusoes = []  # (filtro, id_fila)
+        self._itens_com_falha = set()
+
+        # Documento cujos blocos estão sendo consumidos e seus pontos já embutidos
+        self._documento_aberto = None
+        self._retidos = []
+
+        # Estatísticas de vazão
+        self.total_blocos = 0
+        self.total_inalterados = 0
+        self.total_tokens = 0
+        self.tempo_embedding = 0.0
+        self.tempo_upsert = 0.0
+
+    def contar_tokens(self, texto):
+        return len(self.encoding.encode(texto))
+
+    @staticmethod
+    def id_ponto(referencia, documento, bloco_id):
+        return str(uuid.uuid5(NAMESPACE_PONTOS, f"{referencia}\0{documento}\0{bloco_id}"))
+
+    @staticmethod
+    def hash_conteudo(texto):
+        return hashlib.sha256(texto.encode("utf-8")).hexdigest()
+
+    def adicionar(self, textos, metadatas):
+        """
+        Enfileira para gravação todos os blocos de um documento. Ver sincronizar_documento.
+
+        :param textos: Lista completa de blocos de texto do documento.
+        :param metadatas: Lista de metadados, um por bloco, com id_fila, referencia,
+                          documento e bloco_id.
+        """
+        if not textos:
+            return
+        metadata = metadatas[0]
+        self.sincronizar_documento(
+            metadata["referencia"], metadata["documento"], metadata["id_fila"], zip(textos, metadatas)
+        )
+
+    def sincronizar_documento(self, referencia, documento, id_fila, blocos):
+        """
+        Enfileira para gravação os blocos de um documento, sincronizando-os com a
+        versão já armazenada. Os blocos são consumidos à medida que são gerados e
+        os embeddings são gerados sempre que o lote atinge os limites configurados,
+        de modo que a gravação começa antes do fim da extração.
+
+        :param referencia: Referência (procedimento) do documento.
+        :param documento: Identificação do documento.
+        :param id_fila: ID do item da fila que originou os blocos.
+        :param blocos: Iterável de tuplas (texto, metadata), na ordem dos blocos.
+        :raises Exception: Erros do iterável de blocos são repassados depois de
+                           descartar os blocos já gerados do documento.
+        """
+        # Exclusões e versões anteriores do documento enfileiradas antes destes
+        # blocos devem estar aplicadas antes de consultar o estado atual
+        self._aplicar_exclusoes()
+        if (referencia, documento) in self._documentos_pendentes:
+            self._gravar_pendentes()
+        existentes = self._pontos_existentes(referencia, documento)
+
+        vistos = set()
+        inalterados = []
+        alterados = 0
+        self._documento_aberto = (referencia, documento)
+        try:
+            for texto, metadata in blocos:
+                metadata = dict(metadata, hash_conteudo=self.hash_conteudo(texto))
+                id_ponto = self.id_ponto(referencia, documento, metadata["bloco_id"])
+                vistos.add(id_ponto)
+
+                # Blocos inalterados mantêm o vetor; apenas o id_fila é atualizado
+                if existentes.get(id_ponto, {}).get("hash_conteudo") == metadata["hash_conteudo"]:
+                    inalterados.append(id_ponto)
+                    continue
+
+                tokens = self.contar_tokens(texto)
+                if self._pendentes and (
+                    len(self._pendentes) >= self.lote_textos
+                    or self._tokens_pendentes + tokens > self.lote_tokens
+                ):
+                    self._gravar_pendentes()
+                self._pendentes.append((id_ponto, texto, metadata))
+                self._tokens_pendentes += tokens
+                self._documentos_pendentes.add((referencia, documento))
+                alterados += 1
+        except Exception:
+            self._descartar_documento(referencia, documento)
+            raise
+        finally:
+            self._documento_aberto = None
+
+        # Documento completo: os pontos retidos durante a extração podem ser gravados
+        retidos, self._retidos = self._retidos, []
+        self._gravar_pontos(retidos)
+
+        if not vistos:
+            logger.warning("Documento %s / %s sem blocos; versão armazenada mantida.", referencia, documento)
+            return
+
+        # Blocos da versão anterior que não existem mais (IDs distintos dos pendentes)
+        orfaos = [id_ponto for id_ponto in existentes if id_ponto not in vistos]
+        if orfaos:
+            self.qdrant_client.delete(
+                collection_name=self.collection_name,
+                points_selector=models.PointIdsList(points=orfaos),
+                wait=True
+            )
+
+        desatualizados = [id_ponto for id_ponto in inalterados if existentes[id_ponto].get("id_fila") != id_fila]
+        if desatualizados:
+            self.qdrant_client.set_payload(
+                collection_name=self.collection_name,
+                payload={"id_fila": id_fila},
+                key="metadata",
+                points=desatualizados,
+                wait=True
+            )
+        self.total_inalterados += len(inalterados)
+        metricas.INGESTAO_BLOCOS.labels("inalterado").inc(len(inalterados))
+
+        logger.info(
+            "Documento %s / %s: %s blocos novos ou alterados, %s inalterados, %s removidos",
+            referencia, documento, alterados, len(inalterados), len(orfaos)
+        )
+
+    def _descartar_documento(self, referencia, documento):
+        """
+        Retira da fila do lote os blocos e pontos retidos de um documento cuja
+        extração falhou.
+        """
+        descartados = len(self._retidos)
+        self._retidos = []
+        restantes = [
+            pendente for pendente in self._pendentes
+            if (pendente[2]["referencia"], pendente[2]["documento"]) != (referencia, documento)
+        ]
+        descartados += len(self._pendentes) - len(restantes)
+        self._pendentes = restantes
+        self._tokens_pendentes = sum(self.contar_tokens(texto) for _, texto, _ in restantes)
+        self._documentos_pendentes.discard((referencia, documento))
+        if descartados:
+            logger.warning(
+                "Documento %s / %s: %s blocos descartados após falha na extração; versão armazenada mantida.",
+                referencia, documento, descartados
+            )
+
+    def _pontos_existentes(self, referencia, documento):
+        """
+        Retorna {id do ponto: metadata} dos blocos já armazenados do documento.
+        """
+        filtro = models.Filter(must=[
+            models.FieldCondition(key="metadata.referencia", match=models.MatchValue(value=referencia)),
+            models.FieldCondition(key="metadata.documento", match=models.MatchValue(value=documento)),
+        ])
+        existentes = {}
+        offset = None
+        while True:
+            pontos, offset = self.qdrant_client.scroll(
+                collection_name=self.collection_name,
+                scroll_filter=filtro,
+                limit=1000,
+                offset=offset,
+                with_payload=["metadata.hash_conteudo", "metadata.id_fila"],
+                with_vectors=False
+            )
+            for ponto in pontos:
+                existentes[str(ponto.id)] = (ponto.payload or {}).get("metadata") or {}
+            if offset is None:
+                return existentes
+
+    def excluir(self, filtro, id_fila=None):
+        """
+        Enfileira a exclusão dos pontos que atendem ao filtro. Exclusões
+        consecutivas são enviadas juntas em descarregar() ou antes da próxima
+        inclusão.
+
+        :param filtro: models.Filter que seleciona os pontos a excluir.
+        :param id_fila: ID do item da fila que originou a exclusão.
+        """
+        # Blocos enfileirados antes desta exclusão devem ser gravados primeiro
+        self._gravar_pendentes()
+        self._exclusoes.append((filtro, id_fila))
+
+    def descarregar(self):
+        """
+        Aplica as operações pendentes no Qdrant: gera os embeddings e grava os
+        blocos enfileirados, ou aplica as exclusões enfileiradas.
+        """
+        self._gravar_pendentes()
+        self._aplicar_exclusoes()
+
+    def retirar_falhas(self):
+        """
+        :return: IDs dos itens da fila com blocos ou exclusões perdidos em
+                 gravações que falharam desde a última chamada.
+        """
+        falhas = self._itens_com_falha
+        self._itens_com_falha = set()
+        return falhas
+
+    def _aplicar_exclusoes(self):
+        if not self._exclusoes:
+            return
+
+        exclusoes = self._exclusoes
+        self._exclusoes = []
+        filtros = [filtro for filtro, _ in exclusoes]
+        filtro = filtros[0] if len(filtros) == 1 else models.Filter(should=filtros)
+
+        try:
+            # wait=True garante que a exclusão foi aplicada antes da verificação
+            self.qdrant_client.delete(
+                collection_name=self.collection_name,
+                points_selector=models.FilterSelector(filter=filtro),
+                wait=True
+            )
+            restantes = self.qdrant_client.count(
+                collection_name=self.collection_name,
+                count_filter=filtro,
+                exact=True
+            ).count
+            if restantes:
+                raise RuntimeError(f"{restantes} pontos permanecem no Qdrant após a exclusão")
+        except Exception:
+            self._itens_com_falha.update(id_fila for _, id_fila in exclusoes if id_fila is not None)
+            raise
+        logger.info("%s exclusão(ões) aplicada(s) no Qdrant em uma única requisição.", len(exclusoes))
+
+    def _gravar_pendentes(self):
+        if not self._pendentes:
+            return
+
+        pendentes, tokens = self._pendentes, self._tokens_pendentes
+        self._pendentes = []
+        self._tokens_pendentes = 0
+        self._documentos_pendentes = set()
+
+        textos = [texto for _, texto, _ in pendentes]
+        try:
+            inicio = time.perf_counter()
+            vetores = self._gerar_embeddings(textos)
+            duracao = time.perf_counter() - inicio
+        except Exception:
+            # Os blocos saíram da fila do lote: os itens de origem devem ser reprocessados
+            self._itens_com_falha.update(metadata["id_fila"] for _, _, metadata in pendentes)
+            raise
+        self.tempo_embedding += duracao
+        metricas.INGESTAO_ETAPA_SEGUNDOS.labels("embedding").observe(duracao)
+        self.total_tokens += tokens
+        metricas.EMBEDDING_TOKENS.inc(tokens)
+
+        pontos = []
+        for (id_ponto, texto, metadata), vetor in zip(pendentes, vetores):
+            ponto = PointStruct(
+                id=id_ponto,
+                vector=self._vetores_ponto(texto, vetor),
+                payload={"page_content": texto, "metadata": metadata}
+            )
+            # Pontos do documento em extração aguardam o fim dos seus blocos
+            if (metadata["referencia"], metadata["documento"]) == self._documento_aberto:
+                self._retidos.append(ponto)
+            else:
+                pontos.append(ponto)
+        self._gravar_pontos(pontos)
+
+    def _gravar_pontos(self, pontos):
+        if not pontos:
+            return
+
+        try:
+            inicio = time.perf_counter()
+            for lote in self._lotes_upsert(pontos):
+                self.qdrant_client.upsert(collection_name=self.collection_name, points=lote)
+            duracao = time.perf_counter() - inicio
+        except Exception:
+            self._itens_com_falha.update(ponto.payload["metadata"]["id_fila"] for ponto in pontos)
+            raise
+        self.tempo_upsert += duracao
+        metricas.INGESTAO_ETAPA_SEGUNDOS.labels("upsert").observe(duracao)
+
+        self.total_blocos += len(pontos)
+        metricas.INGESTAO_BLOCOS.labels("gravado").inc(len(pontos))
+
+    def _embutir(self, textos):
+        if self.agendador is None:
+            return self.embeddings.embed_documents(textos)
+        tokens = sum(self.contar_tokens(texto) for texto in textos)
+        return self.agendador.executar(lambda: self.embeddings.embed_documents(textos), tokens, PRIORIDADE_INGESTAO)
+
+    def _gerar_embeddings(self, textos):
+        if self.cache is None:
+            return self._embutir(textos)
+
+        modelo = self.embeddings.model
+        vetores = self.cache.obter_varios(modelo, textos)
+
+        # Apenas textos ausentes do cache vão à OpenAI, e repetidos vão uma única vez
+        faltantes = list(dict.fromkeys(texto for texto, vetor in zip(textos, vetores) if vetor is None))
+        if faltantes:
+            novos = dict(zip(faltantes, self._embutir(faltantes)))
+            self.cache.gravar_varios(modelo, faltantes, [novos[texto] for texto in faltantes])
+            vetores = [vetor if vetor is not None else novos[texto] for texto, vetor in zip(textos, vetores)]
+        return vetores
+
+    def _vetores_ponto(self, texto, vetor):
+        if self.lexico is None:
+            return vetor
+        return {"": vetor, VETOR_LEXICO: self.lexico.vetor_documento(texto)}
+
+    @staticmethod
+    def _dimensoes(vetores):
+        # Vetor denso, ou vetor denso e esparso (índice e valor por termo)
+        if not isinstance(vetores, dict):
+            return len(vetores)
+        return sum(len(v) if isinstance(v, list) else 2 * len(v.indices) for v in vetores.values())
+
+    def _lotes_upsert(self, pontos):
+        lote = []
+        tamanho = 0
+        for ponto in pontos:
+            tamanho_ponto = len(json.dumps(ponto.payload)) + self._dimensoes(ponto.vector) * BYTES_POR_DIMENSAO
+            if lote and (len(lote) >= self.lote_pontos or tamanho + tamanho_ponto > self.lote_bytes):
+                yield lote
+                lote = []
+                tamanho = 0
+            lote.append(ponto)
+            tamanho += tamanho_ponto
+        if lote:
+            yield lote
+
+    def registrar_vazao(self):
+        """
+        Registra no log a vazão acumulada do estágio de embedding e gravação.
+        """
+        tempo_total = self.tempo_embedding + self.tempo_upsert
+        if not self.total_blocos or not tempo_total:
+            return
+        logger.info(
+            "Embeddings: %s blocos, %s tokens em %.2fs (%.1f blocos/s); embedding %.2fs, upsert %.2fs; %s blocos inalterados",
+            self.total_blocos, self.total_tokens, tempo_total,
+            self.total_blocos / tempo_total, self.tempo_embedding, self.tempo_upsert, self.total_inalterados
+        )
+        if self.cache is not None:
+            estatisticas = self.cache.estatisticas()
+            logger.info(
+                "Cache de embeddings: %s acertos, %s falhas (taxa de acerto %.1f%%)",
+                estatisticas["acertos"], estatisticas["falhas"], estatisticas["taxa_acerto"] * 100
+            )
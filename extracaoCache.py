@@ -0,0 +1,129 @@
+import os
+import time
+import json
+import zlib
+import sqlite3
+import hashlib
+import logging
+import threading
+import metricas
+
+# Configuração do logger
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+class ExtracaoCache:
+    """
+    Cache persistente em SQLite dos blocos de texto extraídos de binários,
+    endereçado pelo hash do objeto no MinIO e pela versão da extração. Um acerto
+    dispensa o download, a extração (OCR, transcrição) e a divisão em blocos; os
+    embeddings dos blocos são então encontrados no cache de embeddings.
+
+    Ao ultrapassar o limite de bytes armazenados, remove as entradas menos
+    acessadas recentemente (LRU).
+    """
+
+    def __init__(self, caminho=None, max_bytes=None):
+        self.caminho = caminho or os.getenv("EXTRACAO_CACHE_PATH", "cache/extracoes.sqlite")
+        self.max_bytes = max_bytes or int(os.getenv("EXTRACAO_CACHE_MAX_BYTES", 1024 * 1024 * 1024))
+        self.acertos = 0
+        self.falhas = 0
+        self._lock = threading.Lock()
+
+        try:
+            diretorio = os.path.dirname(self.caminho)
+            if diretorio:
+                os.makedirs(diretorio, exist_ok=True)
+            self.conn = sqlite3.connect(self.caminho, check_same_thread=False)
+            self.conn.execute("PRAGMA journal_mode=WAL;")
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS extracoes (
+                    chave TEXT PRIMARY KEY,
+                    blocos BLOB NOT NULL,
+                    tamanho INTEGER NOT NULL,
+                    acessado_em REAL NOT NULL
+                );
+            """)
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_extracoes_acessado_em ON extracoes (acessado_em);")
+            self.conn.commit()
+            self._itens, self._bytes = self.conn.execute(
+                "SELECT count(*), coalesce(sum(tamanho), 0) FROM extracoes;"
+            ).fetchone()
+            logger.info("Cache de extrações aberto em %s com %s itens (%s bytes).", self.caminho, self._itens, self._bytes)
+        except Exception as e:
+            logger.error("Erro ao abrir o cache de extrações %s: %s", self.caminho, e)
+            raise
+
+    @staticmethod
+    def chave(hash_objeto, versao):
+        return hashlib.sha256(f"{hash_objeto}\0{versao}".encode("utf-8")).hexdigest()
+
+    def obter(self, hash_objeto, versao):
+        """
+        Busca os blocos extraídos de um objeto.
+
+        :param hash_objeto: Hash do objeto no MinIO.
+        :param versao: Versão da extração e da divisão em blocos.
+        :return: Lista de blocos de texto, ou None quando ausente.
+        """
+        chave = self.chave(hash_objeto, versao)
+        with self._lock:
+            linha = self.conn.execute("SELECT blocos FROM extracoes WHERE chave = ?;", (chave,)).fetchone()
+            blocos = json.loads(zlib.decompress(linha[0])) if linha is not None else None
+            if not blocos:
+                # Extrações vazias gravadas por versões anteriores não são reaproveitadas
+                self.falhas += 1
+                metricas.registrar_cache("extracoes", 0, 1)
+                return None
+
+            # Atualiza o último acesso para a política LRU
+            self.conn.execute("UPDATE extracoes SET acessado_em = ? WHERE chave = ?;", (time.time(), chave))
+            self.conn.commit()
+            self.acertos += 1
+        metricas.registrar_cache("extracoes", 1, 0)
+        return blocos
+
+    def gravar(self, hash_objeto, versao, blocos):
+        dados = zlib.compress(json.dumps(blocos, ensure_ascii=False).encode("utf-8"))
+        chave = self.chave(hash_objeto, versao)
+        with self._lock:
+            anterior = self.conn.execute("SELECT tamanho FROM extracoes WHERE chave = ?;", (chave,)).fetchone()
+            self.conn.execute(
+                "INSERT OR REPLACE INTO extracoes (chave, blocos, tamanho, acessado_em) VALUES (?, ?, ?, ?);",
+                (chave, dados, len(dados), time.time())
+            )
+            self.conn.commit()
+            if anterior is None:
+                self._itens += 1
+            self._bytes += len(dados) - (anterior[0] if anterior else 0)
+            if self._bytes > self.max_bytes:
+                self._remover_antigos()
+
+    def _remover_antigos(self):
+        # Remove até 90% do limite para não executar a remoção a cada inserção
+        limite = int(self.max_bytes * 0.9)
+        removidos = 0
+        for chave, tamanho in self.conn.execute(
+            "SELECT chave, tamanho FROM extracoes ORDER BY acessado_em ASC;"
+        ).fetchall():
+            if self._bytes <= limite:
+                break
+            self.conn.execute("DELETE FROM extracoes WHERE chave = ?;", (chave,))
+            self._bytes -= tamanho
+            self._itens -= 1
+            removidos += 1
+        self.conn.commit()
+        logger.info("Cache de extrações: %s itens removidos por LRU.", removidos)
+
+    def taxa_acerto(self):
+        total = self.acertos + self.falhas
+        return self.acertos / total if total else 0.0
+
+    def estatisticas(self):
+        return {
+            "acertos": self.acertos,
+            "falhas": self.falhas,
+            "taxa_acerto": self.taxa_acerto(),
+            "itens": self._itens,
+            "bytes": self._bytes
+        }
@@ -0,0 +1,254 @@
+import os
+import time
+import select
+import logging
+import threading
+import psycopg2
+from psycopg2 import sql
+from datetime import datetime
+import metricas
+
+# Configuração do logger
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+class FilaPostgres:
+    """
+    Acesso à tabela fila_rag: reserva por lease com FOR UPDATE SKIP LOCKED,
+    conclusão e separação dos itens, profundidade da fila e escuta do canal de
+    LISTEN/NOTIFY. Cada thread usa a sua própria conexão.
+    """
+
+    def __init__(self):
+        # Deve coincidir com o argumento do gatilho trg_fila_rag_notificar
+        self.canal_notificacao = os.getenv("FILA_CANAL", "fila_rag")
+        self._local = threading.local()
+
+        try:
+            self._conexao()
+            logger.info("Conexão com PostgreSQL estabelecida com sucesso.")
+        except Exception as e:
+            logger.error("Erro ao conectar ao PostgreSQL: %s", e)
+            raise
+
+    def _conectar(self):
+        return psycopg2.connect(
+            host=os.getenv("PG_HOST"),
+            port=os.getenv("PG_PORT"),
+            dbname=os.getenv("PG_DATABASE"),
+            user=os.getenv("PG_USER"),
+            password=os.getenv("PG_PASSWORD")
+        )
+
+    def _conexao(self):
+        """
+        Retorna a conexão PostgreSQL da thread atual, abrindo-a se necessário.
+        """
+        conn = getattr(self._local, "pg_conn", None)
+        if conn is None or conn.closed:
+            conn = self._conectar()
+            self._local.pg_conn = conn
+        return conn
+
+    def reservar(self, worker_id, limite, lease_segundos, max_tentativas):
+        """
+        Reserva atomicamente um lote de itens pendentes para o worker.
+
+        Usa FOR UPDATE SKIP LOCKED para que vários workers (e contêineres) drenem
+        a mesma tabela sem disputar linhas. Um item só é reservado quando não há
+        item anterior pendente do mesmo documento, para que inclusões e exclusões
+        de um documento não sejam aplicadas fora de ordem por workers distintos.
+        Itens cuja reserva expirou, por queda do worker que os reservou ou falha
+        na gravação do lote, voltam a ser elegíveis; enquanto o worker processa o
+        lote, a reserva é estendida por renovar(). Cada reserva conta uma
+        tentativa; itens que esgotaram max_tentativas sem conclusão são separados
+        em vez de reservados.
+
+        :param worker_id: Identificador do worker que reserva os itens.
+        :param limite: Quantidade máxima de itens reservados.
+        :param lease_segundos: Duração da reserva.
+        :param max_tentativas: Reservas permitidas por item.
+        :return: Lista de tuplas (id, referencia, documento, tipo, acao, conteudo, tentativas).
+        """
+        conn = self._conexao()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("""
+                    UPDATE fila_rag
+                    SET data_hora_erro = now(),
+                        erro = 'Tentativas esgotadas (' || tentativas || ')' || COALESCE(': ' || erro, ''),
+                        reservado_ate = NULL
+                    WHERE id IN (
+                        SELECT id
+                        FROM fila_rag
+                        WHERE data_hora_processamento IS NULL
+                          AND data_hora_erro IS NULL
+                          AND tentativas >= %s
+                          AND (reservado_ate IS NULL OR reservado_ate < now())
+                        FOR UPDATE SKIP LOCKED
+                    )
+                    RETURNING id, tipo, acao;
+                """, (max_tentativas,))
+                esgotados = cursor.fetchall()
+                cursor.execute("""
+                    UPDATE fila_rag
+                    SET reservado_por = %s,
+                        reservado_ate = now() + make_interval(secs => %s),
+                        tentativas = tentativas + 1
+                    WHERE id IN (
+                        SELECT id
+                        FROM fila_rag f
+                        WHERE data_hora_processamento IS NULL
+                          AND data_hora_erro IS NULL
+                          AND (reservado_ate IS NULL OR reservado_ate < now())
+                          -- Itens de um documento são aplicados na ordem de inserção:
+                          -- nenhum item anterior do mesmo documento (ou da referência
+                          -- inteira, sem documento) pode estar pendente
+                          AND NOT EXISTS (
+                              SELECT 1
+                              FROM fila_rag anterior
+                              WHERE anterior.referencia = f.referencia
+                                AND (anterior.documento IS NOT DISTINCT FROM f.documento
+                                     OR anterior.documento IS NULL OR f.documento IS NULL)
+                                AND (anterior.data_hora, anterior.id) < (f.data_hora, f.id)
+                                AND anterior.data_hora_processamento IS NULL
+                                AND anterior.data_hora_erro IS NULL
+                          )
+                        ORDER BY data_hora ASC
+                        LIMIT %s
+                        FOR UPDATE SKIP LOCKED
+                    )
+                    RETURNING id, referencia, documento, tipo, acao, conteudo, tentativas, data_hora;
+                """, (worker_id, lease_segundos, limite))
+                itens = cursor.fetchall()
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            logger.error("Erro ao reservar itens da fila: %s", e)
+            return []
+
+        for id_fila, tipo, acao in esgotados:
+            logger.warning("Item %s separado da fila: tentativas esgotadas.", id_fila)
+            metricas.INGESTAO_ITENS.labels(tipo, acao, "separado").inc()
+
+        # RETURNING não preserva a ordem da subconsulta
+        itens.sort(key=lambda item: item[7])
+        return [item[:7] for item in itens]
+
+    def renovar(self, ids, worker_id, lease_segundos):
+        """
+        Estende a reserva dos itens que o worker ainda está processando.
+
+        :param ids: IDs dos itens reservados pelo worker.
+        :param worker_id: Identificador do worker que reservou os itens.
+        :param lease_segundos: Nova duração da reserva, a partir de agora.
+        :return: Quantidade de itens cuja reserva foi estendida.
+        """
+        conn = self._conexao()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("""
+                    UPDATE fila_rag
+                    SET reservado_ate = now() + make_interval(secs => %s)
+                    WHERE id = ANY(%s)
+                      AND reservado_por = %s
+                      AND data_hora_processamento IS NULL
+                      AND data_hora_erro IS NULL;
+                """, (lease_segundos, list(ids), worker_id))
+                renovados = cursor.rowcount
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        return renovados
+
+    def marcar(self, id_fila, worker_id):
+        conn = self._conexao()
+        try:
+            with conn.cursor() as cursor:
+                # Atualiza status no PostgreSQL, apenas se a reserva ainda for deste worker
+                cursor.execute("""
+                    UPDATE fila_rag
+                    SET data_hora_processamento = %s,
+                        reservado_ate = NULL
+                    WHERE id = %s AND reservado_por = %s;
+                """, (datetime.now(), id_fila, worker_id))
+                if cursor.rowcount == 0:
+                    logger.warning("Reserva do item %s expirou antes da conclusão pelo worker %s", id_fila, worker_id)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+    def separar(self, id_fila, worker_id, erro):
+        """
+        Retira o item da fila registrando o erro. Para reprocessá-lo, basta limpar
+        data_hora_erro.
+        """
+        conn = self._conexao()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("""
+                    UPDATE fila_rag
+                    SET data_hora_erro = %s,
+                        erro = %s,
+                        reservado_ate = NULL
+                    WHERE id = %s AND reservado_por = %s;
+                """, (datetime.now(), erro, id_fila, worker_id))
+            conn.commit()
+            logger.warning("Item %s separado da fila: %s", id_fila, erro)
+        except Exception as e:
+            conn.rollback()
+            logger.error("Erro ao separar item %s da fila: %s", id_fila, e)
+
+    def pendentes(self):
+        """
+        :return: Tupla (itens pendentes, idade do mais antigo em segundos).
+        """
+        conn = self._conexao()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("""
+                    SELECT count(*), COALESCE(EXTRACT(EPOCH FROM now() - min(data_hora)), 0)
+                    FROM fila_rag
+                    WHERE data_hora_processamento IS NULL
+                      AND data_hora_erro IS NULL;
+                """)
+                quantidade, idade = cursor.fetchone()
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        return quantidade, float(idade)
+
+    def ouvir(self, notificar):
+        """
+        Mantém uma conexão dedicada em LISTEN no canal da fila e chama notificar
+        a cada NOTIFY. Reconecta em caso de falha; não retorna.
+
+        :param notificar: Função sem argumentos chamada a cada notificação.
+        """
+        while True:
+            conn = None
+            try:
+                conn = self._conectar()
+                conn.set_isolation_level(psycopg2.extensions.ISOLATION_LEVEL_AUTOCOMMIT)
+                with conn.cursor() as cursor:
+                    cursor.execute(sql.SQL("LISTEN {};").format(sql.Identifier(self.canal_notificacao)))
+                logger.info("Aguardando notificações no canal %s", self.canal_notificacao)
+
+                # Itens inseridos enquanto o ouvinte estava desconectado
+                notificar()
+                while True:
+                    if select.select([conn], [], [], 60) == ([], [], []):
+                        continue
+                    conn.poll()
+                    if conn.notifies:
+                        conn.notifies.clear()
+                        notificar()
+            except Exception as e:
+                logger.error("Erro no ouvinte de notificações da fila: %s", e)
+                time.sleep(5)
+            finally:
+                if conn is not None and not conn.closed:
+                    conn.close()
@@ -1,93 +1,82 @@
 import os
-import spacy
 import json
+import time
+import socket
 import logging
-import psycopg2
+import threading
+import httpx
+import urllib3
 import fitz
-from datetime import datetime
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 from apscheduler.schedulers.background import BackgroundScheduler
+from prometheus_client import start_http_server
 from minio import Minio
 from qdrant_client import QdrantClient
 from qdrant_client.http.models import Distance, VectorParams, models
-from langchain_qdrant import QdrantVectorStore
-from langchain_openai import OpenAIEmbeddings
-from binaryProcessor import PDFProcessor, ImageProcessor, AudioProcessor, VideoProcessor, FormatSupport
+from langchain_openai import OpenAIEmbeddings, ChatOpenAI
+from embeddingCache import EmbeddingCache
+from filaPostgres import FilaPostgres
+from extracaoCache import ExtracaoCache
+from embeddingProcessor import EmbeddingProcessor
+from qdrantCollection import QdrantCollection
+from indiceLexico import IndiceLexico
+from respostaCache import RespostaCache
+from resumoCaso import ResumoCaso
+from agendadorOpenAI import AgendadorOpenAI
+from binaryProcessor import FormatSupport, ExtracaoPool
+from minioDownload import MinioDownload
+from contentProcessor import ContentProcessor
+import metricas
 
 # Configuração do logger
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-class ContentProcessor:
-    def __init__(self):
-        # Inicializa o spaCy com o modelo de português
-        try:
-            self.nlp = spacy.load("pt_core_news_sm")
-            logger.info("Modelo spaCy carregado com sucesso.")
-        except Exception as e:
-            logger.error("Erro ao carregar o modelo spaCy: %s", e)
-            raise
+class FilaProcessor:
+    """
+    Drena a fila_rag com um pool de workers: extrai, divide e grava no Qdrant
+    os itens reservados. A fila e o cliente do MinIO podem ser injetados; por
+    padrão são criados a partir das variáveis de ambiente. As threads de escuta,
+    o agendador e o servidor de métricas só sobem em iniciar().
+    """
 
-    def dividir_por_frases(self, texto, max_tokens=500):
+    def __init__(self, fila=None, minio_client=None):
         """
-        Divide o texto em blocos com base em frases e limite de tokens.
-
-        :param texto: Texto completo a ser dividido.
-        :param max_tokens: Número máximo de tokens por bloco.
-        :return: Lista de blocos de texto.
+        :param fila: Fila com a interface de FilaPostgres; por padrão, a tabela fila_rag.
+        :param minio_client: Cliente do MinIO; por padrão, configurado por MINIO_HOST.
         """
-        try:
-            doc = self.nlp(texto)  # Processar o texto
-            frases = [sent.text for sent in doc.sents]  # Extrair frases
-            blocos = []
-            bloco_atual = []
-
-            token_count = 0
-            for frase in frases:
-                num_tokens = len(frase.split())  # Contar palavras como proxy para tokens
-                if token_count + num_tokens > max_tokens:
-                    # Salvar o bloco atual e reiniciar
-                    blocos.append(" ".join(bloco_atual))
-                    bloco_atual = []
-                    token_count = 0
-
-                # Adicionar a frase ao bloco atual
-                bloco_atual.append(frase)
-                token_count += num_tokens
-
-            # Adicionar o último bloco
-            if bloco_atual:
-                blocos.append(" ".join(bloco_atual))
-
-            return blocos
-        except Exception as e:
-            logger.error("Erro ao dividir texto em frases: %s", e)
-            return []
+        # Configuração dos workers da fila
+        self.num_workers = int(os.getenv("FILA_WORKERS", 4))
+        self.tamanho_lote = int(os.getenv("FILA_LOTE", 10))
+        self.lease_segundos = int(os.getenv("FILA_LEASE_SEGUNDOS", 600))
+        self.max_tentativas = int(os.getenv("FILA_MAX_TENTATIVAS", 5))
+        self.worker_id = f"{socket.gethostname()}-{os.getpid()}"
+        self.intervalo_minutos = int(os.getenv("FILA_INTERVALO_MINUTOS", 30))
+        self._evento_fila = threading.Event()
 
-class FilaProcessor:
-    def __init__(self):
-        try:
-            # Configuração do PostgreSQL
-            self.pg_conn = psycopg2.connect(
-                host=os.getenv("PG_HOST"),
-                port=os.getenv("PG_PORT"),
-                dbname=os.getenv("PG_DATABASE"),
-                user=os.getenv("PG_USER"),
-                password=os.getenv("PG_PASSWORD")
-            )
-            self.pg_cursor = self.pg_conn.cursor()
-            logger.info("Conexão com PostgreSQL estabelecida com sucesso.")
-        except Exception as e:
-            logger.error("Erro ao conectar ao PostgreSQL: %s", e)
-            raise
+        # Itens reservados por worker, cujas reservas são renovadas até o fim do lote
+        self._reservas = {}
+        self._reservas_lock = threading.Lock()
+
+        # Configuração do PostgreSQL (cada worker abre a sua conexão)
+        self.fila = fila if fila is not None else FilaPostgres()
 
         try:
             # Configuração do MinIO
-            self.minio_client = Minio(
+            self.minio_client = minio_client if minio_client is not None else Minio(
                 os.getenv("MINIO_HOST"),
                 access_key=os.getenv("MINIO_USER"),
                 secret_key=os.getenv("MINIO_PASSWORD"),
-                secure=False
+                secure=False,
+                # Pool de conexões HTTP reutilizado entre os itens, uma por worker
+                http_client=urllib3.PoolManager(
+                    maxsize=self.num_workers,
+                    timeout=urllib3.Timeout(connect=10, read=300),
+                    retries=urllib3.Retry(total=5, backoff_factor=0.2, status_forcelist=[500, 502, 503, 504])
+                )
             )
+            self.download = MinioDownload(self.minio_client)
             logger.info("Conexão com MinIO estabelecida com sucesso.")
         except Exception as e:
             logger.error("Erro ao conectar ao MinIO: %s", e)
@@ -99,154 +88,466 @@ class FilaProcessor:
                 url=os.getenv("QDRANT_URL", "http://localhost:6333"),
                 api_key=os.getenv("QDRANT_API_KEY")
             )
+
+            # Cria ou valida a collection, com índices de payload
+            colecao = QdrantCollection(self.qdrant_client, "investigacao")
+            colecao.garantir()
+
+            # Vetores esparsos (BM25) da busca híbrida, gravados junto aos embeddings
+            self.indice_lexico = IndiceLexico() if colecao.lexico else None
+
+            # Cache de respostas da API, invalidado quando os documentos de uma referência mudam
+            self.resposta_cache = RespostaCache(self.qdrant_client)
+            self.resposta_cache.garantir()
             
+            # Chamadas à OpenAI limitadas pelo agendador, que lê os cabeçalhos de
+            # limite das respostas e faz as novas tentativas (o cliente não repete)
+            self.agendador = AgendadorOpenAI()
+            self.http_client = httpx.Client(
+                timeout=float(os.getenv("HTTP_TIMEOUT", 120)), event_hooks=self.agendador.ganchos_http()
+            )
+
             # Configuração de embeddings com OpenAI
             self.embeddings = OpenAIEmbeddings(
                 model="text-embedding-ada-002",
-                openai_api_key=os.getenv("OPENAI_API_KEY")
+                openai_api_key=os.getenv("OPENAI_API_KEY"),
+                max_retries=0,
+                http_client=self.http_client
             )
-            
-            # Configuração do VectorStore com Qdrant
-            self.vectorstore = QdrantVectorStore(
-                client=self.qdrant_client,
-                collection_name="investigacao",
-                embedding=self.embeddings
+
+            # Resumos hierárquicos por documento e referência, atualizados após as alterações
+            self.resumos = ResumoCaso(
+                self.qdrant_client,
+                ChatOpenAI(
+                    model=os.getenv("RESUMO_MODELO", "gpt-4"),
+                    temperature=0,
+                    max_tokens=int(os.getenv("RESUMO_MAX_TOKENS_SAIDA", 800)),
+                    openai_api_key=os.getenv("OPENAI_API_KEY"),
+                    max_retries=0,
+                    http_client=self.http_client
+                ),
+                agendador=self.agendador
             )
-            logger.info("Qdrant VectorStore configurado com sucesso.")
+            self.resumos.garantir()
+
+            # Cache local de embeddings, compartilhado pelos workers
+            self.embedding_cache = EmbeddingCache()
+
+            # Cache dos blocos extraídos de binários, pelo hash do objeto no MinIO
+            self.extracao_cache = ExtracaoCache()
         except Exception as e:
             logger.error("Erro ao configurar Qdrant: %s", e)
             raise
         
-        # Processadores especializados
-        self.pdf_processor = PDFProcessor()
-        self.image_processor = ImageProcessor()
-        self.audio_processor = AudioProcessor()
-        self.video_processor = VideoProcessor()
-        self.content_processor = ContentProcessor()
+        # Processadores especializados; a extração de binários roda em um pool de processos
+        self.extracao = ExtracaoPool()
+        self.content_processor = ContentProcessor(self.embeddings.model)
+
+        # Pool de workers que drenam a fila em paralelo
+        self.executor = ThreadPoolExecutor(max_workers=self.num_workers, thread_name_prefix="fila")
+
+        # Renovação das reservas: um item longo (extração de até EXTRACAO_TIMEOUT_SEGUNDOS)
+        # ou o restante do lote não podem perder a reserva para outro worker
+        self._renovador = threading.Thread(target=self._renovar_reservas, name="fila-renovador", daemon=True)
+        self._renovador.start()
+
+    def iniciar(self):
+        """
+        Sobe o despachante, o ouvinte de notificações, o agendador e o servidor
+        de métricas do Prometheus.
+        """
+        # Despachante: executa processar_fila sempre que a fila for sinalizada
+        self._despachante = threading.Thread(target=self._despachar, name="fila-despachante")
+        self._despachante.start()
+        self.notificar_fila()
 
-        self.processar_fila()
+        # Ouvinte de LISTEN/NOTIFY para acordar os workers assim que houver inserções
+        self._ouvinte = threading.Thread(
+            target=self.fila.ouvir, args=(self.notificar_fila,), name="fila-ouvinte", daemon=True
+        )
+        self._ouvinte.start()
 
-        # Agendador
+        # Agendador: varredura periódica apenas como rede de segurança
         self.scheduler = BackgroundScheduler()
-        self.scheduler.add_job(self.processar_fila, 'interval', minutes=5)
+        self.scheduler.add_job(self.notificar_fila, 'interval', minutes=self.intervalo_minutos)
+
+        # Resumos das referências alteradas, fora do caminho da ingestão
+        self.scheduler.add_job(
+            self.atualizar_resumos, 'interval', seconds=int(os.getenv("RESUMO_INTERVALO_SEGUNDOS", 60))
+        )
+
+        # Expiração e LRU do cache de respostas, fora do caminho das consultas
+        self.scheduler.add_job(
+            self.limpar_cache_respostas, 'interval', seconds=int(os.getenv("RESPOSTA_CACHE_LIMPEZA_SEGUNDOS", 300))
+        )
+
+        # Métricas do Prometheus em porta própria, com a profundidade da fila atualizada periodicamente
+        self.scheduler.add_job(
+            self.atualizar_metricas_fila, 'interval', seconds=int(os.getenv("METRICAS_INTERVALO_SEGUNDOS", 15))
+        )
         self.scheduler.start()
         logger.info("Agendador configurado e iniciado.")
 
-    def processar_fila(self):
-        logger.info("Iniciando processamento da fila...")
+        porta_metricas = int(os.getenv("METRICAS_PORTA_FILA", 9101))
+        start_http_server(porta_metricas)
+        logger.info("Métricas do Prometheus disponíveis na porta %s.", porta_metricas)
+
+    def notificar_fila(self):
+        """
+        Sinaliza que há trabalho na fila. Sinais recebidos durante uma drenagem
+        são agrupados em uma única nova execução.
+        """
+        self._evento_fila.set()
+
+    def _despachar(self):
+        while True:
+            self._evento_fila.wait()
+            self._evento_fila.clear()
+            try:
+                self.processar_fila()
+            except Exception as e:
+                logger.error("Erro ao processar a fila: %s", e)
 
+    @contextmanager
+    def _reservando(self, worker_id, ids):
+        """
+        Mantém a reserva dos itens do lote renovada enquanto o bloco executa.
+        """
+        with self._reservas_lock:
+            self._reservas[worker_id] = list(ids)
         try:
-            # Buscar itens pendentes
-            self.pg_cursor.execute("""
-                SELECT id, referencia, documento, tipo, acao, conteudo
-                FROM fila_rag
-                WHERE data_hora_processamento IS NULL
-                ORDER BY data_hora ASC
-                LIMIT 10;
-            """)
-            itens = self.pg_cursor.fetchall()
+            yield
+        finally:
+            with self._reservas_lock:
+                self._reservas.pop(worker_id, None)
+
+    def _renovar_reservas(self):
+        """
+        Estende, a cada terço de FILA_LEASE_SEGUNDOS, as reservas dos lotes em
+        processamento. Itens concluídos ou separados são ignorados pela fila.
+        """
+        intervalo = max(1, self.lease_segundos / 3)
+        while True:
+            time.sleep(intervalo)
+            with self._reservas_lock:
+                reservas = list(self._reservas.items())
+            for worker_id, ids in reservas:
+                try:
+                    self.fila.renovar(ids, worker_id, self.lease_segundos)
+                except Exception as e:
+                    logger.error("Erro ao renovar a reserva dos itens do worker %s: %s", worker_id, e)
+
+    def atualizar_metricas_fila(self):
+        """
+        Atualiza as métricas de itens pendentes e da idade do mais antigo.
+        """
+        try:
+            pendentes, idade = self.fila.pendentes()
+            metricas.FILA_PENDENTES.set(pendentes)
+            metricas.FILA_IDADE_MAIS_ANTIGO.set(idade)
         except Exception as e:
-            logger.error("Erro ao buscar itens da fila: %s", e)
-            return
+            logger.error("Erro ao atualizar as métricas da fila: %s", e)
 
-        for item in itens:
-            id_fila, referencia, documento, tipo, acao, conteudo = item
-            logger.info("Processando item %s, referência: %s, documento: %s, ação: %s", id_fila, referencia, documento, acao)
+    def atualizar_resumos(self):
+        """
+        Atualiza os resumos das referências alteradas e remove do cache as
+        respostas dadas a partir dos resumos anteriores.
+        """
+        try:
+            atualizadas = self.resumos.atualizar_pendentes()
+            self.resposta_cache.invalidar(atualizadas)
+        except Exception as e:
+            logger.error("Erro ao atualizar os resumos: %s", e)
 
+    def limpar_cache_respostas(self):
+        try:
+            self.resposta_cache.limpar()
+        except Exception as e:
+            logger.error("Erro ao limpar o cache de respostas: %s", e)
+
+    def processar_fila(self):
+        logger.info("Iniciando processamento da fila com %s worker(s)...", self.num_workers)
+
+        futuros = [self.executor.submit(self._drenar_fila, n) for n in range(self.num_workers)]
+        total = 0
+        for futuro in futuros:
             try:
-                if acao == 'I':  # Incluir
-                    if tipo == 'E':  # Dados estruturados
-                        self.processar_estruturado(id_fila, referencia, documento, conteudo)
-                    elif tipo == 'B':  # Binários
-                        self.processar_binario(id_fila, referencia, documento, conteudo)
-                elif acao == 'E':  # Excluir
-                    self.remover_do_rag(id_fila)
-
-                # Atualiza status no PostgreSQL
-                self.pg_cursor.execute("""
-                    UPDATE fila_rag
-                    SET data_hora_processamento = %s
-                    WHERE id = %s;
-                """, (datetime.now(), id_fila))
-                self.pg_conn.commit()
-                logger.info("Item %s processado com sucesso.", id_fila)
+                total += futuro.result()
             except Exception as e:
-                logger.error("Erro ao processar item %s: %s", id_fila, e)
+                logger.error("Erro em worker da fila: %s", e)
+
+        logger.info("Processamento da fila concluído. Itens processados: %s", total)
+
+    def _drenar_fila(self, num_worker):
+        """
+        Reserva e processa lotes da fila até que não haja itens disponíveis.
+
+        :param num_worker: Índice do worker neste nó.
+        :return: Quantidade de itens processados com sucesso.
+        """
+        worker_id = f"{self.worker_id}-{num_worker}"
+        lote = EmbeddingProcessor(
+            self.embeddings, self.qdrant_client, "investigacao", self.embedding_cache, self.indice_lexico,
+            self.agendador
+        )
+        processados = 0
+        while True:
+            itens = self.fila.reservar(worker_id, self.tamanho_lote, self.lease_segundos, self.max_tentativas)
+            if not itens:
+                lote.registrar_vazao()
+                self._registrar_cache_extracao()
+                return processados
+
+            with self._reservando(worker_id, [item[0] for item in itens]):
+                divididos = self._dividir_estruturados(itens)
+                concluidos = [
+                    item for item in itens if self.processar_item(item, worker_id, lote, divididos.get(item[0]))
+                ]
+
+                # Os itens só são marcados depois que os blocos do lote estão no Qdrant
+                try:
+                    lote.descarregar()
+                except Exception as e:
+                    # Nenhum item do lote é marcado: voltam à fila quando a reserva expirar
+                    logger.error("Erro ao gravar blocos do lote no Qdrant: %s", e)
+                    lote.retirar_falhas()
+                    continue
+
+                # Itens com blocos em uma gravação que falhou durante o lote permanecem pendentes
+                falhas = lote.retirar_falhas()
+                if falhas:
+                    logger.warning("Itens %s permanecem pendentes: a gravação dos seus blocos falhou.", sorted(falhas))
+                    concluidos = [item for item in concluidos if item[0] not in falhas]
 
-        logger.info("Processamento da fila concluído.")
+                # Respostas em cache das referências alteradas deixam de valer
+                try:
+                    self.resposta_cache.invalidar(item[1] for item in concluidos)
+                except Exception as e:
+                    logger.error("Erro ao invalidar o cache de respostas: %s", e)
 
-    def processar_estruturado(self, id_fila, referencia, documento, conteudo):
+                # Os resumos dessas referências são refeitos por atualizar_resumos
+                try:
+                    self.resumos.marcar_pendentes(item[1] for item in concluidos)
+                except Exception as e:
+                    logger.error("Erro ao marcar resumos pendentes: %s", e)
+
+                for id_fila in (item[0] for item in concluidos):
+                    try:
+                        self.fila.marcar(id_fila, worker_id)
+                        processados += 1
+                        logger.info("Item %s processado com sucesso.", id_fila)
+                    except Exception as e:
+                        logger.error("Erro ao marcar item %s como processado: %s", id_fila, e)
+
+    def _dividir_estruturados(self, itens):
+        """
+        Divide em blocos, de uma vez (nlp.pipe), os textos das inclusões de
+        dados estruturados do lote. Se a divisão em lote falhar, cada item é
+        dividido por processar_estruturado, onde o erro é atribuído ao item.
+
+        :return: Dicionário {id do item: blocos}.
+        """
+        estruturados = [
+            (id_fila, conteudo) for id_fila, _, _, tipo, acao, conteudo, _ in itens
+            if tipo == 'E' and acao == 'I' and isinstance(conteudo, str)
+        ]
+        if not estruturados:
+            return {}
         try:
-            logger.info("Processando dados estruturados: %s, documento: %s", referencia, documento)
-            blocos = self.content_processor.dividir_por_frases(conteudo)
-
-            for idx, bloco in enumerate(blocos):
-                # Gerar embedding do texto
-                embedding_vector = self.embeddings.embed_query(bloco)
-                
-                self.vectorstore.add_texts(
-                    texts=[bloco],
-                    embeddings=[embedding_vector],
-                    metadatas=[{
-                        "id_fila": id_fila,
-                        "referencia": referencia,
-                        "documento": documento,
-                        "bloco_id": idx
-                    }]
-                )
-            logger.info("Dados estruturados armazenados no Weaviate para ID %s", id_fila)
+            with metricas.INGESTAO_ETAPA_SEGUNDOS.labels("divisao").time():
+                blocos = self.content_processor.dividir_varios([conteudo for _, conteudo in estruturados])
         except Exception as e:
-            logger.error("Erro ao processar dados estruturados %s: %s", referencia, e)
+            logger.error("Erro ao dividir em lote os textos estruturados; divisão por item: %s", e)
+            return {}
+        return {id_fila: blocos_item for (id_fila, _), blocos_item in zip(estruturados, blocos)}
+
+    def processar_item(self, item, worker_id, lote, blocos=None):
+        """
+        Processa um item reservado. Os blocos de inclusões são enfileirados em
+        lote e gravados em descarregar(); o item é marcado pelo chamador.
+        Inclusões estruturadas podem receber os blocos já divididos em lote.
+
+        Erros de dados (conteúdo inválido, chave ausente, extração sem texto) e
+        prazos esgotados separam o item na hora; os demais o deixam reservado
+        até o fim do lease, para nova tentativa, até FILA_MAX_TENTATIVAS.
+
+        :return: True se o item foi processado sem erros.
+        """
+        id_fila, referencia, documento, tipo, acao, conteudo, tentativas = item
+        logger.info("Processando item %s, referência: %s, documento: %s, ação: %s", id_fila, referencia, documento, acao)
 
-    def processar_binario(self, id_fila, referencia, documento, conteudo):
         try:
-            data = json.loads(conteudo)
-            bucket, file_hash = data["bucket"], data["hash"]
-            logger.info("Baixando binário %s do bucket %s", file_hash, bucket)
-
-            # Download do arquivo
-            arquivo_destino = f"/tmp/{file_hash}"
-            self.minio_client.fget_object(bucket, file_hash, arquivo_destino)
-
-            # Identificar tipo e processar
-            tipo_arquivo = FormatSupport.verificar_formato(arquivo_destino)
-            if tipo_arquivo == "pdf":
-                texto = self.pdf_processor.processar_pdf(arquivo_destino)
-            elif tipo_arquivo == "imagem":
-                texto = self.image_processor.processar_imagem(arquivo_destino)
-            elif tipo_arquivo == "audio":
-                texto = self.audio_processor.processar_audio(arquivo_destino)
-            elif tipo_arquivo == "video":
-                texto = self.video_processor.processar_video(arquivo_destino)
-            else:
-                logger.warning("Tipo de arquivo não suportado: %s", file_hash)
-                return
-
-            # Dividir o texto em blocos e armazenar no Weaviate
-            blocos = self.content_processor.dividir_por_frases(texto)
-            for idx, bloco in enumerate(blocos):
-                self.vectorstore.add_texts(
-                    texts=[bloco],
-                    metadatas=[{
-                        "id_fila": id_fila,
-                        "referencia": referencia,
-                        "documento": documento,
-                        "bloco_id": idx
-                    }]
-                )
-            logger.info("Binário processado e armazenado no Weaviate para ID %s", id_fila)
+            if acao == 'I':  # Incluir
+                if tipo == 'E':  # Dados estruturados
+                    self.processar_estruturado(id_fila, referencia, documento, conteudo, lote, blocos)
+                elif tipo == 'B':  # Binários
+                    self.processar_binario(id_fila, referencia, documento, conteudo, lote)
+            elif acao == 'E':  # Excluir
+                self.remover_do_rag(id_fila, referencia, documento, conteudo, lote)
+            metricas.INGESTAO_ITENS.labels(tipo, acao, "sucesso").inc()
+            return True
+        except TimeoutError as e:
+            # Item travado é separado para não voltar a ocupar o pool de extração
+            logger.error("Tempo esgotado ao processar item %s: %s", id_fila, e)
+            self.fila.separar(id_fila, worker_id, str(e))
+            metricas.INGESTAO_ITENS.labels(tipo, acao, "separado").inc()
+            return False
+        except (ValueError, KeyError) as e:
+            # Erros do próprio item (inclui json.JSONDecodeError) não mudam com novas tentativas
+            logger.error("Item %s inválido: %r", id_fila, e)
+            self.fila.separar(id_fila, worker_id, repr(e))
+            metricas.INGESTAO_ITENS.labels(tipo, acao, "separado").inc()
+            return False
         except Exception as e:
-            logger.error("Erro ao processar binário %s: %s", id_fila, e)
+            if tentativas >= self.max_tentativas:
+                logger.error("Erro ao processar item %s na última tentativa: %s", id_fila, e)
+                self.fila.separar(id_fila, worker_id, f"Tentativas esgotadas ({tentativas}): {e}")
+                metricas.INGESTAO_ITENS.labels(tipo, acao, "separado").inc()
+                return False
+            # A reserva não é liberada: o item volta à fila quando ela expirar
+            logger.error("Erro ao processar item %s (tentativa %s de %s): %s", id_fila, tentativas, self.max_tentativas, e)
+            metricas.INGESTAO_ITENS.labels(tipo, acao, "erro").inc()
+            return False
 
-    def remover_do_rag(self, id_fila):
-        try:
-            logger.info("Removendo ID %s do RAG", id_fila)
-            self.qdrant_client.delete(
-                collection_name="investigacao",
-                points_selector={"id": str(id_fila)}
+    def _metadados_blocos(self, id_fila, referencia, documento, blocos):
+        return [{
+            "id_fila": id_fila,
+            "referencia": referencia,
+            "documento": documento,
+            "bloco_id": idx
+        } for idx in range(len(blocos))]
+
+    def _metadados_stream(self, id_fila, referencia, documento, blocos):
+        """
+        Completa os metadados de blocos (texto, metadados próprios do bloco).
+        """
+        for idx, (bloco, extras) in enumerate(blocos):
+            yield bloco, {
+                **extras,
+                "id_fila": id_fila,
+                "referencia": referencia,
+                "documento": documento,
+                "bloco_id": idx
+            }
+
+    def processar_estruturado(self, id_fila, referencia, documento, conteudo, lote, blocos=None):
+        # Erros são tratados em processar_item: o item não é marcado como processado
+        logger.info("Processando dados estruturados: %s, documento: %s", referencia, documento)
+        if blocos is None:
+            with metricas.INGESTAO_ETAPA_SEGUNDOS.labels("divisao").time():
+                blocos = self.content_processor.dividir_por_frases(conteudo)
+
+        # Enfileirar os blocos para embedding e gravação em lote
+        lote.adicionar(blocos, self._metadados_blocos(id_fila, referencia, documento, blocos))
+        logger.info("Dados estruturados enfileirados para o Qdrant para ID %s", id_fila)
+
+    def processar_binario(self, id_fila, referencia, documento, conteudo, lote):
+        # Erros são tratados em processar_item: o item não é marcado como processado
+        data = json.loads(conteudo)
+        bucket, file_hash = data["bucket"], data["hash"]
+
+        # O hash é o endereço do conteúdo: o mesmo objeto anexado a outro
+        # procedimento reutiliza os blocos já extraídos, sem download nem OCR
+        versao = f"{self.extracao.versao()};blocos={ContentProcessor.VERSAO}"
+        blocos = self.extracao_cache.obter(file_hash, versao)
+        if blocos is not None:
+            logger.info("Blocos do binário %s encontrados no cache de extrações.", file_hash)
+            lote.sincronizar_documento(
+                referencia, documento, id_fila,
+                self._metadados_stream(id_fila, referencia, documento, blocos)
             )
-            logger.info("ID %s removido do Qdrant", id_fila)
-        except Exception as e:
-            logger.error("Erro ao remover ID %s do RAG: %s", id_fila, e)
+            return
+
+        # Identificar o tipo pelo nome do objeto, antes de qualquer download
+        tipo_arquivo = FormatSupport.verificar_formato(file_hash)
+        if tipo_arquivo is None:
+            logger.warning("Tipo de arquivo não suportado: %s", file_hash)
+            return
+
+        # Extrair o texto no pool de processos e dividi-lo em blocos à medida
+        # que as partes ficam prontas; os embeddings começam antes do fim da extração,
+        # mas os pontos só são gravados quando ela termina sem erros.
+        # As etapas se intercalam, então o tempo de cada uma é medido por item produzido
+        etapas = metricas.Etapas(metricas.INGESTAO_ETAPA_SEGUNDOS)
+        with etapas.medir("download"):
+            fonte = self.download.abrir(bucket, file_hash, tipo_arquivo)
+        with fonte:
+            if tipo_arquivo in ("audio", "video"):
+                # Blocos da transcrição guardam o intervalo de tempo no áudio
+                segmentos = etapas.iterar("extracao", self.extracao.extrair_segmentos(fonte))
+                blocos = self.content_processor.dividir_segmentos(segmentos)
+            else:
+                partes = etapas.iterar("extracao", self.extracao.extrair_partes(tipo_arquivo, fonte))
+                blocos = ((bloco, {}) for bloco in self.content_processor.dividir_por_frases_stream(partes))
+            blocos = self._gravar_no_cache(file_hash, versao, etapas.iterar("divisao", blocos))
+            lote.sincronizar_documento(
+                referencia, documento, id_fila,
+                self._metadados_stream(id_fila, referencia, documento, blocos)
+            )
+        etapas.registrar()
+        logger.info("Binário processado e enfileirado para o Qdrant para ID %s", id_fila)
+
+    def _gravar_no_cache(self, file_hash, versao, blocos):
+        """
+        Repassa os blocos gerados e os grava no cache de extrações quando a
+        extração termina sem erros.
+
+        :raises ValueError: Se nenhum bloco for extraído do binário; o resultado
+                            vazio não é gravado no cache.
+        """
+        extraidos = []
+        for bloco in blocos:
+            extraidos.append(bloco)
+            yield bloco
+        if not extraidos:
+            raise ValueError(f"Nenhum texto extraído do binário {file_hash}")
+        self.extracao_cache.gravar(file_hash, versao, extraidos)
+
+    def _registrar_cache_extracao(self):
+        estatisticas = self.extracao_cache.estatisticas()
+        if estatisticas["acertos"] or estatisticas["falhas"]:
+            logger.info(
+                "Cache de extrações: %s acertos, %s falhas (taxa de acerto %.1f%%), %s itens, %s bytes",
+                estatisticas["acertos"], estatisticas["falhas"], estatisticas["taxa_acerto"] * 100,
+                estatisticas["itens"], estatisticas["bytes"]
+            )
+
+    @staticmethod
+    def filtro_exclusao(referencia, documento, conteudo):
+        """
+        Monta o filtro de exclusão de um item com ação 'E'.
+
+        Se o conteúdo informar o ID do item de inclusão (JSON {"id_fila": N} ou apenas
+        o número), remove os blocos desse item. Apenas com o conteúdo vazio, remove
+        o documento informado na referência ou, sem documento, todos os blocos da
+        referência.
+
+        :raises ValueError: Se o conteúdo não for vazio nem informar um id_fila
+                            válido, para que um erro de digitação não amplie a exclusão.
+        """
+        if conteudo and conteudo.strip():
+            try:
+                alvo = json.loads(conteudo)
+            except ValueError:
+                raise ValueError(f"Conteúdo de exclusão inválido: {conteudo!r}")
+            if isinstance(alvo, dict) and "id_fila" in alvo:
+                alvo = alvo["id_fila"]
+            if not isinstance(alvo, int) or isinstance(alvo, bool):
+                raise ValueError(f"Conteúdo de exclusão sem id_fila válido: {conteudo!r}")
+            condicoes = [models.FieldCondition(key="metadata.id_fila", match=models.MatchValue(value=alvo))]
+        elif referencia:
+            condicoes = [models.FieldCondition(key="metadata.referencia", match=models.MatchValue(value=referencia))]
+            if documento:
+                condicoes.append(models.FieldCondition(key="metadata.documento", match=models.MatchValue(value=documento)))
+        else:
+            raise ValueError("Exclusão sem id_fila nem referência")
+        return models.Filter(must=condicoes)
+
+    def remover_do_rag(self, id_fila, referencia, documento, conteudo, lote):
+        filtro = self.filtro_exclusao(referencia, documento, conteudo)
+        logger.info("Exclusão do item %s enfileirada: %s", id_fila, filtro)
+        lote.excluir(filtro, id_fila)
+
 if __name__ == "__main__":
     processor = FilaProcessor()
+    processor.iniciar()
@@ -0,0 +1,74 @@
+import os
+import re
+import zlib
+import unicodedata
+from collections import Counter
+from qdrant_client.http import models
+from spacy.lang.pt.stop_words import STOP_WORDS
+
+# Nome do vetor esparso (BM25) na collection do RAG
+VETOR_LEXICO = "lexico"
+
+# Palavras e identificadores com separadores internos (2024.406, 123.456.789-00, 1234/2025)
+TERMO = re.compile(r"\w+(?:[./\-]\w+)*")
+SEPARADORES = re.compile(r"[./\-]")
+
+PALAVRAS_VAZIAS = {
+    "".join(c for c in unicodedata.normalize("NFKD", palavra) if not unicodedata.combining(c))
+    for palavra in STOP_WORDS
+}
+
+class IndiceLexico:
+    """
+    Gera os vetores esparsos da busca lexical (BM25) gravados junto aos blocos
+    no Qdrant.
+
+    O vetor de cada bloco contém a frequência saturada dos termos, normalizada
+    pelo tamanho do bloco (parâmetros k1 e b do BM25). O IDF é calculado pelo
+    próprio Qdrant (Modifier.IDF) na consulta, sobre os blocos da collection.
+    """
+
+    def __init__(self):
+        self.k1 = float(os.getenv("BM25_K1", 1.2))
+        self.b = float(os.getenv("BM25_B", 0.75))
+        self.media_termos = float(os.getenv("BM25_MEDIA_TERMOS", 250))
+
+    @staticmethod
+    def termos(texto):
+        """
+        Termos do texto em minúsculas e sem acentos, exceto palavras vazias.
+        Identificadores com separadores geram também a forma sem separadores,
+        para que "123.456.789-00" e "12345678900" se encontrem.
+        """
+        texto = unicodedata.normalize("NFKD", texto.lower())
+        texto = "".join(c for c in texto if not unicodedata.combining(c))
+        for termo in TERMO.findall(texto):
+            if termo in PALAVRAS_VAZIAS:
+                continue
+            yield termo
+            compacto = SEPARADORES.sub("", termo)
+            if compacto != termo:
+                yield compacto
+
+    @staticmethod
+    def id_termo(termo):
+        return zlib.crc32(termo.encode("utf-8")) & 0x7FFFFFFF
+
+    def vetor_documento(self, texto):
+        """
+        Vetor esparso de um bloco, com o peso BM25 (sem IDF) de cada termo.
+        """
+        frequencias = Counter(self.id_termo(termo) for termo in self.termos(texto))
+        tamanho = sum(frequencias.values())
+        normalizacao = self.k1 * (1 - self.b + self.b * tamanho / self.media_termos)
+        return models.SparseVector(
+            indices=list(frequencias),
+            values=[tf * (self.k1 + 1) / (tf + normalizacao) for tf in frequencias.values()]
+        )
+
+    def vetor_consulta(self, texto):
+        """
+        Vetor esparso de uma pergunta: cada termo distinto com peso 1.
+        """
+        indices = list(dict.fromkeys(self.id_termo(termo) for termo in self.termos(texto)))
+        return models.SparseVector(indices=indices, values=[1.0] * len(indices))
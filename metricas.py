@@ -0,0 +1,96 @@
+import time
+from contextlib import contextmanager
+from prometheus_client import Counter, Gauge, Histogram
+
+# Latência das etapas, de milissegundos (cache, busca) a minutos (OCR, transcrição)
+BUCKETS_SEGUNDOS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+BUCKETS_TOKENS = (250, 500, 1000, 2000, 3000, 4000, 6000, 8000, 16000)
+
+# Consultas (API)
+CONSULTA_ETAPA_SEGUNDOS = Histogram(
+    "rag_consulta_etapa_segundos",
+    "Duração das etapas das consultas: embedding, cache_respostas, resumo, busca, rerank, contexto, llm e total",
+    ["etapa"], buckets=BUCKETS_SEGUNDOS
+)
+CONSULTAS = Counter(
+    "rag_consultas", "Consultas ao RAG por tipo (simples, stream, lote) e resultado",
+    ["tipo", "resultado"]
+)
+PROMPT_TOKENS = Histogram("rag_prompt_tokens", "Tokens do prompt de cada consulta", buckets=BUCKETS_TOKENS)
+LLM_TOKENS = Counter("rag_llm_tokens", "Tokens das chamadas ao LLM (prompt e resposta)", ["tipo"])
+
+# Ingestão (processador da fila)
+INGESTAO_ETAPA_SEGUNDOS = Histogram(
+    "rag_ingestao_etapa_segundos",
+    "Duração das etapas da ingestão: download, extracao e divisao por documento; embedding e upsert por lote; resumo por referência",
+    ["etapa"], buckets=BUCKETS_SEGUNDOS
+)
+INGESTAO_ITENS = Counter("rag_ingestao_itens", "Itens da fila processados", ["tipo", "acao", "resultado"])
+INGESTAO_BLOCOS = Counter("rag_ingestao_blocos", "Blocos sincronizados no Qdrant (gravados ou inalterados)", ["situacao"])
+EMBEDDING_TOKENS = Counter("rag_embedding_tokens", "Tokens dos blocos embutidos na ingestão")
+RESUMOS_NOS = Counter("rag_resumos_nos", "Nós da árvore de resumos gerados pelo LLM ou reutilizados", ["nivel", "resultado"])
+RESUMOS_TOKENS = Counter("rag_resumos_tokens", "Tokens das chamadas ao LLM para gerar resumos (prompt e resposta)", ["tipo"])
+FILA_PENDENTES = Gauge("rag_fila_pendentes", "Itens pendentes na fila_rag")
+FILA_IDADE_MAIS_ANTIGO = Gauge("rag_fila_idade_mais_antigo_segundos", "Idade do item pendente mais antigo da fila_rag")
+
+# Agendador das chamadas à OpenAI
+OPENAI_CONCORRENCIA = Gauge("rag_openai_concorrencia", "Limite atual de chamadas simultâneas à OpenAI (AIMD)")
+OPENAI_ORCAMENTO_RESTANTE = Gauge(
+    "rag_openai_orcamento_restante", "Requisições e tokens restantes informados pela OpenAI", ["tipo"]
+)
+OPENAI_ESPERA_SEGUNDOS = Histogram(
+    "rag_openai_espera_segundos", "Espera na fila do agendador antes de cada chamada à OpenAI, por prioridade",
+    ["prioridade"], buckets=BUCKETS_SEGUNDOS
+)
+OPENAI_FALHAS = Counter("rag_openai_falhas", "Chamadas à OpenAI com erro: limite (429), transitoria ou definitiva", ["tipo"])
+
+# Caches (embeddings, extracoes, respostas)
+CACHE = Counter("rag_cache_consultas", "Consultas aos caches por resultado (acerto ou falha)", ["cache", "resultado"])
+
+def registrar_cache(cache, acertos, falhas):
+    if acertos:
+        CACHE.labels(cache, "acerto").inc(acertos)
+    if falhas:
+        CACHE.labels(cache, "falha").inc(falhas)
+
+class Etapas:
+    """
+    Acumula o tempo de cada etapa de um pipeline de geradores aninhados, como a
+    extração consumida pela divisão em blocos, consumida pela gravação. O tempo
+    gasto em uma etapa interna não é contado na etapa que a envolve.
+    """
+
+    def __init__(self, histograma):
+        self.histograma = histograma
+        self.tempos = {}
+        self._pilha = []  # [etapa, início, tempo das etapas internas]
+
+    @contextmanager
+    def medir(self, etapa):
+        self._pilha.append([etapa, time.perf_counter(), 0.0])
+        try:
+            yield
+        finally:
+            etapa, inicio, internas = self._pilha.pop()
+            duracao = time.perf_counter() - inicio
+            self.tempos[etapa] = self.tempos.get(etapa, 0.0) + duracao - internas
+            if self._pilha:
+                self._pilha[-1][2] += duracao
+
+    def iterar(self, etapa, iteravel):
+        """
+        Repassa os itens do iterável, medindo como etapa o tempo de produzir cada um.
+        """
+        iterador = iter(iteravel)
+        while True:
+            with self.medir(etapa):
+                try:
+                    item = next(iterador)
+                except StopIteration:
+                    return
+            yield item
+
+    def registrar(self):
+        for etapa, tempo in self.tempos.items():
+            self.histograma.labels(etapa).observe(tempo)
+        self.tempos = {}
@@ -0,0 +1,107 @@
+import os
+import logging
+import tempfile
+from datetime import timedelta
+
+# Configuração do logger
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Tamanho de cada leitura do corpo da resposta ao gravar o spool
+TAMANHO_PARTE = 1024 * 1024
+
+class FonteBinario:
+    """
+    Origem do conteúdo de um binário para os processos de extração: bytes em
+    memória, arquivo de spool ou URL pré-assinada lida diretamente pelo ffmpeg.
+    Como gerenciador de contexto, remove o arquivo de spool ao sair.
+    """
+
+    def __init__(self, nome, dados=None, caminho=None, url=None):
+        self.nome = nome
+        self.dados = dados
+        self.caminho = caminho
+        self.url = url
+
+    @property
+    def origem(self):
+        if self.dados is not None:
+            return self.dados
+        return self.caminho or self.url
+
+    def liberar(self):
+        self.dados = None
+        if self.caminho and os.path.exists(self.caminho):
+            os.remove(self.caminho)
+            logger.info("Arquivo temporário removido: %s", self.caminho)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *excecao):
+        self.liberar()
+
+class MinioDownload:
+    """
+    Obtém binários do MinIO sem gravar cópias completas em um caminho fixo:
+    imagens pequenas ficam em memória, PDFs e imagens maiores vão para um
+    arquivo de spool com nome único e áudio e vídeo são lidos pelo ffmpeg a
+    partir de uma URL pré-assinada, em streaming.
+    """
+
+    def __init__(self, minio_client):
+        self.minio_client = minio_client
+        self.limite_memoria = int(os.getenv("MINIO_LIMITE_MEMORIA_BYTES", 32 * 1024 * 1024))
+        self.diretorio_spool = os.getenv("MINIO_DIRETORIO_SPOOL") or tempfile.gettempdir()
+        # A URL precisa valer durante toda a extração
+        self.validade_url = timedelta(seconds=int(os.getenv("MINIO_VALIDADE_URL_SEGUNDOS", 3600)))
+
+    def abrir(self, bucket, objeto, tipo_arquivo):
+        """
+        Prepara a leitura de um objeto para a extração.
+
+        :param bucket: Bucket do objeto.
+        :param objeto: Nome (hash) do objeto.
+        :param tipo_arquivo: Tipo retornado por FormatSupport.verificar_formato.
+        :return: FonteBinario, a ser liberada pelo chamador.
+        """
+        if tipo_arquivo in ("audio", "video"):
+            # O ffmpeg lê por HTTP com requisições de intervalo, o que também
+            # atende MP4 com o índice (moov) no fim do arquivo
+            url = self.minio_client.presigned_get_object(bucket, objeto, expires=self.validade_url)
+            logger.info("Binário %s do bucket %s será lido em streaming.", objeto, bucket)
+            return FonteBinario(objeto, url=url)
+
+        resposta = self.minio_client.get_object(bucket, objeto)
+        try:
+            # PDFs são abertos uma vez por página nos processos do pool: o caminho do
+            # spool evita serializar o arquivo inteiro em cada tarefa. Objetos de
+            # tamanho desconhecido também vão para o spool
+            tamanho = resposta.headers.get("Content-Length")
+            tamanho = int(tamanho) if tamanho else None
+            if tipo_arquivo != "pdf" and tamanho is not None and tamanho <= self.limite_memoria:
+                logger.info("Baixando binário %s do bucket %s para a memória (%s bytes)", objeto, bucket, tamanho)
+                return FonteBinario(objeto, dados=resposta.read())
+
+            logger.info(
+                "Baixando binário %s do bucket %s para o spool (%s bytes)", objeto, bucket,
+                tamanho if tamanho is not None else "tamanho desconhecido"
+            )
+            return FonteBinario(objeto, caminho=self._gravar_spool(resposta, objeto))
+        finally:
+            # Devolve a conexão ao pool do cliente para o próximo item
+            resposta.close()
+            resposta.release_conn()
+
+    def _gravar_spool(self, resposta, objeto):
+        # Nome único: o mesmo hash pode ser processado por dois workers ao mesmo tempo
+        extensao = os.path.splitext(objeto)[1]
+        descritor, caminho = tempfile.mkstemp(prefix="fila_rag_", suffix=extensao, dir=self.diretorio_spool)
+        try:
+            with os.fdopen(descritor, "wb") as arquivo:
+                for parte in resposta.stream(TAMANHO_PARTE):
+                    arquivo.write(parte)
+            return caminho
+        except Exception:
+            os.remove(caminho)
+            raise
@@ -0,0 +1,155 @@
+import os
+import re
+import logging
+import tiktoken
+
+# Configuração do logger
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+PALAVRA = re.compile(r"\w+")
+
+# Sobreposição, em palavras, procurada ao unir blocos consecutivos; abaixo do
+# mínimo, a coincidência entre o fim de um bloco e o início do seguinte é casual
+MIN_PALAVRAS_SOBREPOSICAO = 3
+MAX_PALAVRAS_SOBREPOSICAO = 400
+
+class MontadorContexto:
+    """
+    Monta o contexto do prompt a partir dos blocos recuperados, dentro de um
+    orçamento de tokens do LLM.
+
+    Os blocos são considerados em ordem de score. Blocos quase idênticos a um já
+    incluído (texto padrão repetido entre documentos) não entram de novo: apenas
+    o documento é citado junto ao original. Os demais entram enquanto couberem
+    em CONTEXTO_MAX_TOKENS, e blocos consecutivos de um mesmo documento são
+    unidos em um único trecho, sem repetir a sobreposição entre eles.
+    """
+
+    def __init__(self, modelo="gpt-4"):
+        self.max_tokens = int(os.getenv("CONTEXTO_MAX_TOKENS", 3000))
+        self.limiar_duplicado = float(os.getenv("CONTEXTO_LIMIAR_DUPLICADO", 0.9))
+
+        try:
+            self.encoding = tiktoken.encoding_for_model(modelo)
+        except Exception as e:
+            logger.error("Erro ao carregar o tokenizador do modelo %s: %s", modelo, e)
+            raise
+
+    def contar_tokens(self, texto):
+        return len(self.encoding.encode_ordinary(texto))
+
+    def montar(self, documentos):
+        """
+        :param documentos: Documents recuperados, com referencia, documento e
+                           bloco_id em metadata.
+        :return: Tupla (contexto, Documents incluídos no contexto). Os documentos
+                 com bloco quase idêntico a um incluído ficam em
+                 metadata["documentos_repetidos"] do incluído.
+        """
+        selecionados = []  # (documento, assinatura)
+        usados = 0
+        duplicados = 0
+        fora_do_orcamento = 0
+        for documento in sorted(documentos, key=self._score, reverse=True):
+            assinatura = self._assinatura(documento.page_content)
+            original = next(
+                (d for d, a in selecionados if self._similaridade(a, assinatura) >= self.limiar_duplicado),
+                None
+            )
+            if original is not None:
+                repetidos = original.metadata.setdefault("documentos_repetidos", [])
+                if documento.metadata.get("documento") not in repetidos + [original.metadata.get("documento")]:
+                    repetidos.append(documento.metadata.get("documento"))
+                duplicados += 1
+                continue
+
+            tokens = self.contar_tokens(self._formatar(documento.page_content, documento.metadata))
+            # Blocos que não cabem são pulados; um menor, de score inferior, ainda pode caber
+            if selecionados and usados + tokens > self.max_tokens:
+                fora_do_orcamento += 1
+                continue
+            selecionados.append((documento, assinatura))
+            usados += tokens
+
+        incluidos = [documento for documento, _ in selecionados]
+        contexto = "\n\n".join(self._formatar(texto, metadata) for texto, metadata in self._unir_consecutivos(incluidos))
+        if duplicados or fora_do_orcamento:
+            logger.info(
+                "Contexto: %s blocos incluídos, %s quase idênticos e %s fora do orçamento de %s tokens descartados.",
+                len(incluidos), duplicados, fora_do_orcamento, self.max_tokens
+            )
+        return contexto, incluidos
+
+    @staticmethod
+    def _score(documento):
+        score = documento.metadata.get("score_rerank")
+        return score if score is not None else documento.metadata.get("score") or 0.0
+
+    @staticmethod
+    def _assinatura(texto):
+        # Trigramas de palavras normalizadas; textos curtos usam as próprias palavras
+        palavras = PALAVRA.findall(texto.lower())
+        if len(palavras) < 3:
+            return set(palavras)
+        return set(zip(palavras, palavras[1:], palavras[2:]))
+
+    @staticmethod
+    def _similaridade(a, b):
+        if not a or not b:
+            return 1.0 if a == b else 0.0
+        return len(a & b) / len(a | b)
+
+    @staticmethod
+    def _formatar(texto, metadata):
+        documentos = [metadata.get("documento")] + metadata.get("documentos_repetidos", [])
+        return (
+            f"Informação: {texto}\n"
+            f"Procedimento: {metadata.get('referencia')}\n"
+            f"Documento: {'; '.join(str(d) for d in documentos)}"
+        )
+
+    def _unir_consecutivos(self, incluidos):
+        """
+        Agrupa os blocos incluídos em trechos de blocos consecutivos do mesmo
+        documento. Os trechos seguem a ordem do seu bloco de maior score.
+
+        :return: Lista de tuplas (texto, metadata do primeiro bloco do trecho).
+        """
+        por_documento = {}
+        for documento in incluidos:
+            chave = (documento.metadata.get("referencia"), documento.metadata.get("documento"))
+            por_documento.setdefault(chave, []).append(documento)
+
+        trechos = {}  # id do primeiro bloco do trecho -> (texto, metadata)
+        trecho_do_bloco = {}
+        for blocos in por_documento.values():
+            blocos.sort(key=lambda d: (d.metadata.get("bloco_id") is None, d.metadata.get("bloco_id") or 0))
+            anterior = None
+            for documento in blocos:
+                bloco_id = documento.metadata.get("bloco_id")
+                if anterior is not None and bloco_id is not None and bloco_id == anterior.metadata.get("bloco_id") + 1:
+                    inicial = trecho_do_bloco[id(anterior)]
+                    texto, metadata = trechos[inicial]
+                    trechos[inicial] = (self._juntar(texto, documento.page_content), metadata)
+                else:
+                    inicial = id(documento)
+                    trechos[inicial] = (documento.page_content, dict(documento.metadata))
+                trecho_do_bloco[id(documento)] = inicial
+                repetidos = documento.metadata.get("documentos_repetidos", [])
+                metadata = trechos[inicial][1]
+                metadata["documentos_repetidos"] = list(dict.fromkeys(metadata.get("documentos_repetidos", []) + repetidos))
+                anterior = documento if bloco_id is not None else None
+
+        ordem = list(dict.fromkeys(trecho_do_bloco[id(documento)] for documento in incluidos))
+        return [trechos[inicial] for inicial in ordem]
+
+    @staticmethod
+    def _juntar(texto, seguinte):
+        # Remove do início do bloco seguinte a sobreposição com o final do anterior
+        palavras = texto.split()
+        seguintes = seguinte.split()
+        for tamanho in range(min(len(palavras), len(seguintes), MAX_PALAVRAS_SOBREPOSICAO), MIN_PALAVRAS_SOBREPOSICAO - 1, -1):
+            if palavras[-tamanho:] == seguintes[:tamanho]:
+                return " ".join(palavras + seguintes[tamanho:])
+        return f"{texto} {seguinte}"
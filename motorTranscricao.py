@@ -0,0 +1,75 @@
+import os
+import json
+import logging
+
+# Configuração do logger
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Bytes por leitura enviada ao reconhecedor (0,25 s de PCM 16 bits a 16 kHz)
+TAMANHO_LEITURA = 8000
+
+class MotorTranscricao:
+    """
+    Interface dos motores de transcrição offline. Recebe PCM 16 bits mono e
+    devolve o texto reconhecido.
+    """
+
+    def transcrever(self, pcm, taxa_amostragem):
+        raise NotImplementedError
+
+class MotorVosk(MotorTranscricao):
+    """
+    Transcrição com o Vosk e o modelo em português indicado em VOSK_MODELO.
+    """
+
+    def __init__(self, caminho_modelo=None):
+        self.caminho_modelo = caminho_modelo or os.getenv("VOSK_MODELO", "modelos/vosk-model-pt-fb-v0.1.1-20220516_2113")
+        try:
+            from vosk import Model, SetLogLevel
+            SetLogLevel(-1)
+            self.modelo = Model(self.caminho_modelo)
+            logger.info("Modelo Vosk carregado de %s.", self.caminho_modelo)
+        except Exception as e:
+            logger.error("Erro ao carregar o modelo Vosk %s: %s", self.caminho_modelo, e)
+            raise
+
+    def transcrever(self, pcm, taxa_amostragem):
+        from vosk import KaldiRecognizer
+        reconhecedor = KaldiRecognizer(self.modelo, taxa_amostragem)
+        textos = []
+        for inicio in range(0, len(pcm), TAMANHO_LEITURA):
+            if reconhecedor.AcceptWaveform(pcm[inicio:inicio + TAMANHO_LEITURA]):
+                textos.append(json.loads(reconhecedor.Result()).get("text", ""))
+        textos.append(json.loads(reconhecedor.FinalResult()).get("text", ""))
+        return " ".join(texto for texto in textos if texto)
+
+class MotorFalso(MotorTranscricao):
+    """
+    Motor determinístico, sem modelo, para testes e benchmarks: descreve a
+    duração do trecho recebido.
+    """
+
+    def transcrever(self, pcm, taxa_amostragem):
+        duracao = len(pcm) / 2 / taxa_amostragem
+        return f"Trecho de {duracao:.1f} segundos transcrito."
+
+MOTORES = {
+    "vosk": MotorVosk,
+    "falso": MotorFalso,
+}
+
+_motor = None
+
+def obter_motor():
+    """
+    Retorna o motor configurado em TRANSCRICAO_MOTOR, carregado uma única vez por
+    processo.
+    """
+    global _motor
+    if _motor is None:
+        nome = os.getenv("TRANSCRICAO_MOTOR", "vosk")
+        if nome not in MOTORES:
+            raise ValueError(f"Motor de transcrição desconhecido: {nome}")
+        _motor = MOTORES[nome]()
+    return _motor
@@ -0,0 +1,135 @@
+import os
+import logging
+from qdrant_client.http import models
+from indiceLexico import VETOR_LEXICO
+
+# Configuração do logger
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+DIMENSAO_EMBEDDING = 1536
+
+# Índices de payload usados nos filtros de consulta e exclusão
+INDICES_PAYLOAD = {
+    "metadata.referencia": models.PayloadSchemaType.KEYWORD,
+    "metadata.documento": models.PayloadSchemaType.KEYWORD,
+    "metadata.id_fila": models.PayloadSchemaType.INTEGER,
+}
+
+class QdrantCollection:
+    """
+    Cria ou valida a collection do RAG no Qdrant, com índices de payload,
+    parâmetros do HNSW e quantização escalar opcional.
+
+    Além do vetor denso sem nome, a collection tem o vetor esparso VETOR_LEXICO
+    da busca lexical (BM25), com IDF calculado pelo Qdrant. Collections criadas
+    antes dele não podem recebê-lo: nelas, lexico fica False e a busca usa
+    apenas o vetor denso até que a collection seja recriada e reprocessada.
+    """
+
+    def __init__(self, qdrant_client, collection_name="investigacao"):
+        self.qdrant_client = qdrant_client
+        self.collection_name = collection_name
+
+        self.hnsw_m = int(os.getenv("QDRANT_HNSW_M", 16))
+        self.hnsw_ef_construct = int(os.getenv("QDRANT_HNSW_EF_CONSTRUCT", 100))
+        self.hnsw_ef = int(os.getenv("QDRANT_HNSW_EF", 128))
+        self.quantizacao = os.getenv("QDRANT_QUANTIZACAO", "").lower() == "int8"
+        self.oversampling = float(os.getenv("QDRANT_OVERSAMPLING", 2.0))
+        self.lexico = False
+
+    def config_hnsw(self):
+        return models.HnswConfigDiff(m=self.hnsw_m, ef_construct=self.hnsw_ef_construct)
+
+    def config_quantizacao(self):
+        if not self.quantizacao:
+            return None
+        # Vetores quantizados em memória; os originais ficam em disco para o rescore
+        return models.ScalarQuantization(
+            scalar=models.ScalarQuantizationConfig(
+                type=models.ScalarType.INT8,
+                quantile=0.99,
+                always_ram=True
+            )
+        )
+
+    def parametros_busca(self):
+        """
+        Parâmetros de busca coerentes com a configuração da collection.
+        """
+        quantizacao = None
+        if self.quantizacao:
+            quantizacao = models.QuantizationSearchParams(rescore=True, oversampling=self.oversampling)
+        return models.SearchParams(hnsw_ef=self.hnsw_ef, quantization=quantizacao)
+
+    def garantir(self):
+        """
+        Cria a collection se ela não existir; caso exista, valida a dimensão e a
+        distância dos vetores e aplica os parâmetros de HNSW e quantização. Em
+        ambos os casos, garante os índices de payload.
+        """
+        try:
+            if not self.qdrant_client.collection_exists(self.collection_name):
+                self.qdrant_client.create_collection(
+                    collection_name=self.collection_name,
+                    vectors_config=models.VectorParams(
+                        size=DIMENSAO_EMBEDDING,
+                        distance=models.Distance.COSINE,
+                        on_disk=self.quantizacao
+                    ),
+                    sparse_vectors_config={VETOR_LEXICO: models.SparseVectorParams(modifier=models.Modifier.IDF)},
+                    hnsw_config=self.config_hnsw(),
+                    quantization_config=self.config_quantizacao()
+                )
+                self.lexico = True
+                logger.info("Collection %s criada no Qdrant.", self.collection_name)
+            else:
+                self._validar()
+
+            for campo, tipo in INDICES_PAYLOAD.items():
+                self.qdrant_client.create_payload_index(
+                    collection_name=self.collection_name,
+                    field_name=campo,
+                    field_schema=tipo,
+                    wait=True
+                )
+            logger.info("Índices de payload garantidos na collection %s: %s", self.collection_name, ", ".join(INDICES_PAYLOAD))
+        except Exception as e:
+            logger.error("Erro ao preparar a collection %s no Qdrant: %s", self.collection_name, e)
+            raise
+
+    def _validar(self):
+        info = self.qdrant_client.get_collection(self.collection_name)
+        vetores = info.config.params.vectors
+        if (
+            not isinstance(vetores, models.VectorParams)
+            or vetores.size != DIMENSAO_EMBEDDING
+            or vetores.distance != models.Distance.COSINE
+        ):
+            raise ValueError(
+                f"Collection {self.collection_name} incompatível: {vetores} "
+                f"(esperado vetor sem nome, dimensão {DIMENSAO_EMBEDDING}, distância Cosine)"
+            )
+
+        self.lexico = VETOR_LEXICO in (info.config.params.sparse_vectors or {})
+        if not self.lexico:
+            logger.warning(
+                "Collection %s sem o vetor esparso %s: busca apenas densa até que seja recriada e reprocessada.",
+                self.collection_name, VETOR_LEXICO
+            )
+
+        hnsw = info.config.hnsw_config
+        quantizado = info.config.quantization_config is not None
+        if hnsw.m != self.hnsw_m or hnsw.ef_construct != self.hnsw_ef_construct or quantizado != self.quantizacao:
+            self.qdrant_client.update_collection(
+                collection_name=self.collection_name,
+                vectors_config={"": models.VectorParamsDiff(on_disk=self.quantizacao)},
+                hnsw_config=self.config_hnsw(),
+                quantization_config=self.config_quantizacao() or models.Disabled.DISABLED
+            )
+            logger.info(
+                "Collection %s atualizada: HNSW m=%s, ef_construct=%s, quantização int8=%s",
+                self.collection_name, self.hnsw_m, self.hnsw_ef_construct, self.quantizacao
+            )
+        else:
+            logger.info("Collection %s validada.", self.collection_name)
@@ -1,42 +1,98 @@
 import os
+import time
+import asyncio
 import logging
-from qdrant_client import QdrantClient
-from langchain_qdrant import QdrantVectorStore
+import httpx
+from contextlib import aclosing
+from qdrant_client import QdrantClient, AsyncQdrantClient
+from qdrant_client.http import models
+from langchain_core.documents import Document
 from langchain_core.prompts import PromptTemplate
-from langchain.chains.retrieval_qa.base import RetrievalQA
 from langchain_openai import ChatOpenAI
 from langchain_openai import OpenAIEmbeddings
+from embeddingCache import EmbeddingCache
+from qdrantCollection import QdrantCollection
+from respostaCache import RespostaCache
+from resumoCaso import ResumoCaso
+from indiceLexico import IndiceLexico, VETOR_LEXICO
+from reranker import Reranker
+from montadorContexto import MontadorContexto
+from agendadorOpenAI import AgendadorOpenAI, PRIORIDADE_CONSULTA
+import metricas
 
 logger = logging.getLogger(__name__)
 
+SEM_DOCUMENTOS = "Nenhum documento relevante encontrado para essa referência."
+
 class RAGQuery:
     def __init__(self):
         try:
-            # Configuração do Qdrant
+            # Clientes HTTP compartilhados (pool de conexões) para as chamadas à OpenAI
+            limites = httpx.Limits(
+                max_connections=int(os.getenv("HTTP_MAX_CONEXOES", 100)),
+                max_keepalive_connections=int(os.getenv("HTTP_MAX_CONEXOES_OCIOSAS", 20))
+            )
+            timeout = float(os.getenv("HTTP_TIMEOUT", 120))
+
+            # Agendador das chamadas à OpenAI: lê os cabeçalhos de limite das
+            # respostas e faz as novas tentativas (os clientes não repetem)
+            self.agendador = AgendadorOpenAI()
+            self.http_client = httpx.Client(limits=limites, timeout=timeout, event_hooks=self.agendador.ganchos_http())
+            self.http_async_client = httpx.AsyncClient(
+                limits=limites, timeout=timeout, event_hooks=self.agendador.aganchos_http()
+            )
+
+            # Configuração do Qdrant (síncrono e assíncrono)
             self.qdrant_client = QdrantClient(
                 url=os.getenv("QDRANT_URL", "http://localhost:6333"),
                 api_key=os.getenv("QDRANT_API_KEY")
             )
+            self.async_qdrant_client = AsyncQdrantClient(
+                url=os.getenv("QDRANT_URL", "http://localhost:6333"),
+                api_key=os.getenv("QDRANT_API_KEY")
+            )
+            logger.info("Clientes do Qdrant configurados com sucesso.")
+
+            # Cria ou valida a collection, com índices de payload
+            self.collection_name = "investigacao"
+            self.colecao = QdrantCollection(self.qdrant_client, self.collection_name)
+            self.colecao.garantir()
+            self.parametros_busca = self.colecao.parametros_busca()
+
+            # Busca híbrida: vetor denso e BM25, fundidos por RRF e reordenados localmente
+            self.indice_lexico = IndiceLexico() if self.colecao.lexico else None
+            self.reranker = Reranker()
             
             # Configuração de embeddings com OpenAI
             self.embeddings = OpenAIEmbeddings(
                 model="text-embedding-ada-002",
-                openai_api_key=os.getenv("OPENAI_API_KEY")
+                openai_api_key=os.getenv("OPENAI_API_KEY"),
+                max_retries=0,
+                http_client=self.http_client,
+                http_async_client=self.http_async_client
             )
 
-            # Configuração do VectorStore com Qdrant
-            self.vectorstore = QdrantVectorStore(
-                client=self.qdrant_client,
-                collection_name="investigacao",
-                embedding=self.embeddings
-            )
-            logger.info("Qdrant VectorStore configurado com sucesso.")
+            # Cache local de embeddings
+            self.embedding_cache = EmbeddingCache()
+
+            # Cache semântico de respostas por referência, invalidado pelo processador da fila
+            self.resposta_cache = RespostaCache(self.qdrant_client, self.async_qdrant_client)
+            self.resposta_cache.garantir()
+
+            # Resumos das referências, mantidos pelo processador da fila
+            self.resumos = ResumoCaso(self.qdrant_client, async_qdrant_client=self.async_qdrant_client)
+            self.resumos.garantir()
 
             # Configuração do modelo de linguagem
             self.llm = ChatOpenAI(
                 model="gpt-4",
                 temperature=0,
-                openai_api_key=os.getenv("OPENAI_API_KEY")
+                # Inclui no streaming o uso de tokens, registrado nas métricas
+                stream_usage=True,
+                openai_api_key=os.getenv("OPENAI_API_KEY"),
+                max_retries=0,
+                http_client=self.http_client,
+                http_async_client=self.http_async_client
             )
             logger.info("Modelo ChatGPT configurado com sucesso.")
 
@@ -50,67 +106,450 @@ class RAGQuery:
                     "Responda de forma clara e objetiva, incluindo sempre a referência (procedimento) e o número do(s) documento(s) que embasam a resposta."
                 )
             )
+
+            # Perguntas de resumo são respondidas a partir do resumo pré-calculado da referência
+            self.prompt_resumo = PromptTemplate(
+                input_variables=["reference", "summary", "question"],
+                template=(
+                    "Você é um assistente que responde perguntas com base no seguinte resumo do procedimento {reference}:\n\n"
+                    "{summary}\n\n"
+                    "Pergunta: {question}\n\n"
+                    "Responda de forma clara e objetiva, incluindo sempre a referência (procedimento) e o número do(s) documento(s) que embasam a resposta."
+                )
+            )
             logger.info("Prompt Template configurado com sucesso.")
 
-            # Configuração do limite de resultados do Qdrant
-            self.top_k = int(os.getenv("QDRANT_TOP_K", 10))
+            # Contexto do prompt limitado por orçamento de tokens, sem blocos repetidos
+            self.montador_contexto = MontadorContexto(self.llm.model_name)
 
-            # Configuração da cadeia de consulta
-            self.qa_chain = RetrievalQA.from_chain_type(
-                llm=self.llm,
-                retriever=self.vectorstore.as_retriever(
-                    search_kwargs={"k": self.top_k}
-                ),
-                return_source_documents=True,
-                chain_type="stuff",
-                chain_type_kwargs={"prompt": self.prompt_template}
-            )
-            logger.info("Cadeia de consulta RetrievalQA configurada com sucesso.")
+            # Chamadas simultâneas ao LLM em /consultar/lote
+            self.concorrencia_lote = int(os.getenv("CONSULTA_LOTE_CONCORRENCIA_LLM", 5))
+
+            # Candidatos de cada busca (densa e lexical) e blocos mantidos após o reranking;
+            # sem cross-encoder, mais blocos compensam a ordem menos precisa
+            self.candidatos = int(os.getenv("BUSCA_CANDIDATOS", 30))
+            self.top_k = int(os.getenv("QDRANT_TOP_K", 5 if self.reranker.modelo is not None else 10))
         except Exception as e:
             logger.error("Erro durante a configuração do RAGQuery: %s", e)
             raise
 
-    def gerar_embedding(self, texto):
-        return self.embeddings.embed_query(texto)
+    async def agerar_embedding(self, texto):
+        # O cache é SQLite síncrono, compartilhado com a ingestão: fora do event loop
+        with metricas.CONSULTA_ETAPA_SEGUNDOS.labels("embedding").time():
+            vetor = await asyncio.to_thread(self.embedding_cache.obter, self.embeddings.model, texto)
+            if vetor is None:
+                vetor = await self.agendador.aexecutar(
+                    lambda: self.embeddings.aembed_query(texto), self._tokens_texto(texto), PRIORIDADE_CONSULTA
+                )
+                await asyncio.to_thread(self.embedding_cache.gravar, self.embeddings.model, texto, vetor)
+        return vetor
+
+    async def agerar_embeddings(self, textos):
+        """
+        Embeddings de vários textos: os ausentes do cache vão à OpenAI em uma
+        única chamada de embed_documents.
+        """
+        modelo = self.embeddings.model
+        with metricas.CONSULTA_ETAPA_SEGUNDOS.labels("embedding").time():
+            vetores = await asyncio.to_thread(self.embedding_cache.obter_varios, modelo, textos)
+            faltantes = list(dict.fromkeys(texto for texto, vetor in zip(textos, vetores) if vetor is None))
+            if faltantes:
+                novos = await self.agendador.aexecutar(
+                    lambda: self.embeddings.aembed_documents(faltantes),
+                    sum(self._tokens_texto(texto) for texto in faltantes), PRIORIDADE_CONSULTA
+                )
+                novos = dict(zip(faltantes, novos))
+                await asyncio.to_thread(
+                    self.embedding_cache.gravar_varios, modelo, faltantes, [novos[texto] for texto in faltantes]
+                )
+                vetores = [vetor if vetor is not None else novos[texto] for texto, vetor in zip(textos, vetores)]
+        return vetores
+
+    def filtro_referencia(self, referencia):
+        return models.Filter(
+            must=[
+                models.FieldCondition(
+                    key="metadata.referencia",
+                    match=models.MatchValue(value=referencia)
+                )
+            ]
+        )
+
+    def _requisicao_consulta(self, vetor, pergunta, referencia):
+        filtro = self.filtro_referencia(referencia)
+        if self.indice_lexico is None:
+            return models.QueryRequest(
+                query=vetor, filter=filtro, params=self.parametros_busca, limit=self.candidatos, with_payload=True
+            )
+        # As duas buscas rodam no Qdrant e são fundidas por reciprocal rank fusion
+        return models.QueryRequest(
+            prefetch=[
+                models.Prefetch(query=vetor, filter=filtro, params=self.parametros_busca, limit=self.candidatos),
+                models.Prefetch(
+                    query=self.indice_lexico.vetor_consulta(pergunta),
+                    using=VETOR_LEXICO,
+                    filter=filtro,
+                    limit=self.candidatos
+                ),
+            ],
+            query=models.FusionQuery(fusion=models.Fusion.RRF),
+            limit=self.candidatos,
+            with_payload=True
+        )
+
+    async def abuscar(self, consultas):
+        """
+        Busca no Qdrant os blocos da referência mais relevantes para cada
+        pergunta: busca densa e lexical (BM25) fundidas por RRF, reordenadas pelo
+        Reranker. As buscas de todas as perguntas vão em uma única requisição em
+        lote.
+
+        :param consultas: Lista de tuplas (vetor, pergunta, referencia).
+        :return: Lista, na ordem das consultas, com até top_k Documents de cada
+                 busca, com o score da fusão em metadata["score"] e o do
+                 reranking em metadata["score_rerank"].
+        """
+        with metricas.CONSULTA_ETAPA_SEGUNDOS.labels("busca").time():
+            respostas = await self.async_qdrant_client.query_batch_points(
+                collection_name=self.collection_name,
+                requests=[self._requisicao_consulta(*consulta) for consulta in consultas]
+            )
+
+        # O reranking usa CPU; fora do event loop
+        def reordenar():
+            return [
+                self.reranker.reordenar(pergunta, [self.para_documento(ponto) for ponto in resposta.points], self.top_k)
+                for (_, pergunta, _), resposta in zip(consultas, respostas)
+            ]
+        with metricas.CONSULTA_ETAPA_SEGUNDOS.labels("rerank").time():
+            return await asyncio.to_thread(reordenar)
+
+    @staticmethod
+    def para_documento(ponto):
+        payload = ponto.payload or {}
+        metadata = dict(payload.get("metadata") or {})
+        metadata["score"] = ponto.score
+        return Document(page_content=payload.get("page_content", ""), metadata=metadata)
+
+    async def _apreparar(self, consultas, vetores):
+        """
+        Etapa comum às consultas simples, em lote e em streaming: cache de
+        respostas, resumo pré-calculado e, para as demais perguntas, busca dos
+        blocos e montagem do prompt.
+
+        :param consultas: Lista de tuplas (pergunta, referencia).
+        :param vetores: Embeddings das perguntas, na mesma ordem.
+        :return: Lista de dicts, na ordem das consultas, com "cache" (entrada do
+                 cache de respostas); ou com "situacao" ("resumo", "respondida"
+                 ou "sem_documentos"), "fontes" e, havendo o que responder,
+                 "prompt"; ou com "erro", se a busca falhou.
+        """
+        with metricas.CONSULTA_ETAPA_SEGUNDOS.labels("cache_respostas").time():
+            em_cache = await asyncio.gather(*[
+                self.resposta_cache.abuscar(referencia, vetor) for (_, referencia), vetor in zip(consultas, vetores)
+            ])
+        preparos = [{"cache": entrada} if entrada else None for entrada in em_cache]
+        pendentes = [i for i, preparo in enumerate(preparos) if preparo is None]
+
+        # Perguntas de resumo com resumo pré-calculado dispensam a busca de blocos
+        resumos = await asyncio.gather(*[self.abuscar_resumo(*consultas[i]) for i in pendentes])
+        pendentes_busca = []
+        for i, resumo in zip(pendentes, resumos):
+            if resumo:
+                prompt, fontes = self._prompt_resumo(*consultas[i], resumo)
+                preparos[i] = {"situacao": "resumo", "prompt": prompt, "fontes": fontes}
+            else:
+                pendentes_busca.append(i)
+        if not pendentes_busca:
+            return preparos
+
+        try:
+            blocos = await self.abuscar([(vetores[i], *consultas[i]) for i in pendentes_busca])
+        except Exception as e:
+            logger.error("Erro na busca no Qdrant: %s", e)
+            for i in pendentes_busca:
+                preparos[i] = {"erro": e}
+            return preparos
+
+        for i, resultados in zip(pendentes_busca, blocos):
+            pergunta, referencia = consultas[i]
+            if not resultados:
+                logger.warning("Nenhum documento encontrado para referência: %s", referencia)
+                preparos[i] = {"situacao": "sem_documentos", "fontes": []}
+                continue
+            contexto, incluidos = self._montar_contexto(resultados)
+            preparos[i] = {
+                "situacao": "respondida",
+                "prompt": self.prompt_template.format(context=contexto, question=pergunta),
+                "fontes": self.listar_fontes(incluidos)
+            }
+        return preparos
+
+    async def _aresponder(self, pergunta, referencia, vetor, preparo, inicio_recuperacao):
+        """
+        Chama o LLM com o prompt preparado, sem streaming, e conclui a consulta.
+        """
+        if preparo["situacao"] == "sem_documentos":
+            return SEM_DOCUMENTOS
+        tokens_prompt = self.montador_contexto.contar_tokens(preparo["prompt"])
+
+        inicio = time.perf_counter()
+        resposta = await self.agendador.aexecutar(
+            lambda: self.llm.ainvoke(preparo["prompt"]), self._tokens_chat(tokens_prompt), PRIORIDADE_CONSULTA
+        )
+        await self._aconcluir(
+            pergunta, referencia, vetor, preparo, inicio_recuperacao,
+            resposta.content, time.perf_counter() - inicio, tokens_prompt, resposta.usage_metadata
+        )
+        return resposta.content
 
-    def consultar(self, pergunta, referencia):
+    async def _aconcluir(self, pergunta, referencia, vetor, preparo, inicio_recuperacao,
+                         conteudo, tempo_llm, tokens_prompt, uso):
+        """
+        Registra as métricas do LLM e grava a resposta no cache de respostas.
+        """
+        logger.info(
+            "Pergunta respondida para a referência: %s (llm %.3fs, prompt %s tokens)",
+            referencia, tempo_llm, tokens_prompt
+        )
+        self._registrar_llm(tempo_llm, tokens_prompt, conteudo, uso)
+        await self.resposta_cache.agravar(referencia, pergunta, vetor, conteudo, preparo["fontes"], inicio_recuperacao)
+
+    async def aconsultar(self, pergunta, referencia):
+        """
+        Responde a pergunta com base nos blocos da referência. Embedding, busca e
+        LLM não bloqueiam o event loop, permitindo que consultas concorrentes se
+        sobreponham.
+
+        :return: Tupla (resposta, indicador de resposta vinda do cache).
+        """
+        inicio_consulta = time.perf_counter()
         try:
             logger.info("Deverá responder a pergunta: %s", pergunta)
             logger.info("Consultando RAG para a referência: %s", referencia)
 
-            # Adicionar filtro por referência no Qdrant
-            resultados = self.vectorstore.similarity_search(
-                query=pergunta,
-                filter={
-                    "must": [
-                        {
-                            "key": "metadata.referencia",
-                            "match": {"value": referencia}
-                        }
-                    ]
-                },
-                k=self.top_k
+            # Respostas de consultas iniciadas antes de uma invalidação não vão ao cache
+            inicio_recuperacao = time.time()
+            vetor = await self.agerar_embedding(pergunta)
+            preparo = (await self._apreparar([(pergunta, referencia)], [vetor]))[0]
+            if "erro" in preparo:
+                raise preparo["erro"]
+            if "cache" in preparo:
+                logger.info(
+                    "Resposta obtida do cache para a referência: %s (similaridade %.3f)",
+                    referencia, preparo["cache"]["similaridade"]
+                )
+                self._registrar_consulta("simples", "cache", inicio_consulta)
+                return preparo["cache"]["resposta"], True
+
+            resposta = await self._aresponder(pergunta, referencia, vetor, preparo, inicio_recuperacao)
+            logger.info(
+                "Consulta ao RAG concluída para a referência: %s em %.3fs",
+                referencia, time.perf_counter() - inicio_consulta
             )
+            self._registrar_consulta("simples", preparo["situacao"], inicio_consulta)
+            return resposta, False
+        except Exception as e:
+            logger.error("Erro ao consultar o RAG para a referência %s: %s", referencia, e)
+            self._registrar_consulta("simples", "erro", inicio_consulta)
+            return "Erro ao realizar a consulta. Verifique os logs para mais detalhes.", False
 
-            if not resultados:
-                logger.warning("Nenhum documento encontrado para referência: %s", referencia)
-                return "Nenhum documento relevante encontrado para essa referência."
+    async def aconsultar_lote(self, consultas):
+        """
+        Responde várias perguntas, de uma ou mais referências, com uma única
+        chamada de embedding, uma única busca em lote no Qdrant e as chamadas ao
+        LLM em paralelo, limitadas a CONSULTA_LOTE_CONCORRENCIA_LLM.
 
-            contexto = "\n\n".join([
-                f"Informação: {r.page_content}\nProcedimento: {r.metadata['referencia']}\nDocumento: {r.metadata['documento']}"
-                for r in resultados
-            ])
+        :param consultas: Lista de tuplas (pergunta, referencia).
+        :return: Lista de dicts, na ordem das consultas, com referencia, pergunta
+                 e resposta e cache ou, se aquela consulta falhou, erro.
+        """
+        resultados = [{"referencia": referencia, "pergunta": pergunta} for pergunta, referencia in consultas]
+        logger.info("Consultando RAG em lote: %s perguntas", len(consultas))
+
+        inicio_recuperacao = time.time()
+        inicio_lote = inicio = time.perf_counter()
+        try:
+            vetores = await self.agerar_embeddings([pergunta for pergunta, _ in consultas])
+        except Exception as e:
+            logger.error("Erro ao gerar os embeddings do lote: %s", e)
+            for _ in resultados:
+                self._registrar_consulta("lote", "erro", inicio_lote)
+            return [dict(resultado, erro=str(e)) for resultado in resultados]
+        tempo_embedding = time.perf_counter() - inicio
+
+        inicio = time.perf_counter()
+        preparos = await self._apreparar(consultas, vetores)
+        tempo_recuperacao = time.perf_counter() - inicio
+
+        semaforo = asyncio.Semaphore(self.concorrencia_lote)
+
+        async def responder(i, preparo):
+            pergunta, referencia = consultas[i]
+            if "erro" in preparo:
+                resultados[i]["erro"] = str(preparo["erro"])
+                self._registrar_consulta("lote", "erro", inicio_lote)
+                return
+            if "cache" in preparo:
+                resultados[i].update(resposta=preparo["cache"]["resposta"], cache=True)
+                self._registrar_consulta("lote", "cache", inicio_lote)
+                return
+            async with semaforo:
+                try:
+                    resposta = await self._aresponder(pergunta, referencia, vetores[i], preparo, inicio_recuperacao)
+                    resultados[i].update(resposta=resposta, cache=False)
+                    self._registrar_consulta("lote", preparo["situacao"], inicio_lote)
+                except Exception as e:
+                    logger.error("Erro ao responder a pergunta do lote para a referência %s: %s", referencia, e)
+                    resultados[i]["erro"] = str(e)
+                    self._registrar_consulta("lote", "erro", inicio_lote)
 
-            resposta = self.qa_chain.invoke({"query": pergunta})
+        inicio = time.perf_counter()
+        await asyncio.gather(*[responder(i, preparo) for i, preparo in enumerate(preparos)])
+        tempo_llm = time.perf_counter() - inicio
 
-            logger.info("Consulta ao RAG concluída com sucesso para a referência: %s", referencia)
-            return resposta["result"]
+        logger.info(
+            "Lote de %s perguntas concluído (embedding %.3fs, recuperação %.3fs, llm %.3fs): %s do cache, %s com erro",
+            len(consultas), tempo_embedding, tempo_recuperacao, tempo_llm,
+            sum(1 for resultado in resultados if resultado.get("cache")),
+            sum(1 for resultado in resultados if "erro" in resultado)
+        )
+        return resultados
+
+    async def aconsultar_stream(self, pergunta, referencia):
+        """
+        Consulta o RAG emitindo eventos à medida que ficam disponíveis: primeiro as
+        fontes recuperadas, depois os tokens da resposta conforme o LLM os gera.
+
+        :return: Gerador assíncrono de tuplas (evento, dados), com evento em
+                 "fontes", "token", "fim" ou "erro". O evento "fim" informa em
+                 "cache" se a resposta veio do cache de respostas.
+        """
+        inicio_consulta = time.perf_counter()
+        try:
+            logger.info("Deverá responder (stream) a pergunta: %s", pergunta)
+            logger.info("Consultando RAG para a referência: %s", referencia)
+
+            inicio_recuperacao = time.time()
+            vetor = await self.agerar_embedding(pergunta)
+            preparo = (await self._apreparar([(pergunta, referencia)], [vetor]))[0]
+            if "erro" in preparo:
+                raise preparo["erro"]
+            if "cache" in preparo:
+                logger.info("Resposta (stream) obtida do cache para a referência: %s", referencia)
+                yield "fontes", {"fontes": preparo["cache"]["fontes"]}
+                yield "token", {"conteudo": preparo["cache"]["resposta"]}
+                self._registrar_consulta("stream", "cache", inicio_consulta)
+                yield "fim", {"cache": True}
+                return
+
+            yield "fontes", {"fontes": preparo["fontes"]}
+            if preparo["situacao"] == "sem_documentos":
+                yield "token", {"conteudo": SEM_DOCUMENTOS}
+                self._registrar_consulta("stream", "sem_documentos", inicio_consulta)
+                yield "fim", {"cache": False}
+                return
+            tempo_recuperacao = time.perf_counter() - inicio_consulta
+            tokens_prompt = self.montador_contexto.contar_tokens(preparo["prompt"])
+
+            inicio = time.perf_counter()
+            tempo_primeiro_token = None
+            trechos = []
+            uso = None
+            # aclosing libera a vaga no agendador mesmo se o cliente desconectar no meio da resposta
+            trechos_llm = self.agendador.aexecutar_stream(
+                lambda: self.llm.astream(preparo["prompt"]), self._tokens_chat(tokens_prompt), PRIORIDADE_CONSULTA
+            )
+            async with aclosing(trechos_llm):
+                async for trecho in trechos_llm:
+                    uso = trecho.usage_metadata or uso
+                    if not trecho.content:
+                        continue
+                    if tempo_primeiro_token is None:
+                        tempo_primeiro_token = time.perf_counter() - inicio
+                    trechos.append(trecho.content)
+                    yield "token", {"conteudo": trecho.content}
+
+            await self._aconcluir(
+                pergunta, referencia, vetor, preparo, inicio_recuperacao,
+                "".join(trechos), time.perf_counter() - inicio, tokens_prompt, uso
+            )
+            logger.info(
+                "Consulta (stream) concluída para a referência: %s (recuperação %.3fs, primeiro token %.3fs)",
+                referencia, tempo_recuperacao, tempo_primeiro_token or 0.0
+            )
+            self._registrar_consulta("stream", preparo["situacao"], inicio_consulta)
+            yield "fim", {"cache": False}
         except Exception as e:
             logger.error("Erro ao consultar o RAG para a referência %s: %s", referencia, e)
-            return "Erro ao realizar a consulta. Verifique os logs para mais detalhes."
+            self._registrar_consulta("stream", "erro", inicio_consulta)
+            yield "erro", {"detalhe": "Erro ao realizar a consulta. Verifique os logs para mais detalhes."}
+
+    async def abuscar_resumo(self, pergunta, referencia):
+        if not self.resumos.pergunta_de_resumo(pergunta):
+            return None
+        with metricas.CONSULTA_ETAPA_SEGUNDOS.labels("resumo").time():
+            return await self.resumos.abuscar(referencia)
+
+    def _prompt_resumo(self, pergunta, referencia, resumo):
+        """
+        :return: Tupla (prompt, fontes), com os documentos resumidos como fontes.
+        """
+        logger.info("Pergunta respondida a partir do resumo da referência: %s", referencia)
+        prompt = self.prompt_resumo.format(reference=referencia, summary=resumo["resumo"], question=pergunta)
+        fontes = [{"referencia": referencia, "documento": documento} for documento in resumo.get("documentos", [])]
+        return prompt, fontes
+
+    def _tokens_texto(self, texto):
+        return self.montador_contexto.contar_tokens(texto)
+
+    def _tokens_chat(self, tokens_prompt):
+        # Estimativa do orçamento de uma chamada de chat: prompt e resposta
+        return tokens_prompt + self.agendador.tokens_resposta
+
+    def _montar_contexto(self, resultados):
+        with metricas.CONSULTA_ETAPA_SEGUNDOS.labels("contexto").time():
+            return self.montador_contexto.montar(resultados)
+
+    def _registrar_llm(self, tempo_llm, tokens_prompt, conteudo, uso=None):
+        # Tokens informados pela OpenAI; na falta deles, contados localmente
+        uso = uso or {}
+        metricas.CONSULTA_ETAPA_SEGUNDOS.labels("llm").observe(tempo_llm)
+        metricas.PROMPT_TOKENS.observe(tokens_prompt)
+        metricas.LLM_TOKENS.labels("prompt").inc(uso.get("input_tokens") or tokens_prompt)
+        metricas.LLM_TOKENS.labels("resposta").inc(uso.get("output_tokens") or self.montador_contexto.contar_tokens(conteudo))
+
+    @staticmethod
+    def _registrar_consulta(tipo, resultado, inicio):
+        metricas.CONSULTAS.labels(tipo, resultado).inc()
+        metricas.CONSULTA_ETAPA_SEGUNDOS.labels("total").observe(time.perf_counter() - inicio)
+
+    @staticmethod
+    def listar_fontes(resultados):
+        """
+        Pares (referencia, documento) distintos dos blocos do contexto, na ordem
+        de relevância, incluindo os documentos com blocos repetidos.
+        """
+        fontes = dict.fromkeys(
+            (r.metadata.get("referencia"), documento)
+            for r in resultados
+            for documento in [r.metadata.get("documento")] + r.metadata.get("documentos_repetidos", [])
+        )
+        return [{"referencia": referencia, "documento": documento} for referencia, documento in fontes]
+
+    async def fechar(self):
+        await self.async_qdrant_client.close()
+        await self.http_async_client.aclose()
+        self.http_client.close()
+        self.qdrant_client.close()
 
 if __name__ == "__main__":
-    query_processor = RAGQuery()
+    async def main():
+        query_processor = RAGQuery()
+        try:
+            resposta, _ = await query_processor.aconsultar("Qual é o valor do recibo do veículo.", "IP 1234/2025")
+            print(resposta)
+        finally:
+            await query_processor.fechar()
 
-    resposta = query_processor.consultar("Qual é o valor do recibo do veículo.", "IP 1234/2025")
-    print(resposta)
\ No newline at end of file
+    asyncio.run(main())
\ No newline at end of file
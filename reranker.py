@@ -0,0 +1,61 @@
+import os
+import logging
+from indiceLexico import IndiceLexico
+
+# Configuração do logger
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+class Reranker:
+    """
+    Reordena localmente, na CPU, os candidatos da busca híbrida e mantém os k
+    mais relevantes.
+
+    Com RERANK_MODELO definido, usa um cross-encoder ONNX do fastembed (por
+    exemplo, jinaai/jina-reranker-v2-base-multilingual). Sem modelo, mantém a
+    ordem da fusão e apenas promove os blocos que contêm os identificadores
+    exatos da pergunta (termos com dígitos, como placas, números de documentos
+    e valores), que a busca densa costuma perder.
+    """
+
+    def __init__(self, nome_modelo=None):
+        self.nome_modelo = nome_modelo if nome_modelo is not None else os.getenv("RERANK_MODELO", "")
+        self.modelo = None
+        if self.nome_modelo:
+            try:
+                from fastembed.rerank.cross_encoder import TextCrossEncoder
+                self.modelo = TextCrossEncoder(model_name=self.nome_modelo)
+                logger.info("Modelo de reranking %s carregado.", self.nome_modelo)
+            except Exception as e:
+                logger.error("Erro ao carregar o modelo de reranking %s: %s", self.nome_modelo, e)
+                raise
+
+    def reordenar(self, pergunta, documentos, k):
+        """
+        :param pergunta: Pergunta do usuário.
+        :param documentos: Documents candidatos, na ordem da fusão.
+        :param k: Quantidade de documentos mantidos.
+        :return: Os k documentos mais relevantes, com o score em metadata["score_rerank"].
+        """
+        if not documentos:
+            return []
+        if self.modelo is not None:
+            scores = list(self.modelo.rerank(pergunta, [documento.page_content for documento in documentos]))
+        else:
+            scores = self._scores_termos(pergunta, documentos)
+
+        ordenados = sorted(zip(scores, documentos), key=lambda par: par[0], reverse=True)[:k]
+        for score, documento in ordenados:
+            documento.metadata["score_rerank"] = float(score)
+        return [documento for _, documento in ordenados]
+
+    @staticmethod
+    def _scores_termos(pergunta, documentos):
+        # Palavras comuns à pergunta não reordenam a fusão: a semântica já está no RRF
+        identificadores = {termo for termo in IndiceLexico.termos(pergunta) if any(c.isdigit() for c in termo)}
+        scores = []
+        for posicao, documento in enumerate(documentos):
+            presentes = identificadores & set(IndiceLexico.termos(documento.page_content)) if identificadores else ()
+            # Blocos com mais identificadores sobem; entre eles, vale a ordem da fusão
+            scores.append(len(presentes) - posicao / len(documentos))
+        return scores
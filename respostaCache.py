@@ -0,0 +1,253 @@
+import os
+import time
+import uuid
+import logging
+import metricas
+from qdrant_client.http import models
+from qdrantCollection import DIMENSAO_EMBEDDING
+
+# Configuração do logger
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Namespace dos IDs das respostas (uuid5 de referência e pergunta)
+NAMESPACE_RESPOSTAS = uuid.UUID("5d0e8a3c-2b7f-4e61-9c3a-8f1d2e4b6a70")
+
+INDICES_PAYLOAD = {
+    "referencia": models.PayloadSchemaType.KEYWORD,
+    "criado_em": models.PayloadSchemaType.FLOAT,
+    "acessado_em": models.PayloadSchemaType.FLOAT,
+}
+
+# Marcas de invalidação por referência, sem vetores
+INDICES_INVALIDACOES = {
+    "invalidado_em": models.PayloadSchemaType.FLOAT,
+}
+
+class RespostaCache:
+    """
+    Cache semântico de respostas do RAG por referência, em uma collection do
+    Qdrant compartilhada pela API e pelo processador da fila.
+
+    Uma pergunta é atendida pelo cache quando uma pergunta anterior da mesma
+    referência tem similaridade de cosseno mínima de RESPOSTA_CACHE_LIMIAR com
+    ela. As entradas expiram após RESPOSTA_CACHE_TTL_SEGUNDOS; acima de
+    RESPOSTA_CACHE_MAX_ITENS, as menos acessadas são removidas (LRU) por
+    limpar(), executado periodicamente pelo processador da fila, fora do
+    caminho das consultas.
+
+    O processador da fila invalida as entradas de uma referência sempre que
+    inclui ou exclui documentos dela, registrando o momento da invalidação.
+    Respostas de consultas iniciadas antes desse momento não são gravadas.
+    """
+
+    def __init__(self, qdrant_client, async_qdrant_client=None, collection_name="respostas"):
+        self.qdrant_client = qdrant_client
+        self.async_qdrant_client = async_qdrant_client
+        self.collection_name = collection_name
+        self.collection_invalidacoes = f"{collection_name}_invalidacoes"
+
+        self.limiar = float(os.getenv("RESPOSTA_CACHE_LIMIAR", 0.95))
+        self.ttl = int(os.getenv("RESPOSTA_CACHE_TTL_SEGUNDOS", 86400))
+        self.max_itens = int(os.getenv("RESPOSTA_CACHE_MAX_ITENS", 10000))
+        self.acertos = 0
+        self.falhas = 0
+
+    def garantir(self):
+        """
+        Cria as collections do cache e das invalidações, se não existirem, e os
+        índices de payload.
+        """
+        colecoes = (
+            (self.collection_name,
+             models.VectorParams(size=DIMENSAO_EMBEDDING, distance=models.Distance.COSINE), INDICES_PAYLOAD),
+            (self.collection_invalidacoes, {}, INDICES_INVALIDACOES),
+        )
+        for nome, vetores, indices in colecoes:
+            try:
+                if not self.qdrant_client.collection_exists(nome):
+                    self.qdrant_client.create_collection(collection_name=nome, vectors_config=vetores)
+                    logger.info("Collection %s criada no Qdrant.", nome)
+                for campo, tipo in indices.items():
+                    self.qdrant_client.create_payload_index(
+                        collection_name=nome,
+                        field_name=campo,
+                        field_schema=tipo,
+                        wait=True
+                    )
+            except Exception as e:
+                logger.error("Erro ao preparar a collection %s no Qdrant: %s", nome, e)
+                raise
+
+    @staticmethod
+    def id_resposta(referencia, pergunta):
+        return str(uuid.uuid5(NAMESPACE_RESPOSTAS, f"{referencia}\0{pergunta}"))
+
+    @staticmethod
+    def id_invalidacao(referencia):
+        return str(uuid.uuid5(NAMESPACE_RESPOSTAS, f"invalidacao\0{referencia}"))
+
+    def _filtro_validas(self, referencia):
+        return models.Filter(must=[
+            models.FieldCondition(key="referencia", match=models.MatchValue(value=referencia)),
+            models.FieldCondition(key="criado_em", range=models.Range(gte=time.time() - self.ttl)),
+        ])
+
+    def _parametros_busca(self, referencia, vetor):
+        return {
+            "collection_name": self.collection_name,
+            "query": vetor,
+            "query_filter": self._filtro_validas(referencia),
+            "score_threshold": self.limiar,
+            "limit": 1,
+            "with_payload": True
+        }
+
+    def _resultado(self, pontos):
+        if not pontos:
+            self.falhas += 1
+            metricas.registrar_cache("respostas", 0, 1)
+            return None
+        self.acertos += 1
+        metricas.registrar_cache("respostas", 1, 0)
+        return dict(pontos[0].payload, id=str(pontos[0].id), similaridade=pontos[0].score)
+
+    async def abuscar(self, referencia, vetor):
+        """
+        Busca uma resposta para pergunta equivalente na referência.
+
+        :return: Payload da entrada (pergunta, resposta, fontes, ...) ou None.
+        """
+        try:
+            resposta = await self.async_qdrant_client.query_points(**self._parametros_busca(referencia, vetor))
+            resultado = self._resultado(resposta.points)
+            if resultado:
+                await self.async_qdrant_client.set_payload(
+                    collection_name=self.collection_name,
+                    payload={"acessado_em": time.time()},
+                    points=[resultado["id"]],
+                    wait=False
+                )
+            return resultado
+        except Exception as e:
+            logger.warning("Erro ao consultar o cache de respostas: %s", e)
+            return None
+
+    def _ponto(self, referencia, pergunta, vetor, resposta, fontes):
+        agora = time.time()
+        return models.PointStruct(
+            id=self.id_resposta(referencia, pergunta),
+            vector=vetor,
+            payload={
+                "referencia": referencia,
+                "pergunta": pergunta,
+                "resposta": resposta,
+                "fontes": fontes,
+                "criado_em": agora,
+                "acessado_em": agora
+            }
+        )
+
+    def _invalidada_apos(self, pontos, inicio):
+        return bool(pontos) and pontos[0].payload.get("invalidado_em", 0) >= inicio
+
+    async def agravar(self, referencia, pergunta, vetor, resposta, fontes, inicio):
+        """
+        Grava a resposta de uma consulta, a menos que a referência tenha sido
+        invalidada depois do início da consulta.
+
+        A marca de invalidação é lida depois da gravação: se a invalidação
+        ocorrer entre as duas, ela própria remove a entrada, pois o processador
+        registra a marca antes de excluir as respostas.
+
+        :param inicio: Momento (time.time()) em que a consulta começou a recuperação.
+        """
+        try:
+            ponto = self._ponto(referencia, pergunta, vetor, resposta, fontes)
+            await self.async_qdrant_client.upsert(collection_name=self.collection_name, points=[ponto])
+            marca = await self.async_qdrant_client.retrieve(
+                collection_name=self.collection_invalidacoes, ids=[self.id_invalidacao(referencia)]
+            )
+            if self._invalidada_apos(marca, inicio):
+                await self.async_qdrant_client.delete(
+                    collection_name=self.collection_name, points_selector=models.PointIdsList(points=[ponto.id])
+                )
+                logger.info("Resposta não mantida no cache: referência %s invalidada durante a consulta.", referencia)
+        except Exception as e:
+            logger.warning("Erro ao gravar no cache de respostas: %s", e)
+
+    def invalidar(self, referencias):
+        """
+        Remove as respostas em cache das referências, cujos documentos mudaram.
+        A marca de invalidação é gravada antes da exclusão, para que consultas
+        em andamento não gravem respostas obtidas dos documentos anteriores.
+
+        :param referencias: Iterável de referências.
+        """
+        referencias = sorted({referencia for referencia in referencias if referencia})
+        if not referencias:
+            return
+        agora = time.time()
+        self.qdrant_client.upsert(
+            collection_name=self.collection_invalidacoes,
+            points=[
+                models.PointStruct(
+                    id=self.id_invalidacao(referencia), vector={},
+                    payload={"referencia": referencia, "invalidado_em": agora}
+                )
+                for referencia in referencias
+            ],
+            wait=True
+        )
+        self.qdrant_client.delete(
+            collection_name=self.collection_name,
+            points_selector=models.FilterSelector(filter=models.Filter(must=[
+                models.FieldCondition(key="referencia", match=models.MatchAny(any=referencias))
+            ])),
+            wait=True
+        )
+        logger.info("Cache de respostas invalidado para: %s", ", ".join(referencias))
+
+    def _filtro_expiradas(self):
+        return models.FilterSelector(filter=models.Filter(must=[
+            models.FieldCondition(key="criado_em", range=models.Range(lt=time.time() - self.ttl))
+        ]))
+
+    def _parametros_lru(self, total):
+        # Remove até 90% do limite, deixando folga até a próxima limpeza
+        return {
+            "collection_name": self.collection_name,
+            "limit": total - int(self.max_itens * 0.9),
+            "order_by": models.OrderBy(key="acessado_em", direction=models.Direction.ASC),
+            "with_payload": False,
+            "with_vectors": False
+        }
+
+    def limpar(self):
+        """
+        Remove as entradas expiradas, as marcas de invalidação que não afetam
+        mais nenhuma entrada e, acima de RESPOSTA_CACHE_MAX_ITENS, as entradas
+        menos acessadas recentemente.
+        """
+        self.qdrant_client.delete(collection_name=self.collection_name, points_selector=self._filtro_expiradas(), wait=True)
+        self.qdrant_client.delete(
+            collection_name=self.collection_invalidacoes,
+            points_selector=models.FilterSelector(filter=models.Filter(must=[
+                models.FieldCondition(key="invalidado_em", range=models.Range(lt=time.time() - self.ttl))
+            ])),
+            wait=True
+        )
+        total = self.qdrant_client.count(collection_name=self.collection_name, exact=True).count
+        if total <= self.max_itens:
+            return
+        pontos, _ = self.qdrant_client.scroll(**self._parametros_lru(total))
+        self.qdrant_client.delete(
+            collection_name=self.collection_name,
+            points_selector=models.PointIdsList(points=[ponto.id for ponto in pontos]),
+            wait=True
+        )
+        logger.info("Cache de respostas: %s itens removidos por LRU.", len(pontos))
+
+    def taxa_acerto(self):
+        total = self.acertos + self.falhas
+        return self.acertos / total if total else 0.0
@@ -0,0 +1,428 @@
+import os
+import re
+import time
+import uuid
+import hashlib
+import logging
+import tiktoken
+import metricas
+from agendadorOpenAI import PRIORIDADE_INGESTAO
+from qdrant_client.http import models
+
+# Configuração do logger
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# Namespace dos IDs dos pontos de resumo (uuid5 de nível, referência e chave)
+NAMESPACE_RESUMOS = uuid.UUID("a4c1f7e2-6b3d-4d8a-9e05-2f7b8c1d3e96")
+
+INDICES_PAYLOAD = {
+    "referencia": models.PayloadSchemaType.KEYWORD,
+    "nivel": models.PayloadSchemaType.KEYWORD,
+    "marcado_em": models.PayloadSchemaType.FLOAT,
+    "versao": models.PayloadSchemaType.KEYWORD,
+}
+
+# Níveis dos pontos: resumo do procedimento, de um documento, resumo parcial
+# (nó intermediário da árvore) e pendência de atualização da referência
+NIVEL_REFERENCIA = "referencia"
+NIVEL_DOCUMENTO = "documento"
+NIVEL_PARCIAL = "parcial"
+NIVEL_PENDENCIA = "pendencia"
+
+# Perguntas respondidas pelo resumo do procedimento, sem busca de blocos
+PERGUNTA_RESUMO = re.compile(
+    os.getenv("RESUMO_PADRAO_PERGUNTA", r"\b(resum[oaie]\w*|s[ií]ntese|sintetiz\w*|vis[aã]o geral|panorama)\b"),
+    re.IGNORECASE
+)
+
+PROMPT_DOCUMENTO = (
+    "Resuma o texto a seguir, do documento {documento} do procedimento {referencia}. Preserve nomes de "
+    "pessoas, datas, valores, placas, números de documentos e os fatos relevantes para a investigação.\n\n"
+    "{texto}"
+)
+PROMPT_REFERENCIA = (
+    "A seguir estão resumos dos documentos do procedimento {referencia}. Escreva um resumo único do "
+    "procedimento: fatos, pessoas envolvidas, cronologia e providências, indicando o(s) documento(s) que "
+    "embasam cada ponto.\n\n"
+    "{texto}"
+)
+
+class ResumoCaso:
+    """
+    Resumos hierárquicos (map-reduce) de cada documento e de cada referência,
+    mantidos pelo processador da fila em uma collection própria do Qdrant.
+
+    Os blocos de um documento são agrupados dentro de RESUMO_MAX_TOKENS_ENTRADA
+    e resumidos; os resumos parciais são agrupados e resumidos de novo até
+    restar um único texto. O resumo da referência é reduzido da mesma forma a
+    partir dos resumos dos documentos. Cada resumo parcial é gravado com o hash
+    do seu texto de entrada e reaproveitado enquanto ele não mudar, e cada
+    documento guarda a impressão dos seus blocos (hash_conteudo), de modo que
+    uma atualização só chama o LLM para os documentos alterados e para os
+    níveis acima deles.
+
+    Inclusões e exclusões apenas registram uma pendência para a referência; a
+    atualização ocorre depois de RESUMO_ESPERA_SEGUNDOS sem novas alterações,
+    agrupando uma sequência de itens do mesmo procedimento. Enquanto houver
+    pendência, o resumo da referência não é usado nas consultas.
+    """
+
+    def __init__(self, qdrant_client, llm=None, async_qdrant_client=None,
+                 collection_name="resumos", colecao_blocos="investigacao", agendador=None):
+        self.qdrant_client = qdrant_client
+        self.async_qdrant_client = async_qdrant_client
+        self.llm = llm
+        self.agendador = agendador
+        self.collection_name = collection_name
+        self.colecao_blocos = colecao_blocos
+
+        self.max_tokens_entrada = int(os.getenv("RESUMO_MAX_TOKENS_ENTRADA", 6000))
+        self.max_tokens_literal = int(os.getenv("RESUMO_MAX_TOKENS_LITERAL", 300))
+        self.espera = int(os.getenv("RESUMO_ESPERA_SEGUNDOS", 30))
+
+        modelo = llm.model_name if llm is not None else "gpt-4"
+        try:
+            self.encoding = tiktoken.encoding_for_model(modelo)
+        except Exception as e:
+            logger.error("Erro ao carregar o tokenizador do modelo %s: %s", modelo, e)
+            raise
+
+    def garantir(self):
+        """
+        Cria a collection dos resumos, se não existir, e os índices de payload.
+        Os pontos não têm vetores: são lidos apenas por filtro.
+        """
+        try:
+            if not self.qdrant_client.collection_exists(self.collection_name):
+                self.qdrant_client.create_collection(collection_name=self.collection_name, vectors_config={})
+                logger.info("Collection %s criada no Qdrant.", self.collection_name)
+            for campo, tipo in INDICES_PAYLOAD.items():
+                self.qdrant_client.create_payload_index(
+                    collection_name=self.collection_name,
+                    field_name=campo,
+                    field_schema=tipo,
+                    wait=True
+                )
+        except Exception as e:
+            logger.error("Erro ao preparar a collection %s no Qdrant: %s", self.collection_name, e)
+            raise
+
+    @staticmethod
+    def id_ponto(nivel, referencia, chave=""):
+        return str(uuid.uuid5(NAMESPACE_RESUMOS, f"{nivel}\0{referencia}\0{chave}"))
+
+    @staticmethod
+    def pergunta_de_resumo(pergunta):
+        return bool(PERGUNTA_RESUMO.search(pergunta or ""))
+
+    @staticmethod
+    def _hash(*partes):
+        return hashlib.sha256("\0".join(partes).encode("utf-8")).hexdigest()
+
+    def contar_tokens(self, texto):
+        return len(self.encoding.encode_ordinary(texto))
+
+    # Consulta (API)
+
+    def _parametros_resumo(self, referencia):
+        return {
+            "collection_name": self.collection_name,
+            "scroll_filter": models.Filter(must=[
+                models.FieldCondition(key="referencia", match=models.MatchValue(value=referencia)),
+                models.FieldCondition(key="nivel", match=models.MatchAny(any=[NIVEL_REFERENCIA, NIVEL_PENDENCIA])),
+            ]),
+            "limit": 2,
+            "with_payload": True,
+            "with_vectors": False
+        }
+
+    @staticmethod
+    def _resultado(referencia, pontos):
+        payloads = [ponto.payload or {} for ponto in pontos]
+        if any(payload.get("nivel") == NIVEL_PENDENCIA for payload in payloads):
+            logger.info("Resumo da referência %s aguardando atualização; a consulta usa a busca de blocos.", referencia)
+            return None
+        return next((payload for payload in payloads if payload.get("resumo")), None)
+
+    async def abuscar(self, referencia):
+        """
+        Resumo atualizado da referência.
+
+        :return: Payload do resumo (resumo, documentos, atualizado_em) ou None se
+                 não houver resumo ou se ele aguardar atualização.
+        """
+        try:
+            pontos, _ = await self.async_qdrant_client.scroll(**self._parametros_resumo(referencia))
+            return self._resultado(referencia, pontos)
+        except Exception as e:
+            logger.warning("Erro ao consultar o resumo da referência %s: %s", referencia, e)
+            return None
+
+    # Manutenção (processador da fila)
+
+    def marcar_pendentes(self, referencias):
+        """
+        Registra que os documentos das referências mudaram. Uma nova marcação
+        substitui a anterior e adia a atualização.
+
+        :param referencias: Iterável de referências.
+        """
+        referencias = sorted({referencia for referencia in referencias if referencia})
+        if not referencias:
+            return
+        agora = time.time()
+        self.qdrant_client.upsert(
+            collection_name=self.collection_name,
+            points=[
+                models.PointStruct(
+                    id=self.id_ponto(NIVEL_PENDENCIA, referencia),
+                    vector={},
+                    payload={
+                        "nivel": NIVEL_PENDENCIA,
+                        "referencia": referencia,
+                        "marcado_em": agora,
+                        "versao": uuid.uuid4().hex
+                    }
+                )
+                for referencia in referencias
+            ]
+        )
+
+    def atualizar_pendentes(self):
+        """
+        Atualiza os resumos das referências com pendência mais antiga que
+        RESUMO_ESPERA_SEGUNDOS. Uma referência com erro mantém a pendência e é
+        tentada de novo na próxima execução.
+
+        :return: Lista das referências atualizadas.
+        """
+        filtro = models.Filter(must=[
+            models.FieldCondition(key="nivel", match=models.MatchValue(value=NIVEL_PENDENCIA)),
+            models.FieldCondition(key="marcado_em", range=models.Range(lte=time.time() - self.espera)),
+        ])
+        pendencias = list(self._rolar(self.collection_name, filtro, True))
+
+        atualizadas = []
+        for pendencia in pendencias:
+            referencia = pendencia["referencia"]
+            try:
+                with metricas.INGESTAO_ETAPA_SEGUNDOS.labels("resumo").time():
+                    self.atualizar(referencia)
+                # Remove a pendência apenas se não houve nova marcação durante a atualização
+                self.qdrant_client.delete(
+                    collection_name=self.collection_name,
+                    points_selector=models.FilterSelector(filter=models.Filter(must=[
+                        models.FieldCondition(key="nivel", match=models.MatchValue(value=NIVEL_PENDENCIA)),
+                        models.FieldCondition(key="referencia", match=models.MatchValue(value=referencia)),
+                        models.FieldCondition(key="versao", match=models.MatchValue(value=pendencia["versao"])),
+                    ])),
+                    wait=True
+                )
+                atualizadas.append(referencia)
+            except Exception as e:
+                logger.error("Erro ao atualizar o resumo da referência %s: %s", referencia, e)
+        return atualizadas
+
+    def atualizar(self, referencia):
+        """
+        Recalcula os resumos alterados da referência a partir dos blocos
+        gravados na collection do RAG e remove os resumos de documentos
+        excluídos.
+        """
+        existentes = {}
+        for payload in self._rolar(self.collection_name, self._filtro_referencia("referencia", referencia), True):
+            if payload.get("nivel") != NIVEL_PENDENCIA:
+                existentes[self.id_ponto(payload["nivel"], referencia, payload.get("chave", ""))] = payload
+        parciais = {
+            payload["chave"]: payload["resumo"]
+            for payload in existentes.values() if payload["nivel"] == NIVEL_PARCIAL
+        }
+
+        impressoes = self._impressoes_documentos(referencia)
+        novos = {}
+        resumos_documentos = {}
+        for documento, impressao in sorted(impressoes.items()):
+            id_documento = self.id_ponto(NIVEL_DOCUMENTO, referencia, documento)
+            atual = existentes.get(id_documento)
+            if atual and atual.get("impressao") == impressao:
+                metricas.RESUMOS_NOS.labels(NIVEL_DOCUMENTO, "reutilizado").inc()
+                resumos_documentos[documento] = atual
+                continue
+
+            textos = self._textos_documento(referencia, documento)
+            prompt = PROMPT_DOCUMENTO.replace("{documento}", documento).replace("{referencia}", referencia)
+            resumo, usados = self._reduzir(referencia, textos, prompt, parciais, novos)
+            resumos_documentos[documento] = novos[id_documento] = {
+                "nivel": NIVEL_DOCUMENTO, "referencia": referencia, "chave": documento,
+                "impressao": impressao, "resumo": resumo, "parciais": usados, "atualizado_em": time.time()
+            }
+            metricas.RESUMOS_NOS.labels(NIVEL_DOCUMENTO, "gerado").inc()
+            logger.info("Resumo do documento %s da referência %s atualizado.", documento, referencia)
+
+        id_referencia = self.id_ponto(NIVEL_REFERENCIA, referencia)
+        if resumos_documentos:
+            impressao = self._hash(*(f"{d}\0{r['impressao']}" for d, r in sorted(resumos_documentos.items())))
+            atual = existentes.get(id_referencia)
+            if atual and atual.get("impressao") == impressao:
+                metricas.RESUMOS_NOS.labels(NIVEL_REFERENCIA, "reutilizado").inc()
+                novos[id_referencia] = atual
+            else:
+                textos = [f"Documento {d}: {r['resumo']}" for d, r in sorted(resumos_documentos.items())]
+                resumo, usados = self._reduzir(
+                    referencia, textos, PROMPT_REFERENCIA.replace("{referencia}", referencia), parciais, novos
+                )
+                novos[id_referencia] = {
+                    "nivel": NIVEL_REFERENCIA, "referencia": referencia, "chave": "",
+                    "impressao": impressao, "resumo": resumo, "parciais": usados,
+                    "documentos": sorted(resumos_documentos), "atualizado_em": time.time()
+                }
+                metricas.RESUMOS_NOS.labels(NIVEL_REFERENCIA, "gerado").inc()
+
+        # Pontos ainda referenciados: documentos presentes, a referência e os parciais de ambos
+        validos = {id_referencia} if resumos_documentos else set()
+        validos.update(self.id_ponto(NIVEL_DOCUMENTO, referencia, documento) for documento in resumos_documentos)
+        for id_valido in list(validos):
+            payload = novos.get(id_valido) or existentes.get(id_valido)
+            validos.update(self.id_ponto(NIVEL_PARCIAL, referencia, chave) for chave in payload.get("parciais", []))
+
+        gravar = [
+            models.PointStruct(id=id_ponto, vector={}, payload=payload)
+            for id_ponto, payload in novos.items() if id_ponto in validos and payload is not existentes.get(id_ponto)
+        ]
+        if gravar:
+            self.qdrant_client.upsert(collection_name=self.collection_name, points=gravar, wait=True)
+        obsoletos = [id_ponto for id_ponto in existentes if id_ponto not in validos]
+        if obsoletos:
+            self.qdrant_client.delete(
+                collection_name=self.collection_name,
+                points_selector=models.PointIdsList(points=obsoletos),
+                wait=True
+            )
+        logger.info(
+            "Resumos da referência %s atualizados: %s documentos, %s pontos gravados, %s removidos.",
+            referencia, len(resumos_documentos), len(gravar), len(obsoletos)
+        )
+
+    def _reduzir(self, referencia, textos, prompt, parciais, novos):
+        """
+        Reduz os textos a um único resumo, em níveis: cada grupo que cabe em
+        RESUMO_MAX_TOKENS_ENTRADA é resumido em uma chamada ao LLM, até restar
+        um único grupo. Textos curtos são mantidos como estão.
+
+        :param parciais: {hash da entrada: resumo} dos resumos parciais gravados.
+        :param novos: {id do ponto: payload} dos pontos a gravar, completado com
+                      os resumos parciais gerados.
+        :return: Tupla (resumo, hashes dos resumos parciais usados).
+        """
+        usados = []
+        texto = "\n\n".join(textos)
+        if self.contar_tokens(texto) <= self.max_tokens_literal:
+            return texto, usados
+
+        orcamento = self.max_tokens_entrada - self.contar_tokens(prompt)
+        while True:
+            grupos = self._agrupar(textos, orcamento)
+            if len(grupos) == 1:
+                return self._resumir(prompt, grupos[0]), usados
+
+            textos = []
+            for grupo in grupos:
+                chave = self._hash(prompt, grupo)
+                if chave in parciais:
+                    metricas.RESUMOS_NOS.labels(NIVEL_PARCIAL, "reutilizado").inc()
+                else:
+                    parciais[chave] = self._resumir(prompt, grupo)
+                    novos[self.id_ponto(NIVEL_PARCIAL, referencia, chave)] = {
+                        "nivel": NIVEL_PARCIAL, "referencia": referencia, "chave": chave,
+                        "resumo": parciais[chave], "atualizado_em": time.time()
+                    }
+                    metricas.RESUMOS_NOS.labels(NIVEL_PARCIAL, "gerado").inc()
+                usados.append(chave)
+                textos.append(parciais[chave])
+
+    def _agrupar(self, textos, orcamento):
+        """
+        Junta os textos, em ordem, em grupos de até orcamento tokens. Um texto
+        maior que o orçamento é truncado.
+        """
+        grupos = []
+        atual = []
+        tokens_atual = 0
+        for texto in textos:
+            tokens = self.encoding.encode_ordinary(texto)
+            if len(tokens) > orcamento:
+                tokens = tokens[:orcamento]
+                texto = self.encoding.decode(tokens)
+            if atual and tokens_atual + len(tokens) > orcamento:
+                grupos.append("\n\n".join(atual))
+                atual, tokens_atual = [], 0
+            atual.append(texto)
+            tokens_atual += len(tokens)
+        if atual:
+            grupos.append("\n\n".join(atual))
+        return grupos
+
+    def _resumir(self, prompt, texto):
+        prompt = prompt.replace("{texto}", texto)
+        if self.agendador is None:
+            resposta = self.llm.invoke(prompt)
+        else:
+            tokens = self.contar_tokens(prompt) + (self.llm.max_tokens or self.agendador.tokens_resposta)
+            resposta = self.agendador.executar(lambda: self.llm.invoke(prompt), tokens, PRIORIDADE_INGESTAO)
+        uso = resposta.usage_metadata or {}
+        metricas.RESUMOS_TOKENS.labels("prompt").inc(uso.get("input_tokens") or 0)
+        metricas.RESUMOS_TOKENS.labels("resposta").inc(uso.get("output_tokens") or 0)
+        return resposta.content
+
+    @staticmethod
+    def _filtro_referencia(chave, referencia, documento=None):
+        condicoes = [models.FieldCondition(key=chave, match=models.MatchValue(value=referencia))]
+        if documento is not None:
+            condicoes.append(models.FieldCondition(key="metadata.documento", match=models.MatchValue(value=documento)))
+        return models.Filter(must=condicoes)
+
+    def _rolar(self, colecao, filtro, with_payload):
+        # Percorre todas as páginas do scroll, devolvendo o payload de cada ponto
+        offset = None
+        while True:
+            pontos, offset = self.qdrant_client.scroll(
+                collection_name=colecao,
+                scroll_filter=filtro,
+                limit=256,
+                offset=offset,
+                with_payload=with_payload,
+                with_vectors=False
+            )
+            for ponto in pontos:
+                yield ponto.payload or {}
+            if offset is None:
+                return
+
+    def _impressoes_documentos(self, referencia):
+        """
+        Impressão de cada documento da referência: hash dos hash_conteudo dos
+        seus blocos, na ordem dos blocos.
+        """
+        blocos = {}
+        campos = ["metadata.documento", "metadata.bloco_id", "metadata.hash_conteudo"]
+        for payload in self._rolar(self.colecao_blocos, self._filtro_referencia("metadata.referencia", referencia), campos):
+            metadata = payload.get("metadata") or {}
+            blocos.setdefault(metadata.get("documento"), []).append(
+                (metadata.get("bloco_id") or 0, metadata.get("hash_conteudo") or "")
+            )
+        return {
+            documento: self._hash(*(h for _, h in sorted(hashes)))
+            for documento, hashes in blocos.items() if documento
+        }
+
+    def _textos_documento(self, referencia, documento):
+        blocos = [
+            ((payload.get("metadata") or {}).get("bloco_id") or 0, payload.get("page_content", ""))
+            for payload in self._rolar(
+                self.colecao_blocos,
+                self._filtro_referencia("metadata.referencia", referencia, documento),
+                ["page_content", "metadata.bloco_id"]
+            )
+        ]
+        return [texto for _, texto in sorted(blocos)]